@@ -0,0 +1,93 @@
+"""Indexing pages/second of batch_encode_and_upsert_docs with fixed batch
+sizes against auto-tuned batch sizing.
+
+    python -m benchmarks.batch_size --pages 400 --batch-sizes 1 5 16
+
+The batch size auto mode settles on is logged by the run. A last run fails
+every batch larger than `--oom-above` pages with an out-of-memory error. The
+run exits with status 1 unless every run indexes every page and returns the
+same pages for the sample queries.
+"""
+
+import argparse
+import asyncio
+import pathlib
+import tempfile
+
+from benchmarks import common
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    common.add_model_args(parser)
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 5, 16])
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--oom-above", type=int, default=4)
+    args = parser.parse_args()
+
+    model, processor = common.load_vision_model(args.model, args.device)
+    pages = common.make_sample_pages(args.pages)
+    runs = [(f"fixed bs={size}", size, False) for size in args.batch_sizes]
+    runs.append((f"auto from bs={args.batch_sizes[0]}", args.batch_sizes[0], True))
+    runs.append((f"oom above bs={args.oom_above}", max(args.batch_sizes), False))
+    results = []
+    top_k: dict[str, list[list[str]]] = {}
+    oom_batches: list[int] = []
+    for name, batch_size, auto in runs:
+        with (
+            tempfile.TemporaryDirectory() as tmp_dir,
+            common.vision_store(
+                model,
+                processor,
+                pathlib.Path(tmp_dir),
+                "batch_size",
+                args.device,
+                db_settings={
+                    **common.NO_CACHE,
+                    "MAX_ENCODE_BATCH_SIZE": args.max_batch_size,
+                },
+            ) as store,
+        ):
+            if name.startswith("oom"):
+                encode_docs = store.encode_docs
+
+                def encode_docs_or_oom(batch, encode_docs=encode_docs):
+                    if len(batch) > args.oom_above:
+                        oom_batches.append(len(batch))
+                        raise MemoryError
+                    return encode_docs(batch)
+
+                store.encode_docs = encode_docs_or_oom
+            docs = common.make_docs(store, pages)
+            with common.Timer() as timer:
+                report = asyncio.run(
+                    store.batch_encode_and_upsert_docs(
+                        docs, batch_size, auto_batch_size=auto
+                    )
+                )
+            results.append((name, len(docs) / timer.elapsed))
+            common.check(
+                len(report.upserted_ids) == len(docs), f"{name} indexes every page"
+            )
+            top_k[name] = [
+                [result.metadata.image_key for result in store.query_db(query, k=5)]
+                for query in common.SAMPLE_QUERIES
+            ]
+    for name, rate in results:
+        print(f"{name:<20} {rate:8.2f} pages/s")
+    common.check(
+        max(args.batch_sizes) <= args.oom_above or bool(oom_batches),
+        f"batches over {args.oom_above} pages ran out of memory"
+        f" {len(oom_batches)} times and were split",
+    )
+    first, *others = top_k
+    for name in others:
+        common.check(
+            top_k[name] == top_k[first],
+            f"{name} returns the same pages as {first}",
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Time to load and index a collection with and without bulk-load mode, and
+time to ship the result as a snapshot and restore it.
+
+    python -m benchmarks.bulk_load --qdrant-url http://127.0.0.1:6333
+    python -m benchmarks.bulk_load --pages 2000 --batch-size 16
+
+Pages are encoded once into the embedding store and every run loads the
+same vectors from it, so the runs only differ in how Qdrant ingests and
+indexes them. Load is the time until every upsert returned, index the time
+from then until the collection is green. The snapshot of the bulk-loaded
+collection is restored under another name. The run exits with status 1
+unless every loaded and restored collection returns the same points as the
+one the pages were indexed into. Local mode Qdrant (the default without `--qdrant-url`)
+builds no HNSW index, so only a Qdrant server shows the difference in
+indexing. Point `--qdrant-url` at 127.0.0.1 rather than localhost, which
+selects local mode.
+"""
+
+import argparse
+import asyncio
+import pathlib
+import tempfile
+import time
+
+from benchmarks import common
+from michael_mauboussin_twin.transform import snapshots
+
+
+async def load(store, batch_size: int, bulk: bool) -> tuple[float, float]:
+    """Seconds to load the points and to finish indexing them."""
+    start = time.perf_counter()
+    if bulk:
+        async with store.bulk_load():
+            await store.load_from_embedding_store(batch_size)
+            loaded = time.perf_counter()
+    else:
+        await store.load_from_embedding_store(batch_size)
+        loaded = time.perf_counter()
+        await asyncio.to_thread(store.wait_until_indexed)
+    return loaded - start, time.perf_counter() - loaded
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    common.add_model_args(parser)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--queries", type=int, default=16)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--qdrant-url")
+    args = parser.parse_args()
+
+    db_settings = common.qdrant_db_settings(
+        args.qdrant_url,
+        "Local mode builds no index, so bulk loading only changes the upserts",
+    )
+    model, processor = common.load_vision_model(args.model, args.device)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = pathlib.Path(tmp_dir)
+
+        def open_store(name: str, collection_name: str | None = None):
+            # Local mode allows one client per storage folder.
+            return common.vision_store(
+                model,
+                processor,
+                tmp_path,
+                collection_name or f"bulk_load_{name}",
+                args.device,
+                db_settings={
+                    **db_settings,
+                    "QDRANT_DATABASE_PATH": str(tmp_path / f"db_{name}"),
+                },
+            )
+
+        with open_store("source") as source:
+            common.index_pages(
+                source, common.make_sample_pages(args.pages), args.batch_size
+            )
+            query_embs = source.encode_query_batch(
+                common.make_sample_queries(args.queries)
+            )
+            expected = common.search_ids(source, query_embs, args.k)
+
+        print(f"{'mode':<10} {'load s':>8} {'index s':>8} {'total s':>8}")
+        for name, bulk in [("upsert", False), ("bulk", True)]:
+            with open_store(name) as store:
+                load_time, index_time = asyncio.run(load(store, args.batch_size, bulk))
+                print(
+                    f"{name:<10} {load_time:>8.2f} {index_time:>8.2f}"
+                    f" {load_time + index_time:>8.2f}"
+                )
+                common.check(
+                    common.search_ids(store, query_embs, args.k) == expected,
+                    f"{name} load returns the same points as the indexed collection",
+                )
+                if bulk:
+                    with common.Timer() as timer:
+                        path = snapshots.create_snapshot(
+                            store.db_settings,
+                            store.qdrant_settings.collection_name,
+                            tmp_path / "snapshots",
+                        )
+                    print(
+                        f"snapshot   {timer.elapsed:>8.2f} s"
+                        f"  {path.stat().st_size / 2**20:.1f} MiB"
+                    )
+                    bulk_db_settings = store.db_settings
+
+        # A restore to local mode needs the path to itself, so it runs once
+        # the bulk store's client is closed.
+        with common.Timer() as timer:
+            snapshots.restore_snapshot(bulk_db_settings, "bulk_load_restored", path)
+        print(f"restore    {timer.elapsed:>8.2f} s")
+        with open_store("bulk", "bulk_load_restored") as restored:
+            common.check(
+                common.search_ids(restored, query_embs, args.k) == expected,
+                "the restored snapshot returns the same points",
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,638 @@
+import argparse
+import asyncio
+import contextlib
+import email.utils
+import hashlib
+import http.server
+import os
+import pathlib
+import random
+import string
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+import types
+from typing import TYPE_CHECKING, Any, Iterator
+
+import torch
+from PIL import Image, ImageDraw, ImageFont
+
+if TYPE_CHECKING:
+    import sentence_transformers
+
+    from michael_mauboussin_twin.transform import (
+        base,
+        datamodels,
+        settings,
+        text_db,
+        vision_db,
+    )
+
+PAGE_SIZE = (1275, 1650)
+
+# Caches would answer repeated queries without searching.
+NO_CACHE = {"QUERY_CACHE_SIZE": 0, "RESULT_CACHE_SIZE": 0}
+
+SAMPLE_QUERIES = [
+    "base rates and the outside view in forecasting",
+    "return on invested capital and competitive advantage",
+    "expectations investing and price-implied expectations",
+    "skill versus luck in investment results",
+    "capital allocation and share buybacks",
+    "market efficiency and the wisdom of crowds",
+    "mean reversion in corporate performance",
+    "noise bias and information in decision making",
+]
+
+
+def make_sample_pdfs(
+    output_dir: pathlib.Path,
+    num_pdfs: int = 4,
+    pages_per_pdf: int = 10,
+    seed: int = 0,
+) -> list[pathlib.Path]:
+    rng = random.Random(seed)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    pdf_paths: list[pathlib.Path] = []
+    for pdf_index in range(num_pdfs):
+        pages = [
+            _make_page(rng, f"Sample document {pdf_index} page {page_index}")
+            for page_index in range(pages_per_pdf)
+        ]
+        pdf_path = output_dir / f"sample_{pdf_index}.pdf"
+        pages[0].save(
+            pdf_path, "PDF", resolution=150, save_all=True, append_images=pages[1:]
+        )
+        pdf_paths.append(pdf_path)
+    return pdf_paths
+
+
+def make_sample_text_pdfs(
+    output_dir: pathlib.Path,
+    num_pdfs: int = 4,
+    pages_per_pdf: int = 10,
+    seed: int = 0,
+) -> list[pathlib.Path]:
+    """PDFs with a text layer of paragraphs of varying length."""
+    rng = random.Random(seed)
+    words = " ".join(SAMPLE_QUERIES).split()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    pdf_paths: list[pathlib.Path] = []
+    for pdf_index in range(num_pdfs):
+        pages = []
+        for _ in range(pages_per_pdf):
+            lines: list[str] = []
+            while len(lines) < 50:
+                paragraph = " ".join(rng.choices(words, k=rng.randint(4, 120)))
+                lines.extend(textwrap.wrap(paragraph, 90)[: 50 - len(lines)])
+                lines.append("")
+            pages.append(lines)
+        pdf_path = output_dir / f"sample_text_{pdf_index}.pdf"
+        _write_text_pdf(pdf_path, pages)
+        pdf_paths.append(pdf_path)
+    return pdf_paths
+
+
+def _write_text_pdf(path: pathlib.Path, pages: list[list[str]]) -> None:
+    objects: list[bytes] = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids: list[int] = []
+    for lines in pages:
+        text = "\n".join(f"({line}) Tj T*" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 72 760 Td\n{text}\nET".encode()
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        )
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792]"
+            b" /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % len(objects)
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets: list[int] = []
+    for object_id, obj in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (object_id, obj)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    path.write_bytes(pdf)
+
+
+def make_sample_queries(num_queries: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    words = " ".join(SAMPLE_QUERIES).split()
+    return [" ".join(rng.sample(words, rng.randint(3, 12))) for _ in range(num_queries)]
+
+
+def make_sample_pages(num_pages: int, seed: int = 0) -> list[Image.Image]:
+    rng = random.Random(seed)
+    return [_make_page(rng, f"Sample page {i}") for i in range(num_pages)]
+
+
+def make_sample_text_pages(num_pages: int, seed: int = 0) -> list[Image.Image]:
+    """Pages of body text in one layout, which differ only in their words."""
+    rng = random.Random(seed)
+    words = " ".join(SAMPLE_QUERIES).split()
+    font = ImageFont.load_default(size=18)
+    pages = []
+    for _ in range(num_pages):
+        page = Image.new("RGB", PAGE_SIZE, "white")
+        draw = ImageDraw.Draw(page)
+        for y in range(100, PAGE_SIZE[1] - 100, 26):
+            draw.text((100, y), " ".join(rng.choices(words, k=14)), "black", font)
+        pages.append(page)
+    return pages
+
+
+def _make_page(rng: random.Random, heading: str) -> Image.Image:
+    page = Image.new("RGB", PAGE_SIZE, "white")
+    draw = ImageDraw.Draw(page)
+    draw.text((100, 80), heading, fill="black")
+    y = 160
+    while y < PAGE_SIZE[1] - 120:
+        width = rng.randint(600, PAGE_SIZE[0] - 200)
+        draw.rectangle((100, y, 100 + width, y + 10), fill=(40, 40, 40))
+        y += rng.choice((24, 24, 24, 60))
+    if rng.random() < 0.5:
+        x0, y0 = rng.randint(100, 600), rng.randint(300, 1000)
+        draw.rectangle((x0, y0, x0 + 400, y0 + 300), outline="black", width=4)
+    return page
+
+
+class Timer:
+    def __init__(self) -> None:
+        self.elapsed = 0.0
+
+    def __enter__(self) -> "Timer":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.elapsed = time.perf_counter() - self._start
+
+
+def chunked(items: list, size: int) -> Iterator[list]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+class _PDFRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Static file handler with the ETag, Last-Modified and Range support the
+    extract stage's downloader relies on."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        path = pathlib.Path(self.translate_path(self.path))
+        if not path.is_file():
+            self.send_error(404)
+            return
+        data = path.read_bytes()
+        stat = path.stat()
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        start = 0
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if range_header and if_range in (None, etag, last_modified):
+            start = int(range_header.removeprefix("bytes=").split("-")[0])
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}"
+            )
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(len(data) - start))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+@contextlib.contextmanager
+def serve_directory(directory: pathlib.Path) -> Iterator[str]:
+    """Serve `directory` over HTTP on a free localhost port and yield its base
+    URL."""
+    handler = lambda *args: _PDFRequestHandler(*args, directory=str(directory))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def dir_size(path: pathlib.Path) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+class TensorBatch(dict):
+    def to(self, device: str | torch.device) -> "TensorBatch":
+        return TensorBatch({key: value.to(device) for key, value in self.items()})
+
+
+class TinyColProcessor:
+    """Stand-in for ColQwen2Processor: pages become a grid of 8x8 grayscale
+    patches and queries become hashed word ids, both left unembedded."""
+
+    patch_size = 8
+
+    def __init__(
+        self, grid: tuple[int, int] = (24, 32), vocab_size: int = 8192
+    ) -> None:
+        self.grid = grid
+        self.vocab_size = vocab_size
+        # Like ColQwen2Processor.image_processor, the most pixels kept.
+        self.image_processor = types.SimpleNamespace(
+            max_pixels=grid[0] * grid[1] * self.patch_size**2
+        )
+
+    def process_images(self, images: list[Image.Image]) -> TensorBatch:
+        width, height = self.grid[0] * self.patch_size, self.grid[1] * self.patch_size
+        pixels = torch.stack(
+            [
+                torch.frombuffer(
+                    bytearray(image.convert("L").resize((width, height)).tobytes()),
+                    dtype=torch.uint8,
+                )
+                for image in images
+            ]
+        ).float()
+        patches = (
+            pixels.view(len(images), self.grid[1], self.patch_size, width)
+            .unfold(3, self.patch_size, self.patch_size)
+            .permute(0, 1, 3, 2, 4)
+            .reshape(len(images), -1, self.patch_size * self.patch_size)
+        )
+        patches = 1 - patches / 255
+        return TensorBatch(
+            pixel_values=patches,
+            attention_mask=torch.ones(patches.shape[:2], dtype=torch.long),
+        )
+
+    def process_queries(self, queries: list[str]) -> TensorBatch:
+        token_ids = [
+            [
+                int.from_bytes(hashlib.md5(word.encode()).digest()[:4], "little")
+                % (self.vocab_size - 1)
+                + 1
+                for word in query.lower().split()
+            ]
+            or [1]
+            for query in queries
+        ]
+        length = max(len(ids) for ids in token_ids)
+        input_ids = torch.zeros(len(queries), length, dtype=torch.long)
+        attention_mask = torch.zeros(len(queries), length, dtype=torch.long)
+        for i, ids in enumerate(token_ids):
+            input_ids[i, length - len(ids) :] = torch.tensor(ids)
+            attention_mask[i, length - len(ids) :] = 1
+        return TensorBatch(input_ids=input_ids, attention_mask=attention_mask)
+
+
+class TinyColModel(torch.nn.Module):
+    """Stand-in for ColQwen2 returning L2-normalized multivectors with zeroed
+    padding, small enough to run the pipelines on CPU."""
+
+    def __init__(
+        self, dim: int = 128, vocab_size: int = 8192, patch_dim: int = 64
+    ) -> None:
+        super().__init__()
+        generator = torch.Generator().manual_seed(0)
+        self.patch_proj = torch.nn.Linear(patch_dim, dim)
+        self.token_emb = torch.nn.Embedding(vocab_size, dim)
+        with torch.no_grad():
+            self.patch_proj.weight.copy_(
+                torch.randn(dim, patch_dim, generator=generator)
+            )
+            self.patch_proj.bias.copy_(torch.randn(dim, generator=generator))
+            self.token_emb.weight.copy_(
+                torch.randn(vocab_size, dim, generator=generator)
+            )
+        self.dim = dim
+
+    @property
+    def device(self) -> torch.device:
+        return self.patch_proj.weight.device
+
+    def forward(
+        self,
+        attention_mask: torch.Tensor,
+        pixel_values: torch.Tensor | None = None,
+        input_ids: torch.Tensor | None = None,
+    ) -> torch.Tensor:
+        if pixel_values is not None:
+            embeddings = self.patch_proj(pixel_values)
+        else:
+            embeddings = self.token_emb(input_ids)
+        embeddings = torch.nn.functional.normalize(embeddings, dim=-1)
+        return embeddings * attention_mask.unsqueeze(-1)
+
+
+def load_vision_model(
+    model_name: str, device: str = "cpu"
+) -> tuple[torch.nn.Module, object]:
+    if model_name == "tiny":
+        return TinyColModel().eval(), TinyColProcessor()
+    from colpali_engine import models as colpali_model
+
+    model = (
+        colpali_model.ColQwen2.from_pretrained(model_name, torch_dtype=torch.bfloat16)
+        .to(device)
+        .eval()
+    )
+    return model, colpali_model.ColQwen2Processor.from_pretrained(model_name)
+
+
+def build_vision_store(
+    model: torch.nn.Module,
+    processor: object,
+    db_path: pathlib.Path,
+    collection_name: str,
+    device: str = "cpu",
+    db_settings: dict | None = None,
+    quantization: "settings.QuantizationProfile | None" = None,
+    **qdrant_settings: object,
+) -> "vision_db.VisionVectorStore":
+    from michael_mauboussin_twin.transform import settings, vision_db
+
+    probe = processor.process_queries(["probe"]).to(model.device)
+    with torch.no_grad():
+        vector_size = model(**probe).shape[-1]
+    vectors_config, quantization_config, optimizers_config = (
+        settings.get_default_multi_vector_config(
+            vector_size=vector_size,
+            quantization=quantization or settings.QuantizationProfile(),
+        )
+    )
+    if qdrant_settings.pop("prefetch", False):
+        qdrant_settings["prefetch_vector_params"] = (
+            settings.get_default_prefetch_vector_params(vector_size)
+        )
+    return vision_db.VisionVectorStore(
+        model=model,
+        processor=processor,
+        db_settings=settings.DBSettings(
+            VISION_EMBEDDING_MODEL_PARAMS=settings.VisionEmbeddingModel(),
+            **{
+                "RAG_MODEL_DEVICE": device,
+                "QDRANT_DATABASE_PATH": str(db_path / "db"),
+                "IMAGE_STORE_PATH": str(db_path / "images"),
+                "INDEX_MANIFEST_PATH": str(db_path / "manifest.sqlite"),
+                "EMBEDDING_STORE_PATH": str(db_path / "embeddings"),
+                **(db_settings or {}),
+            },
+        ),
+        qdrant_settings=settings.QdrantSettings(
+            collection_name=collection_name,
+            vector_params=vectors_config,
+            quantization_config=quantization_config,
+            optimizers_config=optimizers_config,
+            **qdrant_settings,
+        ),
+    )
+
+
+def load_text_model(
+    model_name: str, device: str = "cpu"
+) -> "sentence_transformers.SentenceTransformer":
+    import sentence_transformers
+
+    if model_name == "tiny":
+        return _make_tiny_text_model(device)
+    return sentence_transformers.SentenceTransformer(
+        model_name, device=device, trust_remote_code=True
+    )
+
+
+def _make_tiny_text_model(
+    device: str = "cpu", dim: int = 128
+) -> "sentence_transformers.SentenceTransformer":
+    """Randomly initialized two-layer BERT with a word-level vocabulary of the
+    sample queries, built offline, with the same query prompt as stella."""
+    import sentence_transformers
+    import transformers
+    from sentence_transformers import models as st_models
+
+    model_dir = pathlib.Path(tempfile.mkdtemp(prefix="tiny-text-model-"))
+    characters = list("abcdefghijklmnopqrstuvwxyz0123456789")
+    vocab = [
+        "[PAD]",
+        "[UNK]",
+        "[CLS]",
+        "[SEP]",
+        "[MASK]",
+        *string.punctuation,
+        *characters,
+        *(f"##{character}" for character in characters),
+        *sorted(set(" ".join(SAMPLE_QUERIES).lower().split())),
+    ]
+    (model_dir / "vocab.txt").write_text("\n".join(vocab))
+    transformers.BertTokenizerFast(str(model_dir / "vocab.txt")).save_pretrained(
+        model_dir
+    )
+    torch.manual_seed(0)
+    transformers.BertModel(
+        transformers.BertConfig(
+            vocab_size=len(vocab),
+            hidden_size=dim,
+            num_hidden_layers=2,
+            num_attention_heads=2,
+            intermediate_size=2 * dim,
+        )
+    ).save_pretrained(model_dir)
+    return sentence_transformers.SentenceTransformer(
+        modules=[
+            st_models.Transformer(str(model_dir)),
+            st_models.Pooling(dim, "mean"),
+        ],
+        device=device,
+        prompts={
+            "s2p_query": "Instruct: Given a web search query, retrieve relevant passages that answer the query.\nQuery: "
+        },
+    )
+
+
+def build_text_store(
+    model: "sentence_transformers.SentenceTransformer",
+    db_path: pathlib.Path,
+    collection_name: str,
+    device: str = "cpu",
+    db_settings: dict | None = None,
+    quantization: "settings.QuantizationProfile | None" = None,
+    **qdrant_settings: object,
+) -> "text_db.TextVectorDB":
+    from michael_mauboussin_twin.transform import settings, text_db
+
+    vectors_config, quantization_config, optimizers_config = (
+        settings.get_default_single_vector_config(
+            vector_size=model.get_sentence_embedding_dimension(),
+            quantization=quantization or settings.QuantizationProfile(),
+        )
+    )
+    return text_db.TextVectorDB(
+        model=model,
+        db_settings=settings.DBSettings(
+            TEXT_EMBEDDING_MODEL_PARAMS=settings.TextEmbeddingModel(),
+            **{
+                "RAG_MODEL_DEVICE": device,
+                "QDRANT_DATABASE_PATH": str(db_path / "db"),
+                "IMAGE_STORE_PATH": str(db_path / "images"),
+                "INDEX_MANIFEST_PATH": str(db_path / "manifest.sqlite"),
+                "EMBEDDING_STORE_PATH": str(db_path / "embeddings"),
+                **(db_settings or {}),
+            },
+        ),
+        qdrant_settings=settings.QdrantSettings(
+            collection_name=collection_name,
+            vector_params=vectors_config,
+            quantization_config=quantization_config,
+            optimizers_config=optimizers_config,
+            **qdrant_settings,
+        ),
+    )
+
+
+@contextlib.contextmanager
+def vision_store(
+    model: torch.nn.Module,
+    processor: object,
+    db_path: pathlib.Path,
+    collection_name: str,
+    device: str = "cpu",
+    **kwargs: Any,
+) -> Iterator["vision_db.VisionVectorStore"]:
+    """`build_vision_store` that closes the Qdrant client on exit, which
+    local mode needs before another client opens the same path."""
+    store = build_vision_store(
+        model, processor, db_path, collection_name, device, **kwargs
+    )
+    try:
+        yield store
+    finally:
+        store.qdrant_client.close()
+
+
+def index_pages(
+    store: "base.VectorStore", pages: list[Image.Image], batch_size: int = 10
+) -> "datamodels.UpsertReport":
+    docs = make_docs(store, pages)
+    report = asyncio.run(store.batch_encode_and_upsert_docs(docs, batch_size))
+    check(
+        len(report.upserted_ids) == len(docs) and not report.failed_points,
+        f"indexed {len(docs)} pages into {store.qdrant_settings.collection_name}",
+    )
+    return report
+
+
+def search_ids(
+    store: "vision_db.VisionVectorStore | text_db.TextVectorDB",
+    query_embs: list,
+    k: int,
+) -> list[list[str]]:
+    """Ids of the top `k` points of every query embedding."""
+    return [
+        [str(point.id) for point in points]
+        for points in store.search_batch(query_embs, k)
+    ]
+
+
+def add_model_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--model", default="tiny")
+    parser.add_argument("--device", default="cpu")
+
+
+def qdrant_db_settings(qdrant_url: str | None, local_mode_note: str) -> dict:
+    """Settings without caches for the Qdrant server at `qdrant_url`, or for
+    local mode, which builds no index, after printing `local_mode_note`."""
+    if qdrant_url:
+        return {**NO_CACHE, "QDRANT_CLOUD_URL": qdrant_url}
+    print(
+        f"{local_mode_note}; pass --qdrant-url to compare them on a Qdrant server",
+        file=sys.stderr,
+    )
+    return dict(NO_CACHE)
+
+
+def write_metadata(pdf_paths: list[pathlib.Path], path: pathlib.Path) -> pathlib.Path:
+    """Extraction metadata store of the sample PDFs."""
+    from michael_mauboussin_twin.feature.extract import datamodels, metadata_store
+
+    with metadata_store.MetadataStore(path) as store:
+        store.upsert(
+            datamodels.ExtractData(
+                url=f"https://example.com/{pdf_path.name}",
+                title=pdf_path.stem,
+                date="2024-01-01",
+                pdf_path=str(pdf_path),
+            )
+            for pdf_path in pdf_paths
+        )
+    return path
+
+
+def make_docs(
+    store: "base.VectorStore", pages: list[Image.Image]
+) -> list["datamodels.DocumentToVectorDB"]:
+    from michael_mauboussin_twin.transform import datamodels
+
+    return [
+        datamodels.DocumentToVectorDB(
+            doc=page,
+            metadata=datamodels.Metadata(
+                title=f"page {i}",
+                author=["benchmark"],
+                date="",
+                url="",
+                image_key=store.image_store.put_image(page),
+            ),
+        )
+        for i, page in enumerate(pages)
+    ]
+
+
+def check(passed: bool, description: str) -> None:
+    """Print a correctness check and exit with status 1 if it failed."""
+    print(f"{'ok' if passed else 'FAILED':<7} {description}")
+    if not passed:
+        sys.exit(1)
+
+
+def recall_at_k(found: list[str], expected: list[str]) -> float:
+    if not expected:
+        return 1.0
+    return len(set(found) & set(expected)) / len(expected)
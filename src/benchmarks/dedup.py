@@ -0,0 +1,172 @@
+"""Model calls saved by skipping blank pages and collapsing duplicate pages,
+the cost of fingerprinting a page, and Hamming index lookups against a
+linear scan.
+
+    python -m benchmarks.dedup --issues 40 --pages-per-issue 12
+    python -m benchmarks.dedup --index-sizes 1000 100000
+
+The corpus mimics the Consilient Observer: every issue ends with the same
+disclaimer page and some carry a blank separator page, and compilations
+repeat pages of earlier issues rendered at another resolution and
+recompressed as JPEG. Body text pages share one layout, the case where
+perceptual hashes alone would merge different pages. A false duplicate is a
+distinct page collapsed into another page's point. The run exits with
+status 1 if a blank page is kept, a distinct page is collapsed or a repeated
+page is missed, or if index lookups differ from the linear scan.
+"""
+
+import argparse
+import io
+import random
+import statistics
+from typing import Iterator
+
+from PIL import Image
+
+from benchmarks import common
+from michael_mauboussin_twin.transform import dedup, settings
+
+
+def rerender(page: Image.Image, scale: float) -> Image.Image:
+    """`page` at another resolution, saved as JPEG."""
+    resized = page.resize((round(page.width * scale), round(page.height * scale)))
+    buffered = io.BytesIO()
+    resized.save(buffered, format="JPEG", quality=75)
+    return Image.open(buffered)
+
+
+def iter_corpus(
+    num_issues: int, pages_per_issue: int, seed: int = 0
+) -> Iterator[tuple[Image.Image, int | None]]:
+    """Pages and the id of the distinct page each one shows, None for blank
+    pages. Pages are generated on the fly to keep memory flat."""
+    rng = random.Random(seed)
+    disclaimer = common.make_sample_pages(1, seed)[0]
+    blank = Image.new("RGB", common.PAGE_SIZE, "white")
+    for issue in range(num_issues):
+        pages = common.make_sample_text_pages(pages_per_issue, seed=seed + issue)
+        for i, page in enumerate(pages):
+            yield page, issue * pages_per_issue + i
+        if rng.random() < 0.3:
+            yield blank, None
+        yield disclaimer, -1
+    # A compilation of every fourth issue.
+    for issue in range(0, num_issues, 4):
+        pages = common.make_sample_text_pages(pages_per_issue, seed=seed + issue)
+        for i, page in enumerate(pages):
+            yield rerender(page, 1.5), issue * pages_per_issue + i
+
+
+def bench_corpus(args: argparse.Namespace) -> None:
+    fingerprint_time = 0.0
+    index = dedup.DuplicateIndex(args.max_distance)
+    shown: dict[str, int | None] = {}
+    seen: set[int | None] = set()
+    num_pages = blank = duplicates = false_duplicates = missed = 0
+    expected_blank = 0
+    for image, page_id in iter_corpus(args.issues, args.pages_per_issue):
+        with common.Timer() as timer:
+            page = dedup.fingerprint(image)
+        fingerprint_time += timer.elapsed
+        num_pages += 1
+        expected_blank += page_id is None
+        if dedup.is_blank(page, args.max_ink_coverage):
+            blank += 1
+            false_duplicates += page_id is not None
+            continue
+        point_id = index.find(page)
+        if point_id is not None:
+            duplicates += 1
+            false_duplicates += shown[point_id] != page_id
+            continue
+        missed += page_id in seen
+        seen.add(page_id)
+        index.add(page, str(num_pages))
+        shown[str(num_pages)] = page_id
+    print(
+        f"{num_pages} pages, fingerprinted at"
+        f" {fingerprint_time / num_pages * 1000:.1f} ms/page"
+    )
+    print(f"{'blank pages skipped':<24} {blank:>6}")
+    print(f"{'duplicate pages':<24} {duplicates:>6}")
+    print(
+        f"{'model calls saved':<24} {blank + duplicates:>6}"
+        f" ({(blank + duplicates) / num_pages:.1%})"
+    )
+    print(f"{'false duplicates':<24} {false_duplicates:>6}")
+    print(f"{'missed duplicates':<24} {missed:>6}")
+    common.check(blank == expected_blank, "every blank page is skipped")
+    common.check(false_duplicates == 0, "no distinct pages are collapsed")
+    common.check(missed == 0, "every repeated page is collapsed")
+
+
+def bench_index(args: argparse.Namespace) -> None:
+    rng = random.Random(0)
+    print(f"\n{'hashes':>8} {'index us':>9} {'scan us':>9} {'speedup':>8}")
+    for size in args.index_sizes:
+        hashes = [rng.getrandbits(dedup.HASH_BITS) for _ in range(size)]
+        index: dedup.HammingIndex[int] = dedup.HammingIndex(args.max_distance)
+        for i, hash_ in enumerate(hashes):
+            index.add(hash_, i)
+        # Half of the queries are near copies of stored hashes.
+        queries = [
+            (
+                hashes[rng.randrange(size)] ^ (1 << rng.randrange(dedup.HASH_BITS))
+                if i % 2
+                else rng.getrandbits(dedup.HASH_BITS)
+            )
+            for i in range(args.queries)
+        ]
+        index_times, scan_times = [], []
+        found_ids, expected_ids = [], []
+        for query in queries:
+            with common.Timer() as timer:
+                found = index.search(query)
+            index_times.append(timer.elapsed)
+            with common.Timer() as timer:
+                expected = [
+                    i
+                    for i, hash_ in enumerate(hashes)
+                    if dedup.hamming_distance(query, hash_) <= args.max_distance
+                ]
+            scan_times.append(timer.elapsed)
+            found_ids.append(sorted(i for i, _ in found))
+            expected_ids.append(expected)
+        index_us = statistics.mean(index_times) * 1e6
+        scan_us = statistics.mean(scan_times) * 1e6
+        print(f"{size:>8} {index_us:>9.1f} {scan_us:>9.1f} {scan_us / index_us:>7.0f}x")
+        common.check(
+            found_ids == expected_ids,
+            f"index lookups over {size} hashes match a linear scan",
+        )
+
+
+def main() -> None:
+    defaults = settings.DBSettings.model_fields
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--issues", type=int, default=40)
+    parser.add_argument("--pages-per-issue", type=int, default=12)
+    parser.add_argument(
+        "--max-distance",
+        type=int,
+        default=defaults["DUPLICATE_PAGE_MAX_DISTANCE"].default,
+    )
+    parser.add_argument(
+        "--max-ink-coverage",
+        type=float,
+        default=defaults["BLANK_PAGE_MAX_INK_COVERAGE"].default,
+    )
+    parser.add_argument(
+        "--index-sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000]
+    )
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    bench_corpus(args)
+    bench_index(args)
+
+
+if __name__ == "__main__":
+    main()
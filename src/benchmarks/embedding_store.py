@@ -0,0 +1,72 @@
+"""Pages/second of indexing with a cold embedding store, re-indexing the same
+pages into a new collection with the store warm, and bulk-loading a third
+collection straight from the store.
+
+    python -m benchmarks.embedding_store --pages 300
+
+The run exits with status 1 if the warm runs encode any page or return other
+pages than the cold one.
+"""
+
+import argparse
+import asyncio
+import pathlib
+import tempfile
+
+from benchmarks import common
+from michael_mauboussin_twin import metrics
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    common.add_model_args(parser)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    metrics.enable()
+    model, processor = common.load_vision_model(args.model, args.device)
+    pages = common.make_sample_pages(args.pages)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = pathlib.Path(tmp_dir)
+        docs = None
+        expected = None
+        for name in ("cold store", "warm store", "bulk load"):
+            metrics.reset()
+            with common.vision_store(
+                model,
+                processor,
+                tmp_path,
+                name.replace(" ", "_"),
+                args.device,
+                db_settings=common.NO_CACHE,
+            ) as store:
+                docs = docs or common.make_docs(store, pages)
+                with common.Timer() as timer:
+                    if name == "bulk load":
+                        asyncio.run(store.load_from_embedding_store(args.batch_size))
+                    else:
+                        asyncio.run(
+                            store.batch_encode_and_upsert_docs(docs, args.batch_size)
+                        )
+                print(f"{name:<12} {len(docs) / timer.elapsed:8.2f} pages/s")
+                top_k = [
+                    [result.metadata.image_key for result in store.query_db(query)]
+                    for query in common.SAMPLE_QUERIES
+                ]
+            if expected is None:
+                expected = top_k
+                continue
+            encoded = metrics.snapshot()["counters"].get("index.encoded_pages", 0)
+            common.check(
+                encoded == 0 and top_k == expected,
+                f"{name} encodes no page and returns the same pages",
+            )
+        print(
+            f"embedding store size: "
+            f"{common.dir_size(tmp_path / 'embeddings') / 2**20:.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
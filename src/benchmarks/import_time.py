@@ -0,0 +1,119 @@
+"""Import-time budget for the modules light commands load.
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --top 10
+
+Each module is imported in a fresh interpreter under `python -X importtime`.
+The run exits with status 1 if a module's cumulative import time, the median
+over `--repeats` runs, exceeds its budget, or if importing it pulls in a
+library that only the indexing and query commands should load.
+"""
+
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+from typing import NamedTuple
+
+HEAVY_MODULES = ("torch", "transformers", "colpali_engine", "sentence_transformers")
+
+
+class Budget(NamedTuple):
+    module: str
+    seconds: float
+    forbidden: tuple[str, ...]
+
+
+BUDGETS = [
+    Budget(
+        "michael_mauboussin_twin.cli",
+        0.25,
+        (*HEAVY_MODULES, "zenml", "selenium", "qdrant_client", "pydantic"),
+    ),
+    Budget("michael_mauboussin_twin.metrics", 0.3, (*HEAVY_MODULES, "zenml")),
+    Budget(
+        "michael_mauboussin_twin.transform.settings", 2.0, (*HEAVY_MODULES, "zenml")
+    ),
+    Budget(
+        "michael_mauboussin_twin.transform.datamodels", 2.5, (*HEAVY_MODULES, "zenml")
+    ),
+    Budget(
+        "michael_mauboussin_twin.feature.extract.metadata_store",
+        0.5,
+        (*HEAVY_MODULES, "zenml", "selenium"),
+    ),
+    Budget(
+        "michael_mauboussin_twin.feature.extract.download",
+        1.0,
+        (*HEAVY_MODULES, "zenml", "selenium"),
+    ),
+]
+
+IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+START_MARKER = "-- start --"
+
+
+def import_times(module: str, forbidden: tuple[str, ...]) -> tuple[dict, list[str]]:
+    """Cumulative import time in seconds of every module loaded by importing
+    `module`, and which of `forbidden` were loaded."""
+    code = (
+        f"import sys; sys.stderr.write({START_MARKER!r} + '\\n'); import {module}; "
+        f"print(','.join(m for m in {forbidden!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    cumulative = {}
+    lines = result.stderr.splitlines()
+    for line in lines[lines.index(START_MARKER) + 1 :]:
+        if match := IMPORT_TIME.match(line):
+            cumulative[match[4]] = int(match[2]) / 1e6
+    loaded = [name for name in result.stdout.strip().split(",") if name]
+    return cumulative, loaded
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--top", type=int, default=0, help="show the slowest imports of each module"
+    )
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'module':<56} {'seconds':>8} {'budget':>7}")
+    for budget in BUDGETS:
+        runs = [
+            import_times(budget.module, budget.forbidden) for _ in range(args.repeats)
+        ]
+        seconds = statistics.median(cumulative[budget.module] for cumulative, _ in runs)
+        loaded = runs[0][1]
+        over = seconds > budget.seconds
+        print(
+            f"{budget.module:<56} {seconds:>8.3f} {budget.seconds:>7.2f}"
+            f"{'  OVER BUDGET' if over else ''}"
+        )
+        if over:
+            failures.append(f"{budget.module} took {seconds:.3f}s")
+        if loaded:
+            failures.append(f"{budget.module} imported {', '.join(loaded)}")
+        if args.top:
+            cumulative = runs[0][0]
+            del cumulative[budget.module]
+            for name, value in sorted(cumulative.items(), key=lambda item: -item[1])[
+                : args.top
+            ]:
+                print(f"    {name:<52} {value:>8.3f}")
+    if failures:
+        print("\n".join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Index size, query latency and recall@k of pooled ColQwen2 multivectors
+against the unpooled baseline on a small local collection.
+
+    python -m benchmarks.pooling --pages 200 --pool-factors 1 2 3 --model tiny
+    python -m benchmarks.pooling --pdf-dir data/ --model vidore/colqwen2-v1.0
+
+Recall@k is the overlap between each configuration's top-k pages and the
+pool factor 1 top-k pages for the same query. The run exits with status 1
+if pooling does not shrink the vectors or recall drops below `--min-recall`.
+"""
+
+import argparse
+import asyncio
+import pathlib
+import statistics
+import tempfile
+
+from benchmarks import common
+from michael_mauboussin_twin.transform import rasterize
+
+
+async def load_pages(
+    pdf_dir: pathlib.Path | None, num_pages: int, image_store_root: pathlib.Path
+) -> list:
+    if pdf_dir is None:
+        return common.make_sample_pages(num_pages)
+    pages = []
+    async for _, rendered in rasterize.rasterize_pdfs(
+        sorted(pdf_dir.glob("*.pdf")), image_store_root
+    ):
+        pages.extend(page.image for page in rendered)
+    return pages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    common.add_model_args(parser)
+    parser.add_argument("--pdf-dir", type=pathlib.Path)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--pool-factors", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument(
+        "--pooling-method",
+        choices=["hierarchical", "sequential"],
+        default="hierarchical",
+    )
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--min-recall", type=float, default=0.6)
+    args = parser.parse_args()
+
+    model, processor = common.load_vision_model(args.model, args.device)
+    pool_factors = sorted(set(args.pool_factors) | {1})
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pages = asyncio.run(
+            load_pages(args.pdf_dir, args.pages, pathlib.Path(tmp_dir) / "images")
+        )
+        baseline: dict[str, list[str]] = {}
+        for pool_factor in pool_factors:
+            db_path = pathlib.Path(tmp_dir) / f"pool{pool_factor}"
+            with common.vision_store(
+                model,
+                processor,
+                db_path,
+                f"pool{pool_factor}",
+                args.device,
+                pool_factor=pool_factor,
+                pooling_method=args.pooling_method,
+            ) as store:
+                common.index_pages(store, pages, args.batch_size)
+                points, _ = store.qdrant_client.scroll(
+                    store.qdrant_settings.collection_name,
+                    limit=len(pages),
+                    with_vectors=True,
+                )
+                num_vectors = statistics.mean(len(point.vector) for point in points)
+                latencies, recalls = [], []
+                for query in common.SAMPLE_QUERIES:
+                    with common.Timer() as timer:
+                        results = store.query_db(query, k=args.k)
+                    latencies.append(timer.elapsed * 1000)
+                    keys = [result.metadata.image_key for result in results]
+                    if pool_factor == 1:
+                        baseline[query] = keys
+                    recalls.append(common.recall_at_k(keys, baseline[query]))
+            rows.append(
+                (
+                    pool_factor,
+                    num_vectors,
+                    common.dir_size(db_path / "db") / 2**20,
+                    statistics.median(latencies),
+                    statistics.mean(recalls),
+                )
+            )
+
+    print(
+        f"{'pool factor':>11} {'vectors/page':>12} {'index MB':>9} "
+        f"{'p50 ms':>7} {f'recall@{args.k}':>9}"
+    )
+    for pool_factor, num_vectors, index_mb, latency, recall in rows:
+        print(
+            f"{pool_factor:>11} {num_vectors:>12.1f} {index_mb:>9.2f} "
+            f"{latency:>7.2f} {recall:>9.3f}"
+        )
+    unpooled = rows[0][1]
+    for pool_factor, num_vectors, _, _, recall in rows[1:]:
+        common.check(
+            num_vectors <= unpooled / pool_factor + 1,
+            f"pool factor {pool_factor} keeps at most 1/{pool_factor} of the vectors",
+        )
+        common.check(
+            recall >= args.min_recall,
+            f"pool factor {pool_factor} keeps recall@{args.k} >= {args.min_recall}",
+        )
+
+
+if __name__ == "__main__":
+    main()
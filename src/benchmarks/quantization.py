@@ -0,0 +1,155 @@
+"""Memory and disk footprint, query latency and recall@k of every
+quantization profile, against exact search without quantization.
+
+    python -m benchmarks.quantization --qdrant-url http://127.0.0.1:6333
+    python -m benchmarks.quantization --profiles int8 binary-disk --oversampling 1 2 4
+
+Pages are encoded once into the embedding store and every profile's
+collection is loaded from it, so all collections hold the same vectors.
+Footprints are estimated from the number of stored vectors the way Qdrant
+sizes them, without the HNSW graph and payloads. The run exits with status 1
+if a profile misses points or its recall at the largest oversampling is
+below `--min-recall`. Local mode Qdrant (the default without `--qdrant-url`)
+ignores quantization and HNSW and always searches exactly, so only a Qdrant
+server shows the trade-offs. Point `--qdrant-url` at 127.0.0.1 rather than
+localhost, which selects local mode.
+"""
+
+import argparse
+import asyncio
+import math
+import pathlib
+import statistics
+import tempfile
+
+from benchmarks import common
+from michael_mauboussin_twin.transform import settings
+
+BYTES_PER_DIM = {"int8": 1.0, "binary": 1 / 8, "none": 0.0}
+
+
+def footprint(
+    profile: settings.QuantizationProfile, num_rows: int, dim: int
+) -> tuple[float, float]:
+    """Estimated (RAM, disk) bytes of `num_rows` vectors of size `dim`."""
+    original = num_rows * dim * 4
+    if profile.name == "product":
+        quantized = num_rows * dim * 4 / int(profile.compression.value[1:])
+    elif profile.name == "binary":
+        quantized = num_rows * math.ceil(dim / 8)
+    else:
+        quantized = num_rows * dim * BYTES_PER_DIM[profile.name]
+    ram = (0 if profile.on_disk else original) + (
+        quantized if profile.always_ram else 0
+    )
+    return ram, original + quantized
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    common.add_model_args(parser)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument(
+        "--profiles", nargs="+", default=list(settings.QUANTIZATION_PROFILES)
+    )
+    parser.add_argument("--oversampling", type=float, nargs="+", default=[1.0, 3.0])
+    parser.add_argument("--hnsw-ef", type=int, default=128)
+    parser.add_argument("--min-recall", type=float, default=0.8)
+    parser.add_argument("--qdrant-url")
+    args = parser.parse_args()
+
+    db_settings = common.qdrant_db_settings(
+        args.qdrant_url,
+        "Local mode ignores quantization and HNSW, so every profile searches exactly",
+    )
+    model, processor = common.load_vision_model(args.model, args.device)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = pathlib.Path(tmp_dir)
+        with common.vision_store(
+            model,
+            processor,
+            tmp_path,
+            "quantization_exact",
+            args.device,
+            db_settings=db_settings,
+            quantization=settings.QUANTIZATION_PROFILES["none"],
+            exact=True,
+        ) as baseline:
+            common.index_pages(baseline, common.make_sample_pages(args.pages))
+            query_embs = baseline.encode_query_batch(
+                common.make_sample_queries(args.queries)
+            )
+            num_rows, dim = 0, 0
+            for stored_points in baseline.embedding_store.iter_points(
+                baseline.model_name, baseline.qdrant_settings.embedding_settings_hash()
+            ):
+                for _, _, vectors in stored_points:
+                    vector = next(iter(vectors.values()))
+                    num_rows += vector.shape[0] if vector.ndim == 2 else 1
+                    dim = vector.shape[-1]
+            exact = common.search_ids(baseline, query_embs, args.k)
+
+        print(
+            f"{'profile':<14} {'oversample':>10} {'RAM MiB':>8} {'disk MiB':>8}"
+            f" {'p50 ms':>7} {'p95 ms':>7} {f'recall@{args.k}':>9}"
+        )
+        for name in args.profiles:
+            profile = settings.QUANTIZATION_PROFILES[name]
+            with common.vision_store(
+                model,
+                processor,
+                tmp_path,
+                f"quantization_{name}",
+                args.device,
+                # Local mode allows one client per storage folder.
+                db_settings={
+                    **db_settings,
+                    "QDRANT_DATABASE_PATH": str(tmp_path / f"db_{name}"),
+                },
+                quantization=profile,
+                hnsw_ef=args.hnsw_ef,
+            ) as store:
+                asyncio.run(store.load_from_embedding_store())
+                store.wait_until_indexed(600)
+                common.check(
+                    store.qdrant_client.count(
+                        store.qdrant_settings.collection_name
+                    ).count
+                    == args.pages,
+                    f"{name} holds every page",
+                )
+                ram, disk = footprint(profile, num_rows, dim)
+                for oversampling in (
+                    args.oversampling if profile.name != "none" else [1.0]
+                ):
+                    store.qdrant_settings = store.qdrant_settings.model_copy(
+                        update={"oversampling": oversampling}
+                    )
+                    latencies, recalls = [], []
+                    for query_emb, expected in zip(query_embs, exact, strict=True):
+                        with common.Timer() as timer:
+                            points = store.search(query_emb, args.k)
+                        latencies.append(timer.elapsed * 1000)
+                        recalls.append(
+                            common.recall_at_k(
+                                [str(point.id) for point in points], expected
+                            )
+                        )
+                    cuts = statistics.quantiles(latencies, n=20)
+                    print(
+                        f"{name:<14} {oversampling:>10.1f} {ram / 2**20:>8.2f}"
+                        f" {disk / 2**20:>8.2f} {cuts[9]:>7.2f} {cuts[18]:>7.2f}"
+                        f" {statistics.mean(recalls):>9.3f}"
+                    )
+                common.check(
+                    statistics.mean(recalls) >= args.min_recall,
+                    f"{name} keeps recall@{args.k} >= {args.min_recall}",
+                )
+
+
+if __name__ == "__main__":
+    main()
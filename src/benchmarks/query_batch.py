@@ -0,0 +1,63 @@
+"""Queries/second of VisionVectorStore.query_db_batch against calling
+query_db once per query, with the query and result caches disabled.
+
+    python -m benchmarks.query_batch --queries 256 --batch-sizes 8 32 64
+
+The run exits with status 1 if a batch returns other pages than the loop.
+"""
+
+import argparse
+import pathlib
+import tempfile
+
+from benchmarks import common
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    common.add_model_args(parser)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=256)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 32, 64])
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    model, processor = common.load_vision_model(args.model, args.device)
+    queries = common.make_sample_queries(args.queries)
+    with (
+        tempfile.TemporaryDirectory() as tmp_dir,
+        common.vision_store(
+            model,
+            processor,
+            pathlib.Path(tmp_dir),
+            "query_batch",
+            args.device,
+            db_settings=common.NO_CACHE,
+        ) as store,
+    ):
+        common.index_pages(store, common.make_sample_pages(args.pages))
+
+        with common.Timer() as timer:
+            expected = [store.query_db(query, k=args.k) for query in queries]
+        baseline = len(queries) / timer.elapsed
+        print(f"{'query_db loop':<28} {baseline:8.2f} queries/s")
+        for batch_size in args.batch_sizes:
+            with common.Timer() as timer:
+                results = store.query_db_batch(queries, k=args.k, batch_size=batch_size)
+            rate = len(queries) / timer.elapsed
+            print(
+                f"{f'query_db_batch size={batch_size}':<28} {rate:8.2f} queries/s"
+                f"  ({rate / baseline:.2f}x)"
+            )
+            common.check(
+                all(
+                    [r.metadata.image_key for r in got]
+                    == [r.metadata.image_key for r in want]
+                    for got, want in zip(results, expected, strict=True)
+                ),
+                f"batches of {batch_size} return the same pages as the loop",
+            )
+
+
+if __name__ == "__main__":
+    main()
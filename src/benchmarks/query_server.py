@@ -0,0 +1,158 @@
+"""Load test of the query server: throughput and tail latency of
+micro-batched query encoding against serving one query at a time.
+
+    python -m benchmarks.query_server --requests 512 --concurrency 32
+
+The server runs in-process under uvicorn on a free local port, with the tiny
+stand-in model on CPU and the query and result caches disabled. Each run
+sends `--requests` distinct queries from `--concurrency` concurrent clients.
+
+The tiny model encodes a query in under a millisecond, while a ColQwen2
+forward pass on a GPU costs tens of milliseconds almost regardless of batch
+size, which is what micro-batching amortizes. `--forward-ms` adds that fixed
+cost to every forward pass. Local mode Qdrant scores multivectors by brute
+force in Python, so the collection is kept small to keep search from
+dominating. The run exits with status 1 if a request fails or micro-batching
+does not group queries.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import pathlib
+import statistics
+import tempfile
+import threading
+import time
+from typing import Iterator
+
+import fastapi
+import httpx
+import uvicorn
+
+from benchmarks import common
+from michael_mauboussin_twin import metrics
+from michael_mauboussin_twin.serve import app
+
+
+@contextlib.contextmanager
+def run_server(server_app: fastapi.FastAPI) -> Iterator[str]:
+    server = uvicorn.Server(
+        uvicorn.Config(server_app, host="127.0.0.1", port=0, log_level="warning")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+async def send_load(
+    base_url: str, queries: list[str], concurrency: int, k: int
+) -> tuple[list[float], int, float]:
+    """Latencies in ms of the successful requests, number of rejected
+    requests and the wall time in seconds."""
+    pending = iter(queries)
+    latencies: list[float] = []
+    rejected = 0
+
+    async def client_loop(client: httpx.AsyncClient) -> None:
+        nonlocal rejected
+        for query in pending:
+            start = time.perf_counter()
+            response = await client.post("/query", json={"query": query, "k": k})
+            if response.status_code == 503:
+                rejected += 1
+                continue
+            response.raise_for_status()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    async with httpx.AsyncClient(
+        base_url=base_url,
+        limits=httpx.Limits(max_connections=concurrency),
+        timeout=60,
+    ) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, rejected, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    common.add_model_args(parser)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=512)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--max-queue-size", type=int, default=256)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--forward-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    metrics.enable()
+    model, processor = common.load_vision_model(args.model, args.device)
+    with (
+        tempfile.TemporaryDirectory() as tmp_dir,
+        common.vision_store(
+            model,
+            processor,
+            pathlib.Path(tmp_dir),
+            "query_server",
+            args.device,
+            db_settings=common.NO_CACHE,
+        ) as store,
+    ):
+        common.index_pages(store, common.make_sample_pages(args.pages))
+        encode_queries = store.encode_queries
+
+        def encode_queries_with_forward_cost(queries: list[str]):
+            time.sleep(args.forward_ms / 1000)
+            return encode_queries(queries)
+
+        store.encode_queries = encode_queries_with_forward_cost
+
+        print(
+            f"{'mode':<16} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+            f" {'batch':>6} {'503s':>5}"
+        )
+        for name, max_batch_size, max_wait in (
+            ("one at a time", 1, 0.0),
+            ("micro-batched", args.max_batch_size, args.max_wait_ms / 1000),
+        ):
+            metrics.reset()
+            server_app = app.create_app(
+                store, max_batch_size, max_wait, args.max_queue_size
+            )
+            queries = common.make_sample_queries(args.requests, seed=max_batch_size)
+            with run_server(server_app) as base_url:
+                latencies, rejected, elapsed = asyncio.run(
+                    send_load(base_url, queries, args.concurrency, args.k)
+                )
+            counters = metrics.snapshot()["counters"]
+            batch = counters["serve.batched_items"] / counters["serve.batches"]
+            cuts = statistics.quantiles(latencies, n=100)
+            print(
+                f"{name:<16} {len(latencies) / elapsed:>8.1f} {cuts[49]:>8.1f}"
+                f" {cuts[94]:>8.1f} {cuts[98]:>8.1f} {batch:>6.1f} {rejected:>5}"
+            )
+            # The queue only fills up with more clients than it holds.
+            common.check(
+                len(latencies) == args.requests
+                or args.concurrency > args.max_queue_size,
+                f"{name}: every request is answered",
+            )
+            if max_batch_size > 1 and args.concurrency > 1:
+                common.check(batch > 1, f"{name}: queries are encoded together")
+
+
+if __name__ == "__main__":
+    main()
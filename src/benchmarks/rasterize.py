@@ -0,0 +1,81 @@
+"""Pages/second of the serial convert_from_bytes path versus the process-pool
+rasterizer used by VectorStore.stream_from_pdfs.
+
+    python -m benchmarks.rasterize --pdfs 8 --pages 20 --workers 1 4 8
+"""
+
+import argparse
+import asyncio
+import os
+import pathlib
+import tempfile
+
+import pdf2image
+
+from benchmarks import common
+from michael_mauboussin_twin.transform import rasterize
+
+
+def serial_baseline(pdf_paths: list[pathlib.Path]) -> int:
+    num_pages = 0
+    for pdf_path in pdf_paths:
+        for page in pdf2image.convert_from_bytes(pdf_path.read_bytes()):
+            rasterize.image_to_base64(page)
+            num_pages += 1
+    return num_pages
+
+
+async def pooled(
+    pdf_paths: list[pathlib.Path],
+    image_store_root: pathlib.Path,
+    num_workers: int,
+    max_pages_in_flight: int,
+) -> int:
+    num_pages = 0
+    async for _, pages in rasterize.rasterize_pdfs(
+        pdf_paths,
+        image_store_root,
+        max_pages_in_flight=max_pages_in_flight,
+        num_workers=num_workers,
+    ):
+        num_pages += len(pages)
+    return num_pages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pdfs", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, os.cpu_count() or 1]
+    )
+    parser.add_argument("--max-pages-in-flight", type=int, default=32)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_paths = common.make_sample_pdfs(
+            pathlib.Path(tmp_dir), num_pdfs=args.pdfs, pages_per_pdf=args.pages
+        )
+        with common.Timer() as timer:
+            num_pages = serial_baseline(pdf_paths)
+        baseline = num_pages / timer.elapsed
+        print(f"{'serial convert_from_bytes':<28} {baseline:8.2f} pages/s")
+        for num_workers in args.workers:
+            with common.Timer() as timer:
+                num_pages = asyncio.run(
+                    pooled(
+                        pdf_paths,
+                        pathlib.Path(tmp_dir) / f"images-{num_workers}",
+                        num_workers,
+                        args.max_pages_in_flight,
+                    )
+                )
+            rate = num_pages / timer.elapsed
+            print(
+                f"{f'rasterize_pdfs workers={num_workers}':<28} {rate:8.2f} pages/s"
+                f"  ({rate / baseline:.2f}x)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Render time, memory, preview size and retrieval quality of rendering pages
+at the processor's input resolution against pdf2image's 200 DPI default.
+
+    python -m benchmarks.render --pdfs 4 --pages 10
+    python -m benchmarks.render --model vidore/colqwen2-v1.0 --device cuda:0
+
+Every configuration renders the same sample PDFs with one worker, at 200
+DPI or at a multiple of the DPI that fills the processor's input. Decoded
+MiB is the largest window of decoded page images held in memory at once and
+preview KiB the stored full page image per page. Pages are encoded as they
+are rendered, and retrieval quality is the recall@k of the pages the
+200 DPI PNG renders rank first for each sample query, scored by MaxSim, plus
+the mean cosine similarity of each page's mean-pooled embedding to its
+200 DPI one. The tiny stand-in model downscales every page to 192x256, so
+only a real model such as ColQwen2 shows quality differences. The run exits
+with status 1 if a configuration drops pages, decodes more than the 200 DPI
+render, or if its recall@k is below `--min-recall` at the default
+oversampling or more.
+"""
+
+import argparse
+import asyncio
+import pathlib
+import statistics
+import tempfile
+
+import torch
+
+from benchmarks import common
+from michael_mauboussin_twin.transform import base, rasterize
+
+
+def encode_pages(model, processor, images) -> list[torch.Tensor]:
+    batch = processor.process_images(images).to(model.device)
+    with torch.no_grad():
+        embeddings = model(**batch).float().cpu()
+    mask = batch["attention_mask"].bool().cpu()
+    return [embedding[keep] for embedding, keep in zip(embeddings, mask)]
+
+
+def maxsim(query: torch.Tensor, pages: list[torch.Tensor]) -> list[float]:
+    return [float((query @ page.T).max(dim=1).values.sum()) for page in pages]
+
+
+async def render_and_encode(
+    pdf_paths: list[pathlib.Path],
+    image_store_root: pathlib.Path,
+    options: rasterize.RenderOptions,
+    model,
+    processor,
+    max_pages_in_flight: int,
+) -> tuple[list[torch.Tensor], float, int, list[int]]:
+    """Page embeddings, render seconds, peak decoded bytes and DPIs used."""
+    embeddings: list[torch.Tensor] = []
+    render_time, peak_bytes, dpis = 0.0, 0, []
+    pages = rasterize.rasterize_pdfs(
+        pdf_paths,
+        image_store_root,
+        max_pages_in_flight=max_pages_in_flight,
+        options=options,
+    )
+    while True:
+        with common.Timer() as timer:
+            try:
+                window, rendered = await anext(pages)
+            except StopAsyncIteration:
+                break
+        render_time += timer.elapsed
+        dpis.append(window.dpi)
+        images = [page.image for page in rendered]
+        peak_bytes = max(
+            peak_bytes,
+            sum(image.width * image.height * len(image.getbands()) for image in images),
+        )
+        embeddings.extend(encode_pages(model, processor, images))
+    return embeddings, render_time, peak_bytes, dpis
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    common.add_model_args(parser)
+    parser.add_argument("--pdfs", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=32)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--max-pages-in-flight", type=int, default=8)
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument(
+        "--oversampling", type=float, nargs="+", default=[1.0, 1.5, 2.0, 3.0]
+    )
+    parser.add_argument("--min-recall", type=float, default=0.8)
+    args = parser.parse_args()
+
+    model, processor = common.load_vision_model(args.model, args.device)
+    max_pixels = base.processor_max_pixels(processor)
+    configs = [
+        ("200 dpi png", rasterize.RenderOptions(dpi=rasterize.DEFAULT_DPI)),
+        *(
+            (
+                f"{oversampling:g}x png",
+                rasterize.RenderOptions(
+                    max_pixels=max_pixels, oversampling=oversampling
+                ),
+            )
+            for oversampling in args.oversampling
+        ),
+        (
+            "2x jpeg",
+            rasterize.RenderOptions(
+                max_pixels=max_pixels, image_format="JPEG", quality=args.quality
+            ),
+        ),
+        (
+            "2x webp",
+            rasterize.RenderOptions(
+                max_pixels=max_pixels, image_format="WEBP", quality=args.quality
+            ),
+        ),
+    ]
+    queries = processor.process_queries(common.make_sample_queries(args.queries)).to(
+        model.device
+    )
+    with torch.no_grad():
+        query_embs = model(**queries).float().cpu()
+
+    print(f"processor max pixels: {max_pixels}")
+    print(
+        f"{'config':<12} {'dpi':>5} {'pages/s':>8} {'decoded MiB':>11}"
+        f" {'preview KiB':>11} {f'recall@{args.k}':>9} {'cosine':>7}"
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = pathlib.Path(tmp_dir)
+        pdf_paths = common.make_sample_pdfs(
+            tmp_path / "pdfs", num_pdfs=args.pdfs, pages_per_pdf=args.pages
+        )
+        reference_top_k: list[list[int]] = []
+        reference_pooled: torch.Tensor | None = None
+        reference_bytes = 0
+        for name, options in configs:
+            image_store_root = tmp_path / name.replace(" ", "_")
+            embeddings, render_time, peak_bytes, dpis = asyncio.run(
+                render_and_encode(
+                    pdf_paths,
+                    image_store_root,
+                    options,
+                    model,
+                    processor,
+                    args.max_pages_in_flight,
+                )
+            )
+            top_k = [
+                sorted(
+                    range(len(embeddings)),
+                    key=lambda i, scores=maxsim(query, embeddings): -scores[i],
+                )[: args.k]
+                for query in query_embs
+            ]
+            pooled = torch.nn.functional.normalize(
+                torch.stack([embedding.mean(dim=0) for embedding in embeddings]),
+                dim=-1,
+            )
+            if reference_pooled is None:
+                reference_top_k, reference_pooled = top_k, pooled
+                reference_bytes = peak_bytes
+            recall = statistics.mean(
+                common.recall_at_k([str(i) for i in found], [str(i) for i in expected])
+                for found, expected in zip(top_k, reference_top_k, strict=True)
+            )
+            cosine = float((pooled * reference_pooled).sum(dim=-1).mean())
+            print(
+                f"{name:<12} {statistics.median(dpis):>5.0f}"
+                f" {len(embeddings) / render_time:>8.1f}"
+                f" {peak_bytes / 2**20:>11.1f}"
+                f" {common.dir_size(image_store_root) / len(embeddings) / 1024:>11.1f}"
+                f" {recall:>9.3f} {cosine:>7.3f}"
+            )
+            common.check(
+                len(embeddings) == args.pdfs * args.pages
+                and peak_bytes <= reference_bytes,
+                f"{name} renders every page in at most the 200 dpi memory",
+            )
+            if options.oversampling >= rasterize.RenderOptions().oversampling:
+                common.check(
+                    recall >= args.min_recall,
+                    f"{name} keeps recall@{args.k} >= {args.min_recall}",
+                )
+
+
+if __name__ == "__main__":
+    main()
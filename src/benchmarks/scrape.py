@@ -0,0 +1,88 @@
+"""Articles/second of the plain HTTP Consilient Observer scraper against
+saved HTML fixtures served locally, and checks of what it extracts.
+
+    python -m benchmarks.scrape
+    python -m benchmarks.scrape --runs 20 --workers 4
+
+The fixtures in `benchmarks/fixtures/consilient_observer` hold a series
+index and article pages in the markup of the live site, including a page
+rendered by JavaScript and a link to a removed article. Only the first
+should be handed to the browser fallback, which is replaced by a recorder
+since no browser runs here.
+"""
+
+import argparse
+import hashlib
+import pathlib
+import shutil
+import tempfile
+
+from benchmarks import common
+from michael_mauboussin_twin.feature.extract import constants, scrape
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures" / "consilient_observer"
+EXPECTED = {
+    "The Base Rate Book": ("September 26, 2016", "sample_0.pdf"),
+    "Capital Allocation": ("October 6, 2022", "sample_1.pdf"),
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=scrape.MAX_WORKERS)
+    args = parser.parse_args()
+
+    browser_links: list[list[str]] = []
+
+    def record_browser_fallback(url: str, links: list[str] | None = None) -> list:
+        browser_links.append(links or [])
+        return []
+
+    scrape.scrape_data_selenium = record_browser_fallback
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = pathlib.Path(tmp_dir)
+        site = tmp_path / "site" / FIXTURES.name
+        shutil.copytree(FIXTURES, site)
+        pdf_paths = common.make_sample_pdfs(site / "pdfs", num_pdfs=2, pages_per_pdf=2)
+        constants.DATA_DIR = str(tmp_path / "data")
+        with common.serve_directory(tmp_path / "site") as base_url:
+            index_url = f"{base_url}/{FIXTURES.name}/index.html"
+            with common.Timer() as timer:
+                for _ in range(args.runs):
+                    browser_links.clear()
+                    records = scrape.scrape_data_http(index_url, args.workers)
+            num_links = len(
+                scrape.parse_article_links((site / "index.html").read_text(), index_url)
+            )
+        print(f"{args.runs * num_links / timer.elapsed:.1f} articles/s")
+
+        by_title = {record.title: record for record in records}
+        common.check(
+            set(by_title) == set(EXPECTED), "extracts every article served as HTML"
+        )
+        hashes = {
+            pdf_path.name: hashlib.sha256(pdf_path.read_bytes()).hexdigest()
+            for pdf_path in pdf_paths
+        }
+        for title, (date, pdf_name) in EXPECTED.items():
+            record = by_title[title]
+            common.check(
+                record.date == date
+                and record.series == constants.CONSILIENT_OBSERVER_SERIES
+                and record.sha256 == hashes[pdf_name]
+                and pathlib.Path(record.pdf_path).read_bytes()
+                == (site / "pdfs" / pdf_name).read_bytes(),
+                f"{title}: date, series and downloaded PDF",
+            )
+        common.check(
+            browser_links
+            == [[f"{base_url}/{FIXTURES.name}/articles/skill-and-luck.html"]],
+            "only the JavaScript rendered article falls back to the browser",
+        )
+
+
+if __name__ == "__main__":
+    main()
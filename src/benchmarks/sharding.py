@@ -0,0 +1,179 @@
+"""Pages/second of sharded indexing with several worker processes, each with
+its own model replica, against the single process pipeline, and the work
+left for a run restarted from the checkpoint of an interrupted one.
+
+    python -m benchmarks.sharding --pdfs 8 --pages 10 --workers 1 2 4
+    python -m benchmarks.sharding --model vidore/colqwen2-v1.0 --devices cuda:0 cuda:1
+
+Every configuration indexes the same sample PDFs into a fresh collection.
+The interrupted run is stopped once half its shards are complete, and the
+restarted run is timed and its encoded pages counted. On CPU, workers split
+the cores between them, so gains come from overlapping rendering, encoding
+and upserts rather than from more compute. The run exits with status 1 if a
+sharded run misses pages or the restarted run encodes completed shards again.
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import multiprocessing
+import pathlib
+import tempfile
+import time
+
+import psutil
+
+from benchmarks import common
+from michael_mauboussin_twin.transform import settings, sharding, vision_db
+
+
+def load_worker_store(
+    model_name: str,
+    qdrant_settings: settings.QdrantSettings,
+    db_settings: settings.DBSettings,
+) -> vision_db.VisionVectorStore:
+    model, processor = common.load_vision_model(
+        model_name, db_settings.RAG_MODEL_DEVICE
+    )
+    return vision_db.VisionVectorStore(
+        model, processor, db_settings, qdrant_settings, connect=False
+    )
+
+
+def index(
+    args: argparse.Namespace,
+    model,
+    processor,
+    db_path: pathlib.Path,
+    metadata_file: pathlib.Path,
+    num_workers: int,
+) -> int:
+    """Pages a sharded run upserted."""
+    with common.vision_store(
+        model, processor, db_path, "sharding", args.device
+    ) as store:
+        report = asyncio.run(
+            sharding.index_sharded(
+                store,
+                metadata_file,
+                functools.partial(load_worker_store, args.model, store.qdrant_settings),
+                num_workers,
+                devices=args.devices,
+                shard_size=args.shard_size,
+                batch_size=args.batch_size,
+                checkpoint_path=db_path / "checkpoint.json",
+            )
+        )
+    return len(report.upserted_ids)
+
+
+def index_until(
+    args: argparse.Namespace,
+    db_path: pathlib.Path,
+    metadata_file: pathlib.Path,
+    num_workers: int,
+    num_shards: int,
+) -> None:
+    """Run `index` in a process killed once `num_shards` shards are
+    complete, as a crash would stop it."""
+    checkpoint_path = db_path / "checkpoint.json"
+    context = multiprocessing.get_context("spawn")
+    process = context.Process(
+        target=index_in_process,
+        args=(args, db_path, metadata_file, num_workers),
+    )
+    process.start()
+    while process.is_alive():
+        if checkpoint_path.exists() and (
+            sum(
+                shard["complete"]
+                for shard in json.loads(checkpoint_path.read_text())["shards"].values()
+            )
+            >= num_shards
+        ):
+            for child in psutil.Process(process.pid).children(recursive=True):
+                child.kill()
+            process.kill()
+            break
+        time.sleep(0.01)
+    process.join()
+
+
+def index_in_process(args, db_path, metadata_file, num_workers) -> None:
+    model, processor = common.load_vision_model(args.model, args.device)
+    index(args, model, processor, db_path, metadata_file, num_workers)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    common.add_model_args(parser)
+    parser.add_argument("--devices", nargs="+")
+    parser.add_argument("--pdfs", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--shard-size", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    model, processor = common.load_vision_model(args.model, args.device)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = pathlib.Path(tmp_dir)
+        pdf_paths = common.make_sample_pdfs(
+            tmp_path / "pdfs", num_pdfs=args.pdfs, pages_per_pdf=args.pages
+        )
+        metadata_file = common.write_metadata(pdf_paths, tmp_path / "metadata.sqlite")
+        num_pages = args.pdfs * args.pages
+
+        with common.vision_store(
+            model, processor, tmp_path / "single", "sharding", args.device
+        ) as store:
+            with common.Timer() as timer:
+                report = asyncio.run(
+                    store.batch_encode_and_upsert_docs(
+                        store.stream_from_pdfs(metadata_file), args.batch_size
+                    )
+                )
+        baseline = len(report.upserted_ids) / timer.elapsed
+        print(f"{'single process':<22} {baseline:8.2f} pages/s")
+        for num_workers in args.workers:
+            with common.Timer() as timer:
+                upserted = index(
+                    args,
+                    model,
+                    processor,
+                    tmp_path / f"workers-{num_workers}",
+                    metadata_file,
+                    num_workers,
+                )
+            rate = upserted / timer.elapsed
+            print(
+                f"{f'{num_workers} workers':<22} {rate:8.2f} pages/s"
+                f"  ({rate / baseline:.2f}x)"
+            )
+            common.check(
+                upserted == num_pages, f"{num_workers} workers index every page"
+            )
+
+        num_workers = max(args.workers)
+        db_path = tmp_path / "resume"
+        num_shards = -(-args.pdfs // args.shard_size)
+        index_until(args, db_path, metadata_file, num_workers, num_shards // 2)
+        with common.Timer() as timer:
+            upserted = index(
+                args, model, processor, db_path, metadata_file, num_workers
+            )
+        print(
+            f"restart after {num_shards // 2} of {num_shards} shards encoded"
+            f" {upserted} of {num_pages} pages in {timer.elapsed:.2f} s"
+        )
+        common.check(
+            upserted <= num_pages - num_shards // 2 * args.shard_size * args.pages,
+            "the restarted run skips the completed shards",
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Offline CPU benchmark of every pipeline stage: download, rasterize, page
+image encoding, model encode, upsert and query latency.
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --baseline benchmarks/baseline.json
+    python -m benchmarks.suite --output benchmarks/baseline.json
+
+Sample PDFs and pages are generated, the tiny stand-in model replaces
+ColQwen2, Qdrant runs in local path mode and downloads are served by a
+local HTTP server. With `--baseline`, every metric is compared against the
+stored results and the run exits with status 1 if any regressed by more
+than `--tolerance`. Stages that cannot run here (rasterizing without
+poppler) are reported as skipped.
+
+`benchmarks/baseline.json` was recorded with the default parameters on a
+single CPU Linux host without poppler, as listed in its environment.
+Rates depend on the host, so record a new baseline before comparing runs
+elsewhere.
+"""
+
+import argparse
+import asyncio
+import json
+import pathlib
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import NamedTuple
+
+import torch
+
+from benchmarks import common
+from michael_mauboussin_twin.feature.extract import download
+from michael_mauboussin_twin.transform import base, image_store, rasterize
+
+
+class Metric(NamedTuple):
+    value: float
+    unit: str
+    higher_is_better: bool
+
+
+def percentiles(latencies: list[float]) -> dict[str, float]:
+    cuts = statistics.quantiles(latencies, n=100)
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98]}
+
+
+def bench_download(
+    pdf_paths: list[pathlib.Path], tmp_path: pathlib.Path
+) -> dict[str, Metric]:
+    downloader = download.Downloader()
+    num_bytes = sum(pdf_path.stat().st_size for pdf_path in pdf_paths)
+    with common.serve_directory(pdf_paths[0].parent) as base_url:
+        downloads = [
+            (f"{base_url}/{pdf_path.name}", tmp_path / "downloads" / pdf_path.name)
+            for pdf_path in pdf_paths
+        ]
+        with common.Timer() as cold:
+            downloader.download_many(downloads)
+        with common.Timer() as revalidate:
+            downloader.download_many(downloads)
+    return {
+        "download.files_per_s": Metric(len(pdf_paths) / cold.elapsed, "files/s", True),
+        "download.mb_per_s": Metric(num_bytes / 2**20 / cold.elapsed, "MB/s", True),
+        "download.revalidate_files_per_s": Metric(
+            len(pdf_paths) / revalidate.elapsed, "files/s", True
+        ),
+    }
+
+
+def bench_rasterize(
+    pdf_paths: list[pathlib.Path], tmp_path: pathlib.Path, workers: int
+) -> dict[str, Metric]:
+    async def run() -> int:
+        num_pages = 0
+        async for _, pages in rasterize.rasterize_pdfs(
+            pdf_paths, tmp_path / "rasterized", num_workers=workers
+        ):
+            num_pages += len(pages)
+        return num_pages
+
+    with common.Timer() as timer:
+        num_pages = asyncio.run(run())
+    return {"rasterize.pages_per_s": Metric(num_pages / timer.elapsed, "pages/s", True)}
+
+
+def bench_image_encoding(pages: list, tmp_path: pathlib.Path) -> dict[str, Metric]:
+    store = image_store.ImageStore(tmp_path / "image_encoding")
+    metrics = {}
+    for name, encode in (
+        ("base64_png", rasterize.image_to_base64),
+        ("thumbnail_jpeg", rasterize.image_to_thumbnail_base64),
+        ("image_store_put", store.put_image),
+    ):
+        with common.Timer() as timer:
+            for page in pages:
+                encode(page)
+        metrics[f"image_encoding.{name}_ms_per_page"] = Metric(
+            timer.elapsed * 1000 / len(pages), "ms/page", False
+        )
+    return metrics
+
+
+def bench_index_and_query(
+    pages: list,
+    tmp_path: pathlib.Path,
+    batch_size: int,
+    num_queries: int,
+    k: int,
+) -> dict[str, Metric]:
+    model, processor = common.load_vision_model("tiny")
+    with common.vision_store(
+        model, processor, tmp_path / "index", "suite", db_settings=common.NO_CACHE
+    ) as store:
+        docs = common.make_docs(store, pages)
+        batches = list(common.chunked(docs, batch_size))
+
+        with common.Timer() as timer:
+            vectors = [store.encode_vectors(batch) for batch in batches]
+        encode_rate = len(docs) / timer.elapsed
+        with common.Timer() as timer:
+            points = [
+                [doc.to_point(vector) for doc, vector in zip(batch, batch_vectors)]
+                for batch, batch_vectors in zip(batches, vectors)
+            ]
+        to_point_rate = len(docs) / timer.elapsed
+        with common.Timer() as timer:
+            for i, batch_points in enumerate(points):
+                base.upsert_to_qdrant(
+                    store.qdrant_client,
+                    store.qdrant_settings.collection_name,
+                    batch_points,
+                    i * batch_size,
+                    i * batch_size + len(batch_points),
+                )
+        upsert_rate = len(docs) / timer.elapsed
+
+        latencies = []
+        for query in common.make_sample_queries(num_queries):
+            start = time.perf_counter()
+            store.query_db(query, k=k)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        "encode.pages_per_s": Metric(encode_rate, "pages/s", True),
+        "to_point.pages_per_s": Metric(to_point_rate, "pages/s", True),
+        "upsert.pages_per_s": Metric(upsert_rate, "pages/s", True),
+        **{
+            f"query_db.{name}_ms": Metric(value, "ms", False)
+            for name, value in percentiles(latencies).items()
+        },
+    }
+
+
+def compare(
+    metrics: dict[str, dict], baseline: dict[str, dict], tolerance: float
+) -> list[str]:
+    """Print every metric against the baseline and return the regressed ones."""
+    regressions = []
+    print(f"{'metric':<44} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, metric in metrics.items():
+        if "value" not in metric:
+            print(f"{name:<44} {'-':>10} {'skipped':>10}")
+            continue
+        if name not in baseline or "value" not in baseline[name]:
+            print(f"{name:<44} {'-':>10} {metric['value']:>10.2f}")
+            continue
+        before, after = baseline[name]["value"], metric["value"]
+        change = (after - before) / before if before else 0.0
+        regressed = (
+            change < -tolerance if metric["higher_is_better"] else change > tolerance
+        )
+        if regressed:
+            regressions.append(name)
+        print(
+            f"{name:<44} {before:>10.2f} {after:>10.2f} {change:>+8.1%}"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--pdfs", type=int, default=4)
+    parser.add_argument("--pages-per-pdf", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--output", type=pathlib.Path)
+    parser.add_argument("--baseline", type=pathlib.Path)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    metrics: dict[str, dict] = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = pathlib.Path(tmp_dir)
+        pdf_paths = common.make_sample_pdfs(
+            tmp_path / "pdfs", args.pdfs, args.pages_per_pdf
+        )
+        pages = common.make_sample_pages(args.pages)
+        stages = [
+            ("download", lambda: bench_download(pdf_paths, tmp_path)),
+            (
+                "rasterize",
+                lambda: bench_rasterize(pdf_paths, tmp_path, args.workers),
+            ),
+            ("image_encoding", lambda: bench_image_encoding(pages, tmp_path)),
+            (
+                "index_and_query",
+                lambda: bench_index_and_query(
+                    pages, tmp_path, args.batch_size, args.queries, args.k
+                ),
+            ),
+        ]
+        for stage, bench in stages:
+            if stage == "rasterize" and shutil.which("pdftoppm") is None:
+                print(f"Skipping {stage}: poppler is not installed", file=sys.stderr)
+                metrics[f"{stage}.pages_per_s"] = {"skipped": "poppler not installed"}
+                continue
+            with common.Timer() as timer:
+                stage_metrics = bench()
+            print(f"{stage} took {timer.elapsed:.1f}s", file=sys.stderr)
+            metrics.update(
+                {name: metric._asdict() for name, metric in stage_metrics.items()}
+            )
+
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpus": torch.get_num_threads(),
+        },
+        "parameters": {
+            key: str(value) if isinstance(value, pathlib.Path) else value
+            for key, value in vars(args).items()
+        },
+        "metrics": metrics,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    baseline = json.loads(args.baseline.read_text())["metrics"] if args.baseline else {}
+    regressions = compare(metrics, baseline, args.tolerance)
+    if regressions:
+        print(f"Regressed: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
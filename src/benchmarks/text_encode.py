@@ -0,0 +1,94 @@
+"""Chunks/second of TextVectorDB: PDF text extraction and chunking, encoding
+of length-sorted batches against the same chunks in random order, and
+end-to-end indexing into a local Qdrant.
+
+    python -m benchmarks.text_encode --pdfs 8 --pages 20 --batch-sizes 16 64
+
+`--model tiny` builds a small random BERT offline; any sentence-transformers
+checkpoint (e.g. sentence-transformers/all-MiniLM-L6-v2) can be used instead.
+The run exits with status 1 if length sorting does not cut padding or a
+chunk is not indexed.
+"""
+
+import argparse
+import asyncio
+import pathlib
+import random
+import tempfile
+
+from benchmarks import common
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    common.add_model_args(parser)
+    parser.add_argument("--pdfs", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 64])
+    args = parser.parse_args()
+
+    model = common.load_text_model(args.model, args.device)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = pathlib.Path(tmp_dir)
+        pdf_paths = common.make_sample_text_pdfs(
+            tmp_path / "pdfs", args.pdfs, args.pages
+        )
+        metadata_path = common.write_metadata(pdf_paths, tmp_path / "metadata.sqlite")
+        store = common.build_text_store(model, tmp_path, "text_encode", args.device)
+
+        with common.Timer() as timer:
+            docs = asyncio.run(store.read_from_pdfs(metadata_path))
+        print(
+            f"{'extract + chunk':<28} {len(docs) / timer.elapsed:10.1f} chunks/s"
+            f"  ({len(docs)} chunks)"
+        )
+
+        token_counts = dict(
+            zip(
+                (doc.id for doc in docs),
+                map(len, model.tokenizer([doc.doc for doc in docs])["input_ids"]),
+            )
+        )
+        shuffled = docs.copy()
+        random.Random(0).shuffle(shuffled)
+        for batch_size in args.batch_sizes:
+            padding = {}
+            for order, ordered_docs in (("length-sorted", docs), ("random", shuffled)):
+                batches = list(common.chunked(ordered_docs, batch_size))
+                with common.Timer() as timer:
+                    for batch in batches:
+                        store.encode_docs(batch)
+                tokens = sum(token_counts.values())
+                padded = sum(
+                    max(token_counts[doc.id] for doc in batch) * len(batch)
+                    for batch in batches
+                )
+                padding[order] = 1 - tokens / padded
+                print(
+                    f"{f'encode {order} bs={batch_size}':<28} "
+                    f"{len(docs) / timer.elapsed:10.1f} chunks/s"
+                    f"  (padding {padding[order]:.1%})"
+                )
+            common.check(
+                batch_size == 1 or padding["length-sorted"] < padding["random"],
+                f"length sorting pads less than random order at bs={batch_size}",
+            )
+
+        with common.Timer() as timer:
+            report = asyncio.run(
+                store.batch_encode_and_upsert_docs(docs, max(args.batch_sizes))
+            )
+        print(
+            f"{'encode + upsert':<28} "
+            f"{len(report.upserted_ids) / timer.elapsed:10.1f} chunks/s"
+        )
+        common.check(
+            len(report.upserted_ids) == len(docs) and not report.failed_points,
+            f"indexed all {len(docs)} chunks",
+        )
+        print(store.query_db(common.SAMPLE_QUERIES[0], k=3)[0].metadata.text)
+        store.qdrant_client.close()
+
+
+if __name__ == "__main__":
+    main()
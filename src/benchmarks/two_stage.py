@@ -0,0 +1,81 @@
+"""Query latency and recall@k of two-stage retrieval (mean-pooled prefetch
+then MaxSim rerank) against a full multivector MaxSim search.
+
+    python -m benchmarks.two_stage --pages 500 --prefetch-limits 20 50 100
+
+Recall@k is measured against the full MaxSim top-k on the same collection.
+The run exits with status 1 unless a prefetch limit covering the whole
+collection returns exactly the full MaxSim top-k.
+"""
+
+import argparse
+import pathlib
+import statistics
+import tempfile
+
+from benchmarks import common
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    common.add_model_args(parser)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--prefetch-limits", type=int, nargs="+", default=[20, 50, 100])
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    model, processor = common.load_vision_model(args.model, args.device)
+    with (
+        tempfile.TemporaryDirectory() as tmp_dir,
+        common.vision_store(
+            model,
+            processor,
+            pathlib.Path(tmp_dir),
+            "two_stage",
+            args.device,
+            prefetch=True,
+        ) as store,
+    ):
+        common.index_pages(store, common.make_sample_pages(args.pages), args.batch_size)
+        query_embs = {
+            query: store.encode_queries([query])[0] for query in common.SAMPLE_QUERIES
+        }
+
+        def run(two_stage: bool, prefetch_limit: int | None = None) -> tuple:
+            latencies, top_k = [], {}
+            for _ in range(args.repeat):
+                for query, query_emb in query_embs.items():
+                    with common.Timer() as timer:
+                        points = store.search(
+                            query_emb, args.k, two_stage, prefetch_limit
+                        )
+                    latencies.append(timer.elapsed * 1000)
+                    top_k[query] = [str(point.id) for point in points]
+            return latencies, top_k
+
+        print(f"{'mode':<24} {'p50 ms':>7} {'p95 ms':>7} {f'recall@{args.k}':>9}")
+        latencies, exact = run(two_stage=False)
+        print(
+            f"{'full MaxSim':<24} {statistics.median(latencies):>7.2f} "
+            f"{statistics.quantiles(latencies, n=20)[-1]:>7.2f} {1.0:>9.3f}"
+        )
+        for prefetch_limit in sorted(set(args.prefetch_limits) | {args.pages}):
+            latencies, top_k = run(two_stage=True, prefetch_limit=prefetch_limit)
+            recall = statistics.mean(
+                common.recall_at_k(top_k[query], exact[query]) for query in exact
+            )
+            print(
+                f"{f'two-stage prefetch={prefetch_limit}':<24} "
+                f"{statistics.median(latencies):>7.2f} "
+                f"{statistics.quantiles(latencies, n=20)[-1]:>7.2f} {recall:>9.3f}"
+            )
+        common.check(
+            top_k == exact,
+            f"prefetching all {args.pages} pages reranks to the full MaxSim top-k",
+        )
+
+
+if __name__ == "__main__":
+    main()
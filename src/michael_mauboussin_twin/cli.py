@@ -0,0 +1,477 @@
+"""Command line entry point.
+
+    mauboussin-twin extract
+    mauboussin-twin index [--text] [--from-embedding-store]
+    mauboussin-twin index --workers 2 --devices cuda:0 cuda:1
+    mauboussin-twin index --bulk
+    mauboussin-twin query "What is the base rate of earnings growth?"
+    mauboussin-twin query "capital allocation" --date-from 2015-01-01 --series Research
+    mauboussin-twin stats
+    mauboussin-twin snapshot --output mj-snapshots
+    mauboussin-twin restore mj-snapshots/mauboussinTwin-2024-01-01-00-00-00.tar.gz
+    mauboussin-twin serve --port 8080
+
+Only the standard library is imported at startup. Each subcommand imports
+what it needs when it runs, so torch, colpali_engine and
+sentence_transformers are loaded only by `index`, `query` and `serve`, zenml and
+selenium only by `extract`, and models only when a subcommand encodes
+something.
+"""
+
+import argparse
+import asyncio
+import datetime
+import functools
+import json
+import os
+import pathlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from michael_mauboussin_twin.transform import base, settings, text_db, vision_db
+
+DEFAULT_METADATA_FILE = pathlib.Path(
+    "michael_mauboussin_twin/feature/extract/data/extraction_metadata.sqlite"
+)
+
+
+def get_settings(
+    args: argparse.Namespace,
+) -> tuple["settings.DBSettings", "settings.QdrantSettings"]:
+    from michael_mauboussin_twin.transform import settings
+
+    if args.quantization not in settings.QUANTIZATION_PROFILES:
+        raise ValueError(
+            f"Unknown quantization profile {args.quantization}, expected one of"
+            f" {', '.join(settings.QUANTIZATION_PROFILES)}"
+        )
+    quantization = settings.QUANTIZATION_PROFILES[args.quantization]
+    if args.text:
+        vector_config = settings.get_default_single_vector_config(
+            args.vector_size, quantization=quantization
+        )
+        db_settings = settings.DBSettings(
+            TEXT_EMBEDDING_MODEL_PARAMS=settings.TextEmbeddingModel()
+        )
+    else:
+        vector_config = settings.get_default_multi_vector_config(
+            args.vector_size, quantization=quantization
+        )
+        db_settings = settings.DBSettings(
+            VISION_EMBEDDING_MODEL_PARAMS=settings.VisionEmbeddingModel()
+        )
+    vectors_config, quantization_config, optimizers_config = vector_config
+    qdrant_settings = settings.QdrantSettings(
+        collection_name=args.collection_name,
+        vector_params=vectors_config,
+        quantization_config=quantization_config,
+        optimizers_config=optimizers_config,
+        pool_factor=args.pool_factor,
+        pooling_method=args.pooling_method,
+        prefetch_vector_params=(
+            settings.get_default_prefetch_vector_params(args.vector_size)
+            if args.prefetch
+            else None
+        ),
+        hnsw_ef=args.hnsw_ef,
+        exact=args.exact,
+        rescore=not args.no_rescore,
+        oversampling=args.oversampling,
+    )
+    return db_settings, qdrant_settings
+
+
+def load_store(
+    args: argparse.Namespace, load_model: bool = True
+) -> "vision_db.VisionVectorStore | text_db.TextVectorDB":
+    """Vector store for the collection in `args`. Without `load_model` no
+    model is loaded, which is enough to upsert already computed vectors."""
+    from michael_mauboussin_twin.transform import text_db, vision_db
+
+    db_settings, qdrant_settings = get_settings(args)
+    store_cls = text_db.TextVectorDB if args.text else vision_db.VisionVectorStore
+    if not load_model:
+        return store_cls(
+            model=None,
+            processor=None,
+            db_settings=db_settings,
+            qdrant_settings=qdrant_settings,
+        )
+    return store_cls.from_pretrained(
+        db_settings.embedding_model_params, db_settings, qdrant_settings
+    )
+
+
+def load_worker_store(
+    args: argparse.Namespace, db_settings: "settings.DBSettings"
+) -> "vision_db.VisionVectorStore | text_db.TextVectorDB":
+    """Model replica of an `index --workers` process, without Qdrant."""
+    from michael_mauboussin_twin.transform import text_db, vision_db
+
+    _, qdrant_settings = get_settings(args)
+    store_cls = text_db.TextVectorDB if args.text else vision_db.VisionVectorStore
+    return store_cls.from_pretrained(
+        db_settings.embedding_model_params, db_settings, qdrant_settings, connect=False
+    )
+
+
+def extract(args: argparse.Namespace) -> None:
+    from michael_mauboussin_twin.feature.extract import extract_data
+
+    extract_data.extraction_data()
+
+
+async def _index(store: "base.VectorStore", args: argparse.Namespace) -> None:
+    if args.from_embedding_store:
+        await store.load_from_embedding_store(args.batch_size or 256)
+        return
+    batch_size = args.batch_size or 5
+    stream_kwargs = {"max_pages_in_flight": args.max_pages_in_flight}
+    if args.workers:
+        from michael_mauboussin_twin.transform import sharding
+
+        report = await sharding.index_sharded(
+            store,
+            args.metadata,
+            functools.partial(load_worker_store, args),
+            args.workers,
+            devices=args.devices,
+            num_threads=args.threads_per_worker,
+            shard_size=args.shard_size,
+            batch_size=batch_size,
+            auto_batch_size=not args.fixed_batch_size,
+            checkpoint_path=args.checkpoint,
+            stream_kwargs=stream_kwargs,
+        )
+    else:
+        report = await store.batch_encode_and_upsert_docs(
+            store.stream_from_pdfs(args.metadata, **stream_kwargs),
+            batch_size,
+            auto_batch_size=not args.fixed_batch_size,
+        )
+    if report.failed_ids:
+        await store.replay_failed_upserts(report, batch_size)
+    await store.prune_deleted_documents(args.metadata)
+    store.update_shared_sources()
+    await store.update_document_payloads(args.metadata)
+
+
+def index(args: argparse.Namespace) -> None:
+    from michael_mauboussin_twin import metrics
+
+    # With workers, each worker process loads its own model.
+    store = load_store(args, load_model=not (args.from_embedding_store or args.workers))
+    try:
+        asyncio.run(_bulk_index(store, args) if args.bulk else _index(store, args))
+    finally:
+        metrics.report()
+
+
+async def _bulk_index(store: "base.VectorStore", args: argparse.Namespace) -> None:
+    async with store.bulk_load():
+        await _index(store, args)
+
+
+def snapshot(args: argparse.Namespace) -> None:
+    from michael_mauboussin_twin.transform import snapshots
+
+    db_settings, _ = get_settings(args)
+    print(snapshots.create_snapshot(db_settings, args.collection_name, args.output))
+
+
+def restore(args: argparse.Namespace) -> None:
+    from michael_mauboussin_twin.transform import snapshots
+
+    db_settings, _ = get_settings(args)
+    snapshots.restore_snapshot(db_settings, args.collection_name, args.snapshot)
+
+
+def query(args: argparse.Namespace) -> None:
+    from michael_mauboussin_twin.transform import datamodels
+
+    store = load_store(args)
+    filters = datamodels.SearchFilters(
+        date_from=args.date_from,
+        date_to=args.date_to,
+        authors=args.author,
+        series=args.series,
+        titles=args.title,
+    )
+    batch_results = store.query_db_batch(args.queries, args.k, filters=filters)
+    if args.json:
+        print(
+            json.dumps(
+                [
+                    [
+                        result.model_dump(
+                            exclude={"metadata": {"base64_image", "thumbnail_base64"}}
+                        )
+                        for result in results
+                    ]
+                    for results in batch_results
+                ],
+                indent=2,
+            )
+        )
+        return
+    for query_text, results in zip(args.queries, batch_results, strict=True):
+        print(query_text)
+        for result in results:
+            metadata = result.metadata
+            print(
+                f"  {result.score:.3f}  {metadata.title} ({metadata.date})"
+                f" page {metadata.page_number}  {metadata.url}"
+            )
+
+
+def stats(args: argparse.Namespace) -> None:
+    from michael_mauboussin_twin.feature.extract import metadata_store
+    from michael_mauboussin_twin.transform import embedding_store, manifest, settings
+
+    db_settings, qdrant_settings = get_settings(args)
+    model_name = db_settings.embedding_model_params.name
+    rows: list[tuple[str, object]] = [("model", model_name)]
+    if args.metadata.exists():
+        with metadata_store.MetadataStore(args.metadata) as metadata:
+            rows.append(("extracted documents", len(metadata)))
+    if os.path.exists(db_settings.INDEX_MANIFEST_PATH):
+        index_manifest = manifest.IndexManifest(db_settings.INDEX_MANIFEST_PATH)
+        num_pdfs, num_pages, num_points = index_manifest.counts(
+            model_name, qdrant_settings.index_settings_hash()
+        )
+        index_manifest.close()
+        rows += [
+            ("indexed documents", num_pdfs),
+            ("indexed pages", num_pages),
+            ("indexed points", num_points),
+        ]
+    if os.path.exists(db_settings.EMBEDDING_STORE_PATH):
+        embeddings = embedding_store.EmbeddingStore(db_settings.EMBEDDING_STORE_PATH)
+        num_contents, num_points = embeddings.counts(
+            model_name, qdrant_settings.embedding_settings_hash()
+        )
+        embeddings.close()
+        rows += [("stored embeddings", num_contents), ("stored points", num_points)]
+    # Opening a local Qdrant path would create it.
+    client = (
+        settings.get_qdrant_client(db_settings)
+        if not db_settings.is_local_qdrant
+        or os.path.exists(db_settings.QDRANT_DATABASE_PATH)
+        else None
+    )
+    if client and client.collection_exists(qdrant_settings.collection_name):
+        info = client.get_collection(qdrant_settings.collection_name)
+        rows += [
+            ("collection status", info.status.value),
+            ("collection points", info.points_count),
+            ("collection segments", info.segments_count),
+        ]
+    else:
+        rows.append(("collection status", "missing"))
+    if client:
+        client.close()
+    for name, value in rows:
+        print(f"{name:<20} {value}")
+
+
+def serve(args: argparse.Namespace) -> None:
+    import uvicorn
+
+    from michael_mauboussin_twin import metrics
+    from michael_mauboussin_twin.serve import app
+
+    metrics.enable()
+    store = load_store(args)
+    uvicorn.run(
+        app.create_app(
+            store,
+            max_batch_size=args.max_batch_size,
+            max_wait=args.max_wait_ms / 1000,
+            max_queue_size=args.max_queue_size,
+        ),
+        host=args.host,
+        port=args.port,
+    )
+
+
+def add_collection_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--collection-name", default="mauboussinTwin")
+    parser.add_argument(
+        "--text",
+        action="store_true",
+        help="use the text embedding model instead of ColQwen2",
+    )
+    parser.add_argument("--vector-size", type=int, default=1024)
+    parser.add_argument("--pool-factor", type=int, default=1)
+    parser.add_argument(
+        "--pooling-method",
+        choices=["hierarchical", "sequential"],
+        default="hierarchical",
+    )
+    parser.add_argument("--prefetch", action="store_true")
+    parser.add_argument(
+        "--quantization",
+        default="int8",
+        help="int8, binary, product or none; a -disk suffix keeps the original"
+        " vectors on disk",
+    )
+    parser.add_argument("--hnsw-ef", type=int)
+    parser.add_argument("--exact", action="store_true", help="search without HNSW")
+    parser.add_argument(
+        "--no-rescore",
+        action="store_true",
+        help="rank by the quantized vectors only",
+    )
+    parser.add_argument(
+        "--oversampling",
+        type=float,
+        help="fetch this many times k candidates with quantized vectors before"
+        " rescoring",
+    )
+    parser.add_argument("--metadata", type=pathlib.Path, default=DEFAULT_METADATA_FILE)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="mauboussin-twin",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(required=True)
+
+    extract_parser = subparsers.add_parser(
+        "extract", help="scrape and download the PDFs and their metadata"
+    )
+    extract_parser.set_defaults(func=extract)
+
+    index_parser = subparsers.add_parser(
+        "index", help="encode the extracted PDFs and upsert them to Qdrant"
+    )
+    add_collection_args(index_parser)
+    index_parser.add_argument("--batch-size", type=int)
+    index_parser.add_argument(
+        "--fixed-batch-size",
+        action="store_true",
+        help="do not grow the batch size while throughput improves",
+    )
+    index_parser.add_argument("--max-pages-in-flight", type=int, default=8)
+    index_parser.add_argument(
+        "--workers",
+        type=int,
+        help="encode shards of the documents in this many processes, each with"
+        " its own model, resuming from the checkpoint of an interrupted run",
+    )
+    index_parser.add_argument(
+        "--devices",
+        nargs="+",
+        help="devices the workers' models are spread over, RAG_MODEL_DEVICE by"
+        " default",
+    )
+    index_parser.add_argument(
+        "--threads-per-worker",
+        type=int,
+        help="torch threads of each worker; CPU workers split the cores by" " default",
+    )
+    index_parser.add_argument(
+        "--shard-size", type=int, default=16, help="documents per shard"
+    )
+    index_parser.add_argument(
+        "--checkpoint",
+        type=pathlib.Path,
+        help="checkpoint of completed shards, INDEX_CHECKPOINT_PATH by default",
+    )
+    index_parser.add_argument(
+        "--from-embedding-store",
+        action="store_true",
+        help="rebuild the collection from stored vectors without the model; the"
+        " pool factor, pooling method and prefetch vector must match the ones"
+        " the vectors were computed with",
+    )
+    index_parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="turn indexing off while loading and build the HNSW index once at"
+        " the end, for full rebuilds",
+    )
+    index_parser.set_defaults(func=index)
+
+    query_parser = subparsers.add_parser("query", help="search the collection")
+    add_collection_args(query_parser)
+    query_parser.add_argument("queries", nargs="+")
+    query_parser.add_argument("--k", type=int, default=5)
+    query_parser.add_argument("--json", action="store_true")
+    query_parser.add_argument(
+        "--date-from",
+        type=datetime.date.fromisoformat,
+        help="only documents dated on or after this YYYY-MM-DD date",
+    )
+    query_parser.add_argument(
+        "--date-to",
+        type=datetime.date.fromisoformat,
+        help="only documents dated on or before this YYYY-MM-DD date",
+    )
+    query_parser.add_argument(
+        "--author", nargs="+", help="only documents by any of these authors"
+    )
+    query_parser.add_argument(
+        "--series",
+        nargs="+",
+        help='only documents in any of these series, such as "Research"',
+    )
+    query_parser.add_argument(
+        "--title", nargs="+", help="only documents with any of these exact titles"
+    )
+    query_parser.set_defaults(func=query)
+
+    stats_parser = subparsers.add_parser(
+        "stats", help="count extracted, stored and indexed documents"
+    )
+    add_collection_args(stats_parser)
+    stats_parser.set_defaults(func=stats)
+
+    snapshot_parser = subparsers.add_parser(
+        "snapshot", help="write a snapshot of the collection to ship elsewhere"
+    )
+    add_collection_args(snapshot_parser)
+    snapshot_parser.add_argument(
+        "--output", type=pathlib.Path, help="directory, SNAPSHOT_PATH by default"
+    )
+    snapshot_parser.set_defaults(func=snapshot)
+
+    restore_parser = subparsers.add_parser(
+        "restore", help="replace the collection with a snapshot"
+    )
+    add_collection_args(restore_parser)
+    restore_parser.add_argument("snapshot", type=pathlib.Path)
+    restore_parser.set_defaults(func=restore)
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="serve queries over HTTP with a warm model"
+    )
+    add_collection_args(serve_parser)
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    serve_parser.add_argument("--max-batch-size", type=int, default=32)
+    serve_parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=5.0,
+        help="how long the first query of a batch waits for more to arrive",
+    )
+    serve_parser.add_argument(
+        "--max-queue-size",
+        type=int,
+        default=256,
+        help="queries waiting beyond this are rejected with a 503",
+    )
+    serve_parser.set_defaults(func=serve)
+    return parser
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
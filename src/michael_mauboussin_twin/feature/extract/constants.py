@@ -3,4 +3,9 @@ DATA_DIR = "michael_mauboussin_twin/feature/extract/data"
 URL = "https://www.michaelmauboussin.com/writing"
 CHUNK_SIZE = 8192
 
+# Link text prefixes of the series on the writing page.
+RESEARCH_SERIES = "Research"
+CONSILIENT_OBSERVER_SERIES = "The Consilient Observer"
+
 EXTRACTION_METADATA_FILE = "extraction_metadata.json"
+METADATA_STORE_FILE = "extraction_metadata.sqlite"
@@ -9,3 +9,5 @@ class ExtractData(pydantic.BaseModel):
     author: Optional[list[str]] = ["Michael Mauboussin"]
     date: Optional[str] = None
     pdf_path: str
+    sha256: Optional[str] = None
+    series: Optional[str] = None
@@ -0,0 +1,181 @@
+import concurrent.futures
+import functools
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+from typing import Any, Literal, NamedTuple, Optional
+
+import loguru
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from michael_mauboussin_twin import metrics
+from michael_mauboussin_twin.feature.extract import constants
+
+logger = loguru.logger
+
+META_SUFFIX = ".meta.json"
+PART_SUFFIX = ".part"
+
+
+class DownloadResult(NamedTuple):
+    url: str
+    path: str
+    sha256: str
+    status: Literal["downloaded", "resumed", "not_modified"]
+
+
+class Downloader:
+    """Shared HTTP download engine for the extract stage.
+
+    Connections are pooled in one `requests.Session` and `download_many` runs
+    at most `max_workers` downloads at once. Every file keeps a sidecar with
+    its ETag, Last-Modified and sha256 so unchanged files are revalidated with
+    a conditional request instead of being downloaded again. Interrupted
+    downloads resume from their `.part` file with a Range request, and
+    finished files are moved into place atomically.
+    """
+
+    def __init__(
+        self,
+        session: Optional[requests.Session] = None,
+        max_workers: int = 8,
+        timeout: float = 100,
+        chunk_size: int = constants.CHUNK_SIZE,
+    ) -> None:
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max_workers,
+            pool_maxsize=max_workers,
+            max_retries=Retry(
+                total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504)
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @metrics.timed("extract.http_get")
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(url, **kwargs)
+
+    @metrics.timed("extract.download")
+    def download(self, url: str, path: str | os.PathLike) -> DownloadResult:
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        part_path = path.with_name(path.name + PART_SUFFIX)
+        meta = _read_meta(path)
+        headers: dict[str, str] = {}
+        if path.exists() and meta.get("url") == url:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        if offset and meta.get("url") == url:
+            headers["Range"] = f"bytes={offset}-"
+            validator = meta.get("part_etag") or meta.get("part_last_modified")
+            if validator:
+                headers["If-Range"] = validator
+
+        with self.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 416:
+                part_path.unlink()
+                return self.download(url, path)
+            if response.status_code == 304:
+                logger.info(f"PDF {path} is unchanged at {url}")
+                sha256 = meta.get("sha256") or _hash_file(path, self.chunk_size)
+                metrics.inc("extract.not_modified")
+                return DownloadResult(url, str(path), sha256, "not_modified")
+            if response.status_code not in (200, 206):
+                logger.error(f"Failed to download PDF from {url}")
+                raise ValueError(f"Failed to download PDF from {url}")
+            resumed = response.status_code == 206
+            sha256 = hashlib.sha256()
+            if resumed:
+                with open(part_path, "rb") as f:
+                    while chunk := f.read(self.chunk_size):
+                        sha256.update(chunk)
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            _write_meta(
+                path,
+                {
+                    **meta,
+                    "url": url,
+                    "part_etag": etag,
+                    "part_last_modified": last_modified,
+                },
+            )
+            num_bytes = 0
+            with open(part_path, "ab" if resumed else "wb") as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    sha256.update(chunk)
+                    num_bytes += len(chunk)
+        os.replace(part_path, path)
+        _write_meta(
+            path,
+            {
+                "url": url,
+                "etag": etag,
+                "last_modified": last_modified,
+                "sha256": sha256.hexdigest(),
+            },
+        )
+        metrics.inc("extract.resumed" if resumed else "extract.downloaded")
+        metrics.inc("extract.downloaded_bytes", num_bytes)
+        logger.info(f"Downloaded PDF from {url} to {path}")
+        return DownloadResult(
+            url, str(path), sha256.hexdigest(), "resumed" if resumed else "downloaded"
+        )
+
+    def download_many(
+        self, downloads: list[tuple[str, str | os.PathLike]]
+    ) -> list[DownloadResult]:
+        """Download (url, path) pairs concurrently, returning results in input
+        order. The first failure is raised after all downloads finish."""
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+            futures = [
+                executor.submit(self.download, url, path) for url, path in downloads
+            ]
+            concurrent.futures.wait(futures)
+        return [future.result() for future in futures]
+
+
+@functools.lru_cache(maxsize=1)
+def get_downloader() -> Downloader:
+    return Downloader()
+
+
+def _hash_file(path: pathlib.Path, chunk_size: int) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _meta_path(path: pathlib.Path) -> pathlib.Path:
+    return path.with_name(path.name + META_SUFFIX)
+
+
+def _read_meta(path: pathlib.Path) -> dict:
+    try:
+        with open(_meta_path(path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_meta(path: pathlib.Path, meta: dict) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, _meta_path(path))
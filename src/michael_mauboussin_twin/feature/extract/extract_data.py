@@ -1,4 +1,3 @@
-import json
 import os
 import sys
 from typing import Annotated, Tuple
@@ -6,7 +5,13 @@ from typing import Annotated, Tuple
 import loguru
 import zenml
 
-from michael_mauboussin_twin.feature.extract import constants, datamodels, scrape, web
+from michael_mauboussin_twin.feature.extract import (
+    constants,
+    datamodels,
+    metadata_store,
+    scrape,
+    web,
+)
 
 sys.setrecursionlimit(3000)
 
@@ -39,20 +44,13 @@ def save_metadata(
     # consilient_observer_data: list[datamodels.ExtractData],
 ) -> None:
     # combined_data = pdf_data_list + consilient_observer_data
-    output_path = os.path.join(constants.DATA_DIR, constants.EXTRACTION_METADATA_FILE)
-    with open(output_path, "r+", encoding="utf-8") as f:
-        try:
-            existing_data = json.load(f)
-            f.seek(0)
-            f.truncate()
-            json.dump(
-                existing_data.extend([data.model_dump() for data in extract_data]),
-                f,
-                indent=2,
-            )
-        except json.JSONDecodeError:
-            json.dump([data.model_dump() for data in extract_data], f, indent=2)
-        logger.info(f"Saved metadata to {output_path}")
+    store_path = os.path.join(constants.DATA_DIR, constants.METADATA_STORE_FILE)
+    legacy_path = os.path.join(constants.DATA_DIR, constants.EXTRACTION_METADATA_FILE)
+    with metadata_store.MetadataStore(store_path) as store:
+        if len(store) == 0 and os.path.exists(legacy_path):
+            store.import_json(legacy_path)
+            logger.info(f"Imported legacy metadata from {legacy_path}")
+        store.upsert(extract_data)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,136 @@
+import json
+import pathlib
+import sqlite3
+import time
+from typing import Iterable, Iterator, Optional
+
+import loguru
+
+from michael_mauboussin_twin.feature.extract import datamodels
+
+logger = loguru.logger
+
+COLUMNS = ("url", "title", "author", "date", "pdf_path", "sha256", "series")
+
+
+class MetadataStore:
+    """SQLite store of extracted document metadata, keyed by URL and indexed
+    by PDF hash and by the time a document was first added.
+
+    Upserting a record that is already stored only touches its row, and
+    `updated_at` only moves when one of its fields changed.
+    """
+
+    def __init__(self, path: str | pathlib.Path) -> None:
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                url TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                author TEXT,
+                date TEXT,
+                pdf_path TEXT NOT NULL,
+                sha256 TEXT,
+                series TEXT,
+                added_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS documents_sha256 ON documents (sha256);
+            CREATE INDEX IF NOT EXISTS documents_added_at ON documents (added_at);
+            CREATE INDEX IF NOT EXISTS documents_updated_at ON documents (updated_at);
+            """)
+        self.connection.commit()
+
+    def __enter__(self) -> "MetadataStore":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM documents").fetchone()
+        return count
+
+    def upsert(self, records: Iterable[datamodels.ExtractData]) -> None:
+        now = time.time()
+        rows = [(*_to_row(record), now, now) for record in records]
+        changed = " OR ".join(
+            f"{column} IS NOT excluded.{column}" for column in COLUMNS
+        )
+        self.connection.executemany(
+            f"INSERT INTO documents ({', '.join(COLUMNS)}, added_at, updated_at)"
+            f" VALUES ({', '.join('?' * (len(COLUMNS) + 2))})"
+            " ON CONFLICT (url) DO UPDATE SET"
+            f" {', '.join(f'{column} = excluded.{column}' for column in COLUMNS[1:])},"
+            f" updated_at = excluded.updated_at WHERE {changed}",
+            rows,
+        )
+        self.connection.commit()
+        logger.info(f"Saved {len(rows)} metadata records to {self.path}")
+
+    def get(self, url: str) -> Optional[datamodels.ExtractData]:
+        row = self.connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM documents WHERE url = ?", (url,)
+        ).fetchone()
+        return _from_row(row) if row is not None else None
+
+    def get_by_hash(self, sha256: str) -> list[datamodels.ExtractData]:
+        rows = self.connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM documents WHERE sha256 = ?", (sha256,)
+        )
+        return [_from_row(row) for row in rows]
+
+    def iter_records(
+        self,
+        added_since: Optional[float] = None,
+        batch_size: int = 500,
+        updated_since: Optional[float] = None,
+    ) -> Iterator[datamodels.ExtractData]:
+        """Stream records in insertion order, optionally only those first
+        added at or after the `added_since` Unix timestamp or changed at or
+        after the `updated_since` one."""
+        cursor = self.connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM documents"
+            " WHERE added_at >= ? AND updated_at >= ? ORDER BY added_at, rowid",
+            (
+                added_since if added_since is not None else float("-inf"),
+                updated_since if updated_since is not None else float("-inf"),
+            ),
+        )
+        while rows := cursor.fetchmany(batch_size):
+            yield from (_from_row(row) for row in rows)
+
+    def import_json(self, path: str | pathlib.Path) -> None:
+        """Upsert the records of a legacy `extraction_metadata.json` file."""
+        with open(path, "r", encoding="utf-8") as f:
+            self.upsert(datamodels.ExtractData(**ed) for ed in json.load(f))
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def _to_row(record: datamodels.ExtractData) -> tuple:
+    return (
+        record.url,
+        record.title,
+        json.dumps(record.author) if record.author is not None else None,
+        record.date,
+        record.pdf_path,
+        record.sha256,
+        record.series,
+    )
+
+
+def _from_row(row: tuple) -> datamodels.ExtractData:
+    url, title, author, date, pdf_path, sha256, series = row
+    return datamodels.ExtractData(
+        url=url,
+        title=title,
+        author=json.loads(author) if author is not None else None,
+        date=date,
+        pdf_path=pdf_path,
+        sha256=sha256,
+        series=series,
+    )
@@ -1,5 +1,7 @@
+import concurrent.futures
 import os
-from typing import Annotated
+import urllib.parse
+from typing import Annotated, Literal, NamedTuple, Optional
 
 import bs4
 import loguru
@@ -9,17 +11,27 @@ import zenml
 from bs4 import BeautifulSoup
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
 from webdriver_manager.chrome import ChromeDriverManager
 
-from michael_mauboussin_twin.feature.extract import constants, datamodels
+from michael_mauboussin_twin import metrics
+from michael_mauboussin_twin.feature.extract import constants, datamodels, download
 
 logger = loguru.logger
 
 DATE_CLASS = "insightHeaderTextRegular text-uppercase customColor insightDateColor"
 TITLE_CLASS = "heroProductName equalSpace noMargin customColor"
-TEXT_CLASS = "blockText"
 PDF_CLASS = "buttoncomponent left custom-btn btn btn-default btn-lg"
+ARTICLES_SELECTOR = ".series-detail-articles a"
+
+HTML_PARSER = "lxml"
+MAX_WORKERS = 8
+
+
+class Article(NamedTuple):
+    url: str
+    title: str
+    date: str
+    pdf_link: str
 
 
 def _setup_driver(url: str) -> webdriver.Chrome:
@@ -29,51 +41,130 @@ def _setup_driver(url: str) -> webdriver.Chrome:
     return driver
 
 
-def _open_links(driver: webdriver.Chrome) -> None:
-    articles = driver.find_elements(By.CSS_SELECTOR, ".series-detail-articles a")
-
-    seen_urls = set()
-
-    for article in articles:
-        url = article.get_attribute("href")
-        if url not in seen_urls:
-            driver.execute_script("window.open(arguments[0], '_blank');", url)
-            seen_urls.add(url)
+def parse_article_links(html: str, base_url: str) -> list[str]:
+    soup = BeautifulSoup(html, HTML_PARSER)
+    links = [
+        urllib.parse.urljoin(base_url, str(article["href"]))
+        for article in soup.select(ARTICLES_SELECTOR)
+        if article.get("href")
+    ]
+    return list(dict.fromkeys(links))
+
+
+def parse_article(html: str, url: str) -> Article:
+    soup = BeautifulSoup(html, HTML_PARSER)
+    date, title, pdf_link = (
+        soup.find(class_=DATE_CLASS),
+        soup.find(class_=TITLE_CLASS),
+        soup.find(class_=PDF_CLASS),
+    )
+    if date is None or title is None or pdf_link is None or not pdf_link.get("href"):
+        raise ValueError(f"Article page {url} is missing its date, title or PDF link")
+    return Article(
+        url=url,
+        date=date.text.strip(),
+        title=title.text.strip(),
+        pdf_link=urllib.parse.urljoin(url, str(pdf_link["href"])),
+    )
+
+
+def _save_pdf(article: Article) -> datamodels.ExtractData:
+    pdf_path = os.path.join(
+        constants.DATA_DIR, f"{_sanitize_title_name(article.title)}.pdf"
+    )
+    pdf = download.get_downloader().download(article.pdf_link, pdf_path)
+    return datamodels.ExtractData(
+        url=article.url,
+        title=article.title,
+        date=article.date,
+        pdf_path=pdf.path,
+        sha256=pdf.sha256,
+        series=constants.CONSILIENT_OBSERVER_SERIES,
+    )
+
+
+def _save_pdf_or_none(article: Article) -> Optional[datamodels.ExtractData]:
+    try:
+        return _save_pdf(article)
+    except (ValueError, requests.RequestException) as e:
+        logger.error(f"Failed to extract PDF from {article.url}: {e}")
+        return None
+
+
+def _fetch_article(url: str) -> Optional[Article]:
+    """The article at `url`, or None if its page has to be rendered by a
+    browser. Download errors are raised."""
+    response = download.get_downloader().get(url)
+    response.raise_for_status()
+    try:
+        return parse_article(response.text, url)
+    except ValueError as e:
+        logger.warning(f"Failed to parse {url} ({e}), using a browser")
+        return None
 
 
-def _close_tab(driver: webdriver.Chrome) -> None:
-    driver.switch_to.window(driver.window_handles[0])
-    driver.close()
-
-
-def _extract_data(driver: webdriver.Chrome) -> tuple[str, str, str]:
-    html = driver.page_source
-    soup = BeautifulSoup(html, "html.parser")
-    date = soup.find(class_=DATE_CLASS).text.strip()
-    title = soup.find(class_=TITLE_CLASS).text.strip()
-    text = soup.find(class_=TEXT_CLASS).text.strip()
-    return date, title, text
+def _sanitize_title_name(title: str) -> str:
+    return title.replace(" ", "_")
 
 
-def _extract_pdf(driver: webdriver.Chrome, sanitized_title: str) -> str:
-    os.makedirs(constants.DATA_DIR, exist_ok=True)
-    pdf_link = driver.find_element(
-        By.CLASS_NAME, PDF_CLASS.replace(" ", ".")
-    ).get_attribute("href")
-    pdf_path = os.path.join(constants.DATA_DIR, f"{sanitized_title}.pdf")
-    response = requests.get(pdf_link, timeout=100, stream=True)
+def scrape_data_http(
+    url: str, max_workers: int = MAX_WORKERS
+) -> list[datamodels.ExtractData]:
+    """Fetch the series index and every article over plain HTTP with a bounded
+    worker pool. Pages whose content is rendered by JavaScript, including an
+    index without article links, are handed to the Selenium fallback;
+    articles that fail to download are skipped."""
+    response = download.get_downloader().get(url)
     if response.status_code != 200:
-        logger.error(f"Failed to download PDF from {pdf_link}")
-        raise ValueError(f"Failed to download PDF from {pdf_link}")
-    with open(pdf_path, "wb") as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            f.write(chunk)
-    logger.info(f"Downloaded PDF {sanitized_title} to {pdf_path}")
-    return pdf_path
+        logger.error(f"Failed to download HTML from {url}")
+        raise ValueError(f"Failed to download HTML from {url}")
+    links = parse_article_links(response.text, url)
+    if not links:
+        logger.warning(f"No article links in {url}, falling back to a browser")
+        return scrape_data_selenium(url)
+    articles: list[Article] = []
+    js_links: list[str] = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = [(link, executor.submit(_fetch_article, link)) for link in links]
+        for link, future in futures:
+            try:
+                article = future.result()
+            except requests.RequestException as e:
+                logger.error(f"Failed to fetch {link}: {e}")
+                continue
+            if article is None:
+                js_links.append(link)
+            else:
+                articles.append(article)
+        saved = executor.map(_save_pdf_or_none, articles)
+        consilient_data = [data for data in saved if data is not None]
+    if js_links:
+        consilient_data.extend(scrape_data_selenium(url, js_links))
+    return consilient_data
 
 
-def _sanitize_title_name(title: str) -> str:
-    return title.replace(" ", "_")
+def scrape_data_selenium(
+    url: str, links: Optional[list[str]] = None
+) -> list[datamodels.ExtractData]:
+    consilient_data: list[datamodels.ExtractData] = []
+    driver = _setup_driver(url)
+    try:
+        if links is None:
+            links = parse_article_links(driver.page_source, url)
+        for link in links:
+            try:
+                with metrics.span("extract.browser_page"):
+                    driver.get(link)
+                    article = parse_article(driver.page_source, link)
+            except (selenium.common.exceptions.WebDriverException, ValueError) as e:
+                logger.error(f"Failed to extract data from {link}: {e}")
+                continue
+            data = _save_pdf_or_none(article)
+            if data is not None:
+                consilient_data.append(data)
+    finally:
+        driver.quit()
+    return consilient_data
 
 
 @zenml.step(
@@ -82,48 +173,18 @@ def _sanitize_title_name(title: str) -> str:
 )
 def scrape_data(
     url_tag: bs4.element.Tag,
+    mode: Literal["http", "selenium"] = "http",
 ) -> Annotated[
     list[datamodels.ExtractData],
     zenml.ArtifactConfig(name="consilient_observer_data", version="2025"),
 ]:
-    url = url_tag.get("href")
-    consilient_data: list[datamodels.ExtractData] = []
-    driver = _setup_driver(url)
-    _open_links(driver)
-    _close_tab(driver)
-    while True:
-        driver.switch_to.window(driver.window_handles[0])
-        try:
-            date, title, text = _extract_data(driver)
-        except selenium.common.exceptions.NoSuchElementException as e:
-            logger.error(f"Failed to extract data from {driver.current_url}: {e}")
-            driver.close()
-            continue
-        sanitized_title = _sanitize_title_name(title)
-        try:
-            pdf_path = _extract_pdf(driver, sanitized_title)
-        except selenium.common.exceptions.WebDriverException as e:
-            logger.error(f"Failed to extract PDF from {driver.current_url}: {e}")
-            driver.close()
-            continue
-        consilient_data.append(
-            datamodels.ExtractData(
-                date=date,
-                title=title,
-                text=text,
-                pdf_path=pdf_path,
-                url=driver.current_url,
-            )
-        )
-        driver.close()
-        try:
-            hasattr(driver, "window_handles")
-        except selenium.common.exceptions.InvalidSessionIdException:
-            break
-    return consilient_data
+    url = str(url_tag["href"])
+    if mode == "selenium":
+        return scrape_data_selenium(url)
+    return scrape_data_http(url)
 
 
 if __name__ == "__main__":
     URL = "https://www.morganstanley.com/im/en-us/financial-advisor/insights/series/consilient-observer.html"
-    data = scrape_data(URL)
+    data = scrape_data_http(URL)
     print(data)
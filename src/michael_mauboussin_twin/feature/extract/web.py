@@ -3,11 +3,10 @@ from typing import Annotated
 
 import bs4
 import loguru
-import requests
 import zenml
 from bs4 import BeautifulSoup
 
-from michael_mauboussin_twin.feature.extract import constants, datamodels
+from michael_mauboussin_twin.feature.extract import constants, datamodels, download
 
 logger = loguru.logger
 
@@ -19,7 +18,7 @@ logger = loguru.logger
 def get_consilient_observer_link_after_saving_previous_data(
     url: str = constants.URL,
 ) -> tuple[list[datamodels.ExtractData], bs4.element.Tag]:
-    response = requests.get(url, timeout=30)
+    response = download.get_downloader().get(url, timeout=30)
     if response.status_code != 200:
         logger.error(f"Failed to download HTML from {url}")
         raise ValueError(f"Failed to download HTML from {url}")
@@ -42,40 +41,39 @@ def process_links(
     tuple[list[datamodels.ExtractData], bs4.element.Tag | None],
     zenml.ArtifactConfig(name="previous_pdf_data", version="2025"),
 ]:
-    pdf_data_list: list[datamodels.ExtractData] = []
+    research_links: list[bs4.element.Tag] = []
     consilient_observer_link: bs4.element.Tag | None = None
     for link in links:
-        if link.text.startswith("Research"):
-            filepath = pdf_data_save(link["href"], link.text)
-            pdf_data_list.append(
-                datamodels.ExtractData(
-                    url=link["href"],
-                    title=link.text,
-                    pdf_path=filepath,
-                    date=link.text[link.text.find("(") + 1 : link.text.rfind(")")],
-                )
-            )
-        elif link.text.startswith("The Consilient Observer"):
+        if link.text.startswith(constants.RESEARCH_SERIES):
+            research_links.append(link)
+        elif link.text.startswith(constants.CONSILIENT_OBSERVER_SERIES):
             consilient_observer_link = link
+    downloads = download.get_downloader().download_many(
+        [(link["href"], pdf_path_for(link.text)) for link in research_links]
+    )
+    pdf_data_list = [
+        datamodels.ExtractData(
+            url=link["href"],
+            title=link.text,
+            pdf_path=result.path,
+            sha256=result.sha256,
+            date=link.text[link.text.find("(") + 1 : link.text.rfind(")")],
+            series=constants.RESEARCH_SERIES,
+        )
+        for link, result in zip(research_links, downloads, strict=True)
+    ]
     return pdf_data_list, consilient_observer_link
 
 
-def pdf_data_save(link: str, filename: str) -> str:
+def pdf_path_for(filename: str) -> str:
     safe_filename = (
         "".join(c if c.isalnum() or c in "-_" else "_" for c in filename) + ".pdf"
     )
-    response = requests.get(link, timeout=100, stream=True)
-    if response.status_code != 200:
-        logger.error(f"Failed to download PDF from {link}")
-        raise ValueError(f"Failed to download PDF from {link}")
-    os.makedirs(constants.DATA_DIR, exist_ok=True)
-    filepath = os.path.join(constants.DATA_DIR, safe_filename)
-
-    with open(filepath, "wb") as f:
-        for chunk in response.iter_content(chunk_size=constants.CHUNK_SIZE):
-            f.write(chunk)
-    logger.info(f"Downloaded PDF {filename} to {filepath}")
-    return filepath
+    return os.path.join(constants.DATA_DIR, safe_filename)
+
+
+def pdf_data_save(link: str, filename: str) -> str:
+    return download.get_downloader().download(link, pdf_path_for(filename)).path
 
 
 def restore_original_filename(safe_filename: str) -> str:
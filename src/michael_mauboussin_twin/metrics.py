@@ -0,0 +1,220 @@
+"""Span timers, counters and histograms for the pipeline stages.
+
+Disabled unless the `MJ_METRICS` environment variable is set (or `enable()`
+is called); while disabled, `span` returns a shared no-op context manager and
+`timed` calls straight through. `report` logs a per-stage summary table and,
+when `MJ_METRICS_FILE` is set, writes the metrics there as JSON or, for a
+`.prom` file, in the Prometheus text exposition format.
+"""
+
+import bisect
+import contextlib
+import functools
+import inspect
+import json
+import os
+import pathlib
+import re
+import threading
+import time
+from typing import Any, Callable, Iterator, TypeVar, cast
+
+import loguru
+
+logger = loguru.logger
+
+F = TypeVar("F", bound=Callable)
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PREFIX = "mj"
+
+_enabled = os.environ.get("MJ_METRICS", "").lower() in ("1", "true", "yes")
+_lock = threading.Lock()
+_counters: dict[str, float] = {}
+_histograms: dict[str, "Histogram"] = {}
+_noop = contextlib.nullcontext()
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "buckets": dict(zip([*map(str, self.buckets), "+Inf"], self.counts)),
+        }
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(on: bool = True) -> None:
+    global _enabled
+    _enabled = on
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def inc(name: str, value: float = 1) -> None:
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name: str, value: float) -> None:
+    if not _enabled:
+        return
+    with _lock:
+        if name not in _histograms:
+            _histograms[name] = Histogram()
+        _histograms[name].observe(value)
+
+
+@contextlib.contextmanager
+def _span(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def span(name: str) -> contextlib.AbstractContextManager:
+    """Time a block into the `name` histogram, in seconds."""
+    return _span(name) if _enabled else _noop
+
+
+def timed(name: str) -> Callable[[F], F]:
+    """Decorator timing every call of a sync or async function with `span`."""
+
+    def decorator(fn: F) -> F:
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                if not _enabled:
+                    return await fn(*args, **kwargs)
+                with _span(name):
+                    return await fn(*args, **kwargs)
+
+            return cast(F, async_wrapper)
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _span(name):
+                return fn(*args, **kwargs)
+
+        return cast(F, wrapper)
+
+    return decorator
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "spans": {name: h.to_dict() for name, h in _histograms.items()},
+        }
+
+
+def merge(data: dict) -> None:
+    """Add a `snapshot` taken in another process, e.g. a pool worker."""
+    if not _enabled:
+        return
+    with _lock:
+        for name, value in data["counters"].items():
+            _counters[name] = _counters.get(name, 0) + value
+        for name, other in data["spans"].items():
+            if name not in _histograms:
+                _histograms[name] = Histogram()
+            histogram = _histograms[name]
+            for i, count in enumerate(other["buckets"].values()):
+                histogram.counts[i] += count
+            histogram.sum += other["sum"]
+            histogram.count += other["count"]
+            histogram.max = max(histogram.max, other["max"])
+
+
+def to_json() -> str:
+    return json.dumps(snapshot(), indent=2)
+
+
+def _metric_name(name: str) -> str:
+    return f"{PREFIX}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}"
+
+
+def to_prometheus() -> str:
+    lines: list[str] = []
+    data = snapshot()
+    for name, value in sorted(data["counters"].items()):
+        metric = f"{_metric_name(name)}_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+    for name, histogram in sorted(data["spans"].items()):
+        metric = f"{_metric_name(name)}_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for le, count in histogram["buckets"].items():
+            cumulative += count
+            lines.append(f'{metric}_bucket{{le="{le}"}} {cumulative}')
+        lines += [
+            f"{metric}_sum {histogram['sum']}",
+            f"{metric}_count {histogram['count']}",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def summary_table() -> str:
+    """Time by stage, slowest first, followed by the counters. Shares are of
+    the summed span time, which counts nested spans (`query.search` inside
+    `query.query_db`) twice."""
+    data = snapshot()
+    spans = sorted(data["spans"].items(), key=lambda item: -item[1]["sum"])
+    total = sum(histogram["sum"] for _, histogram in spans) or 1.0
+    lines = [
+        f"{'stage':<36} {'calls':>8} {'total s':>9} {'mean ms':>9} "
+        f"{'max ms':>9} {'share':>6}"
+    ]
+    for name, histogram in spans:
+        lines.append(
+            f"{name:<36} {histogram['count']:>8} {histogram['sum']:>9.2f} "
+            f"{histogram['sum'] / histogram['count'] * 1000:>9.2f} "
+            f"{histogram['max'] * 1000:>9.2f} {histogram['sum'] / total:>6.1%}"
+        )
+    for name, value in sorted(data["counters"].items()):
+        lines.append(f"{name:<36} {value:>8g}")
+    return "\n".join(lines)
+
+
+def dump(path: str | pathlib.Path) -> None:
+    path = pathlib.Path(path)
+    path.write_text(to_prometheus() if path.suffix == ".prom" else to_json())
+
+
+def report() -> None:
+    if not _enabled:
+        return
+    logger.info(f"Time by stage:\n{summary_table()}")
+    if path := os.environ.get("MJ_METRICS_FILE"):
+        dump(path)
+        logger.info(f"Wrote metrics to {path}")
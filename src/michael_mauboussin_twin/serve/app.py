@@ -0,0 +1,99 @@
+import contextlib
+from typing import AsyncIterator
+
+import fastapi
+import pydantic
+from fastapi import responses
+
+from michael_mauboussin_twin import metrics
+from michael_mauboussin_twin.serve import batcher
+from michael_mauboussin_twin.transform import datamodels, text_db, vision_db
+
+
+class QueryRequest(pydantic.BaseModel):
+    query: str = pydantic.Field(min_length=1)
+    k: int = pydantic.Field(default=5, ge=1, le=100)
+    filters: datamodels.SearchFilters | None = None
+
+
+class QueryResponse(pydantic.BaseModel):
+    results: list[datamodels.QueryResult]
+
+
+def create_app(
+    store: vision_db.VisionVectorStore | text_db.TextVectorDB,
+    max_batch_size: int = 32,
+    max_wait: float = 0.005,
+    max_queue_size: int = 256,
+) -> fastapi.FastAPI:
+    """Query service around one warm vector store.
+
+    Concurrent `/query` requests are encoded and searched together in
+    micro-batches, see `batcher.MicroBatcher`. When `max_queue_size` requests
+    are already waiting, new ones get a 503 with a Retry-After header.
+    """
+
+    def query_batch(
+        items: list[tuple[str, int, datamodels.SearchFilters | None]],
+    ) -> list[list[datamodels.QueryResult]]:
+        results: list[list[datamodels.QueryResult]] = [[] for _ in items]
+        positions_by_search: dict[
+            tuple[int, datamodels.SearchFilters | None], list[int]
+        ] = {}
+        for i, (_, k, filters) in enumerate(items):
+            positions_by_search.setdefault((k, filters), []).append(i)
+        for (k, filters), positions in positions_by_search.items():
+            batch_results = store.query_db_batch(
+                [items[i][0] for i in positions], k, filters=filters
+            )
+            for i, query_results in zip(positions, batch_results, strict=True):
+                results[i] = query_results
+        return results
+
+    query_batcher = batcher.MicroBatcher(
+        query_batch, max_batch_size, max_wait, max_queue_size
+    )
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app: fastapi.FastAPI) -> AsyncIterator[None]:
+        query_batcher.start()
+        yield
+        await query_batcher.stop()
+
+    app = fastapi.FastAPI(title="Mauboussin Twin query service", lifespan=lifespan)
+    app.state.batcher = query_batcher
+
+    @app.post("/query", response_model=QueryResponse)
+    async def query(request: QueryRequest) -> QueryResponse:
+        with metrics.span("serve.request"):
+            try:
+                results = await query_batcher.submit(
+                    (request.query, request.k, request.filters)
+                )
+            except batcher.Overloaded as e:
+                raise fastapi.HTTPException(
+                    status_code=503, detail=str(e), headers={"Retry-After": "1"}
+                )
+        return QueryResponse(results=results)
+
+    @app.get("/health")
+    async def health() -> responses.JSONResponse:
+        return responses.JSONResponse(
+            {
+                "status": "ok" if query_batcher.running else "stopped",
+                "collection": store.qdrant_settings.collection_name,
+                "queued": query_batcher.queue.qsize(),
+            },
+            status_code=200 if query_batcher.running else 503,
+        )
+
+    @app.get("/metrics")
+    async def prometheus_metrics() -> responses.PlainTextResponse:
+        return responses.PlainTextResponse(
+            metrics.to_prometheus()
+            + "# TYPE mj_serve_queued gauge\n"
+            + f"mj_serve_queued {query_batcher.queue.qsize()}\n",
+            media_type="text/plain; version=0.0.4",
+        )
+
+    return app
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from typing import Any, Callable, Generic, NamedTuple, TypeVar
+
+import loguru
+
+from michael_mauboussin_twin import metrics
+
+logger = loguru.logger
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class Overloaded(Exception):
+    """The batcher queue is full; the caller should retry later."""
+
+
+class _Pending(NamedTuple):
+    item: Any
+    future: asyncio.Future
+    submitted: float
+
+
+class MicroBatcher(Generic[K, V]):
+    """Run `fn` on micro-batches of concurrently submitted items.
+
+    A batch is closed when it holds `max_batch_size` items or `max_wait`
+    seconds after its first item arrived, whichever comes first, and `fn` runs
+    in a worker thread so the event loop keeps accepting requests. Batches run
+    one at a time, since the model behind `fn` is not thread safe. At most
+    `max_queue_size` items wait for a batch; further submissions raise
+    `Overloaded` instead of queueing without bound.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[list[K]], list[V]],
+        max_batch_size: int = 32,
+        max_wait: float = 0.005,
+        max_queue_size: int = 256,
+    ) -> None:
+        if max_batch_size < 1 or max_queue_size < 1:
+            raise ValueError("max_batch_size and max_queue_size must be at least 1")
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue: asyncio.Queue[_Pending] = asyncio.Queue(max_queue_size)
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while not self.queue.empty():
+            pending = self.queue.get_nowait()
+            pending.future.cancel()
+
+    async def submit(self, item: K) -> V:
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait(_Pending(item, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            metrics.inc("serve.rejected")
+            raise Overloaded(f"{self.queue.qsize()} items are already queued")
+        return await future
+
+    async def _next_batch(self) -> list[_Pending]:
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Take whatever else is already queued without waiting any longer.
+        while len(batch) < self.max_batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = [
+                pending
+                for pending in await self._next_batch()
+                if not pending.future.done()
+            ]
+            if not batch:
+                continue
+            start = time.perf_counter()
+            for pending in batch:
+                metrics.observe("serve.queue_wait", start - pending.submitted)
+            metrics.inc("serve.batches")
+            metrics.inc("serve.batched_items", len(batch))
+            try:
+                with metrics.span("serve.batch"):
+                    results = await asyncio.to_thread(
+                        self.fn, [pending.item for pending in batch]
+                    )
+            except asyncio.CancelledError:
+                for pending in batch:
+                    pending.future.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"Batch of {len(batch)} failed: {e}")
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(e)
+                continue
+            for pending, result in zip(batch, results, strict=True):
+                if not pending.future.done():
+                    pending.future.set_result(result)
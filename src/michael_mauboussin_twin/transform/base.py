@@ -1,73 +1,114 @@
-from typing import Generic, TypeVar
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Generic,
+    Iterator,
+    TypeVar,
+)
 import abc
+import asyncio
+import contextlib
+import functools
 import torch
-from colpali_engine import models as colpali_model
+import numpy as np
 import tqdm
 import stamina
-import sentence_transformers
 import loguru
 from qdrant_client.http import models
 import qdrant_client
 import pathlib
-import pdf2image
-import base64
-import aiofiles
 import json
-from PIL import Image
-from io import BytesIO
-from michael_mauboussin_twin.transform import settings, datamodels
+import time
+from michael_mauboussin_twin import metrics
+from michael_mauboussin_twin.transform import (
+    batching,
+    settings,
+    datamodels,
+    cache,
+    dedup,
+    embedding_store,
+    image_store,
+    manifest,
+    rasterize,
+)
 from michael_mauboussin_twin.feature.extract import datamodels as extract_datamodels
+from michael_mauboussin_twin.feature.extract import metadata_store
+
+if TYPE_CHECKING:
+    import sentence_transformers
+    from colpali_engine import models as colpali_model
 
 T = TypeVar("T", bound="VectorStore")
 
 logger = loguru.logger
 
 
-@stamina.retry(on=Exception, attempts=3)
+@stamina.retry(on=Exception, attempts=5, wait_initial=0.5, wait_max=10.0)
+@metrics.timed("index.upsert_to_qdrant")
 def upsert_to_qdrant(
     qdrant_client_: qdrant_client.QdrantClient,
     collection_name: str,
     points: list[models.PointStruct],
     start: int,
     end: int,
-):
-    try:
-        qdrant_client_.upsert(
-            collection_name=collection_name,
-            points=points,
-            wait=False,
-        )
-        logger.info(f"Upserted from {start} to {end} points to Qdrant")
-    except Exception as e:
-        logger.error(f"Error during upsert: {e}")
-        return False
-    return True
+    wait: bool = True,
+) -> None:
+    qdrant_client_.upsert(
+        collection_name=collection_name,
+        points=points,
+        wait=wait,
+    )
+    metrics.inc("index.upserted_points", len(points))
+    logger.info(f"Upserted from {start} to {end} points to Qdrant")
 
 
 class VectorStore(abc.ABC, Generic[T]):
 
     def __init__(
         self,
-        model: colpali_model.ColQwen2 | sentence_transformers.SentenceTransformer,
+        model: "colpali_model.ColQwen2 | sentence_transformers.SentenceTransformer | None",
         db_settings: settings.DBSettings,
         qdrant_settings: settings.QdrantSettings,
-        processor: colpali_model.ColQwen2Processor | None = None,
+        processor: "colpali_model.ColQwen2Processor | None" = None,
         force_create_collection: bool = False,
+        connect: bool = True,
     ) -> None:
-        self.model = model
+        """Without `connect` the store does not open Qdrant, for processes
+        that only encode and leave upserts to another process. Without a
+        `model` it can only upsert vectors computed elsewhere."""
+        self._model = model
         self.processor = processor
         self.db_settings = db_settings
         self.qdrant_settings = qdrant_settings
-        if "localhost" in self.db_settings.QDRANT_CLOUD_URL:
-            self.qdrant_client = qdrant_client.QdrantClient(
-                path=self.db_settings.QDRANT_DATABASE_PATH,
-            )
-        else:
-            self.qdrant_client = qdrant_client.QdrantClient(
-                url=self.db_settings.QDRANT_CLOUD_URL,
-                port=self.db_settings.QDRANT_DATABASE_PORT,
-                api_key=self.db_settings.QDRANT_APIKEY,
+        self.image_store = image_store.ImageStore(
+            self.db_settings.IMAGE_STORE_PATH,
+            self.db_settings.PREVIEW_FORMAT,
+            self.db_settings.PREVIEW_QUALITY,
+        )
+        self.manifest = manifest.IndexManifest(self.db_settings.INDEX_MANIFEST_PATH)
+        # Shard workers collect their page records here for the coordinator
+        # to write, see `record_pages`.
+        self.deferred_page_records: list[manifest.PageRecords] | None = None
+        self.embedding_store = embedding_store.EmbeddingStore(
+            self.db_settings.EMBEDDING_STORE_PATH
+        )
+        self.query_embedding_cache: cache.LRUCache[str, torch.Tensor] = cache.LRUCache(
+            self.db_settings.QUERY_CACHE_SIZE, self.db_settings.QUERY_CACHE_TTL
+        )
+        self.query_result_cache: cache.LRUCache[tuple, list[datamodels.QueryResult]] = (
+            cache.LRUCache(
+                self.db_settings.RESULT_CACHE_SIZE, self.db_settings.RESULT_CACHE_TTL
             )
+        )
+        self.is_local = self.db_settings.is_local_qdrant
+        self.bulk_loading = False
+        self._qdrant_client: qdrant_client.QdrantClient | None = None
+        if not connect:
+            return
+        self._qdrant_client = settings.get_qdrant_client(self.db_settings)
         if (
             not self.qdrant_client.collection_exists(
                 self.qdrant_settings.collection_name
@@ -78,75 +119,775 @@ class VectorStore(abc.ABC, Generic[T]):
                 collection_name=self.qdrant_settings.collection_name,
                 on_disk_payload=self.qdrant_settings.on_disk_payload,
                 optimizers_config=self.qdrant_settings.optimizers_config,
-                vectors_config=self.qdrant_settings.vector_params,
-                quantization_config=self.qdrant_settings.scalar_params,
+                vectors_config=self.qdrant_settings.vectors_config,
+                quantization_config=self.qdrant_settings.quantization_config,
             )
+        # Local mode has no payload indexes.
+        if not self.is_local:
+            self.create_payload_indexes()
+
+    @property
+    def model(
+        self,
+    ) -> "colpali_model.ColQwen2 | sentence_transformers.SentenceTransformer":
+        if self._model is None:
+            raise RuntimeError("The store was created without a model")
+        return self._model
+
+    @property
+    def qdrant_client(self) -> qdrant_client.QdrantClient:
+        if self._qdrant_client is None:
+            raise RuntimeError("The store was created without connecting to Qdrant")
+        return self._qdrant_client
+
+    def create_payload_indexes(self) -> None:
+        """Index the payload fields in `settings.PAYLOAD_INDEXES` that the
+        collection does not index yet."""
+        payload_schema = self.qdrant_client.get_collection(
+            self.qdrant_settings.collection_name
+        ).payload_schema
+        for field_name, field_schema in settings.PAYLOAD_INDEXES.items():
+            if field_name not in payload_schema:
+                self.qdrant_client.create_payload_index(
+                    collection_name=self.qdrant_settings.collection_name,
+                    field_name=field_name,
+                    field_schema=field_schema,
+                    wait=True,
+                )
+                logger.info(f"Created a {field_schema.value} index on {field_name}")
 
     @abc.abstractmethod
-    def encode_docs(
-        self, docs: list[datamodels.DocumentToVectorDB]
-    ) -> list[torch.Tensor]:
+    def encode_docs(self, docs: list[datamodels.DocumentToVectorDB]) -> torch.Tensor:
         pass
 
+    def postprocess_embeddings(
+        self, vector_emb: torch.Tensor
+    ) -> torch.Tensor | list[torch.Tensor] | list[dict[str, torch.Tensor]]:
+        return vector_emb
+
     async def batch_encode_and_upsert_docs(
         self,
-        docs: list[datamodels.DocumentToVectorDB],
+        docs: (
+            list[datamodels.DocumentToVectorDB]
+            | AsyncIterable[list[datamodels.DocumentToVectorDB]]
+        ),
         batch_size: int = 10,
+        max_in_flight_upserts: int = 2,
+        auto_batch_size: bool = False,
+    ) -> datamodels.UpsertReport:
+        """Encode batch N+1 while batch N is being upserted. Batches that
+        still fail after retries are returned in the report, see
+        `replay_failed_upserts`."""
+        if self.is_local:
+            max_in_flight_upserts = 1
+        elif self.bulk_loading:
+            max_in_flight_upserts = max(
+                max_in_flight_upserts, self.db_settings.BULK_UPLOAD_PARALLEL
+            )
+        report = datamodels.UpsertReport()
+        sizer = batching.BatchSizer(
+            batch_size,
+            self.model.device,
+            auto=auto_batch_size,
+            max_batch_size=self.db_settings.MAX_ENCODE_BATCH_SIZE,
+            memory_limit=self.db_settings.ENCODE_MEMORY_LIMIT,
+        )
+        upsert_slots = asyncio.Semaphore(max_in_flight_upserts)
+        upserts: set[asyncio.Task] = set()
+        total = len(docs) if isinstance(docs, list) else None
+        start = 0
+        run_start = time.perf_counter()
+        with tqdm.tqdm(total=total, desc="Indexing Progress", unit="page") as pbar:
+
+            def on_upserted(_: asyncio.Task, num_points: int) -> None:
+                upsert_slots.release()
+                pbar.update(num_points)
+
+            try:
+                async for batch in iter_batches(docs, sizer):
+                    batch_start = time.perf_counter()
+                    points = await asyncio.to_thread(
+                        self.encode_to_points, batch, sizer
+                    )
+                    sizer.record(len(batch), time.perf_counter() - batch_start)
+                    await upsert_slots.acquire()
+                    task = asyncio.create_task(
+                        self._upsert_batch(points, start, report)
+                    )
+                    upserts.add(task)
+                    task.add_done_callback(upserts.discard)
+                    task.add_done_callback(
+                        functools.partial(on_upserted, num_points=len(batch))
+                    )
+                    start += len(batch)
+            finally:
+                # Upserts of encoded batches finish even if encoding fails, so
+                # no points or manifest records are left half written.
+                await asyncio.gather(*upserts)
+        logger.info(
+            f"Indexed {start} pages at {start / (time.perf_counter() - run_start):.2f}"
+            f" pages/s with batch size {sizer.batch_size}"
+        )
+        if report.failed_ids:
+            logger.error(f"{len(report.failed_ids)} of {start} points failed to upsert")
+        return report
+
+    def encode_to_points(
+        self,
+        batch: list[datamodels.DocumentToVectorDB],
+        sizer: batching.BatchSizer | None = None,
     ) -> list[models.PointStruct]:
-        point_struct_models: list[models.PointStruct] = []
-        with tqdm.tqdm(total=len(docs), desc="Indexing Progress") as pbar:
-            for i in range(0, len(docs), batch_size):
-                batch = docs[i : i + batch_size]
+        """Build points from the vectors already in the embedding store and
+        only run the model on the documents that are missing from it."""
+        vectors, new_vectors = self.load_or_encode_vectors(batch, sizer)
+        if new_vectors:
+            with metrics.span("index.embedding_store_put"):
+                self.embedding_store.put_many(
+                    new_vectors,
+                    self.model_name,
+                    self.qdrant_settings.embedding_settings_hash(),
+                )
+        with metrics.span("index.to_point"):
+            return [
+                doc.to_point(vector) for vector, doc in zip(vectors, batch, strict=True)
+            ]
+
+    def load_or_encode_vectors(
+        self,
+        batch: list[datamodels.DocumentToVectorDB],
+        sizer: batching.BatchSizer | None = None,
+    ) -> tuple[
+        list[torch.Tensor | dict[str, torch.Tensor]],
+        list[tuple[str, dict[str, np.ndarray]]],
+    ]:
+        """Vectors of `batch`, read from the embedding store where it has
+        them and encoded otherwise, and the (content key, stored vectors) of
+        the encoded ones, which are not put in the store yet."""
+        config = self.qdrant_settings.embedding_settings_hash()
+        keys = [
+            embedding_store.content_key(doc.metadata.image_key, doc.metadata.text)
+            for doc in batch
+        ]
+        with metrics.span("index.embedding_store_get"):
+            stored = self.embedding_store.get_many(
+                (key for key in keys if key is not None), self.model_name, config
+            )
+        missing = [doc for doc, key in zip(batch, keys) if key not in stored]
+        metrics.inc("index.embedding_store_hits", len(batch) - len(missing))
+        encoded = iter(self.encode_vectors(missing, sizer) if missing else [])
+        vectors: list[torch.Tensor | dict[str, torch.Tensor]] = []
+        new_vectors: list[tuple[str, dict[str, np.ndarray]]] = []
+        for key in keys:
+            if key in stored:
+                vectors.append(from_stored_vectors(stored[key]))
+                continue
+            vector = next(encoded)
+            vectors.append(vector)
+            if key is not None:
+                new_vectors.append((key, to_stored_vectors(vector)))
+        return vectors, new_vectors
+
+    def encode_vectors(
+        self,
+        batch: list[datamodels.DocumentToVectorDB],
+        sizer: batching.BatchSizer | None = None,
+    ) -> list[torch.Tensor | dict[str, torch.Tensor]]:
+        try:
+            with metrics.span("index.encode_docs"):
                 vector_emb = self.encode_docs(batch)
-                assert vector_emb.shape[0] == len(
-                    batch
-                ), f"Number of vectors {vector_emb.shape[0]} does not match number of documents {len(batch)}"
-                current_batch: list[models.PointStruct] = []
-                for vemb, b in zip(vector_emb, batch, strict=True):
-                    current_batch.append(b.to_point(vemb))
-                upsert_to_qdrant(
-                    self.qdrant_client,
-                    self.qdrant_settings.collection_name,
-                    current_batch,
-                    i,
-                    i + batch_size,
+        except Exception as e:
+            if sizer is None or len(batch) == 1 or not batching.is_out_of_memory(e):
+                raise
+        else:
+            assert vector_emb.shape[0] == len(
+                batch
+            ), f"Number of vectors {vector_emb.shape[0]} does not match number of documents {len(batch)}"
+            metrics.inc("index.encoded_pages", len(batch))
+            with metrics.span("index.postprocess_embeddings"):
+                return list(self.postprocess_embeddings(vector_emb))
+        # Retry outside the except block so the failed batch's tensors can be
+        # freed before the cache is cleared.
+        sizer.on_out_of_memory(len(batch))
+        metrics.inc("index.out_of_memory_retries")
+        size = sizer.batch_size
+        return [
+            vector
+            for i in range(0, len(batch), size)
+            for vector in self.encode_vectors(batch[i : i + size], sizer)
+        ]
+
+    async def _upsert_batch(
+        self,
+        points: list[models.PointStruct],
+        start: int,
+        report: datamodels.UpsertReport,
+    ) -> None:
+        end = start + len(points)
+        try:
+            await asyncio.to_thread(
+                upsert_to_qdrant,
+                self.qdrant_client,
+                self.qdrant_settings.collection_name,
+                points,
+                start,
+                end,
+                not self.bulk_loading,
+            )
+        except Exception as e:
+            logger.error(f"Failed to upsert points {start} to {end}: {e}")
+            report.failed_points.extend(points)
+        else:
+            self.query_result_cache.clear()
+            report.upserted_ids.extend(str(point.id) for point in points)
+            self.manifest.record(
+                points, self.model_name, self.qdrant_settings.index_settings_hash()
+            )
+            self.embedding_store.record_points(
+                [
+                    (str(point.id), key, payload)
+                    for point in points
+                    if (
+                        key := embedding_store.content_key(
+                            (payload := point.payload or {}).get("image_key"),
+                            payload.get("text"),
+                        )
+                    )
+                    is not None
+                ],
+                self.model_name,
+                self.qdrant_settings.embedding_settings_hash(),
+            )
+
+    async def replay_failed_upserts(
+        self,
+        report: datamodels.UpsertReport,
+        batch_size: int = 10,
+    ) -> datamodels.UpsertReport:
+        replay_report = datamodels.UpsertReport()
+        failed_points = report.failed_points
+        for i in range(0, len(failed_points), batch_size):
+            await self._upsert_batch(
+                failed_points[i : i + batch_size], i, replay_report
+            )
+        return replay_report
+
+    async def load_from_embedding_store(
+        self, batch_size: int = 256
+    ) -> datamodels.UpsertReport:
+        """Upsert every point the embedding store holds for this model and
+        embedding config into the collection, without running the model."""
+        report = datamodels.UpsertReport()
+        start = 0
+        for stored_points in self.embedding_store.iter_points(
+            self.model_name,
+            self.qdrant_settings.embedding_settings_hash(),
+            batch_size,
+        ):
+            await self.upsert_stored_points(stored_points, start, report)
+            start += len(stored_points)
+        logger.info(f"Loaded {start} points from the embedding store")
+        return report
+
+    async def upsert_stored_points(
+        self,
+        stored_points: list[tuple[str, dict, dict[str, np.ndarray]]],
+        start: int,
+        report: datamodels.UpsertReport,
+    ) -> None:
+        """Upsert (point id, payload, vectors by name) as the embedding store
+        keeps them."""
+        points = [
+            models.PointStruct(
+                id=point_id,
+                vector=to_vector_struct(stored_vectors),
+                payload=payload,
+            )
+            for point_id, payload, stored_vectors in stored_points
+        ]
+        await self._upsert_batch(points, start, report)
+
+    @contextlib.asynccontextmanager
+    async def bulk_load(self, timeout: float = 3600.0) -> AsyncIterator[None]:
+        """Turn indexing off while loading points and build the HNSW index
+        once on exit, waiting up to `timeout` seconds for it. A run killed
+        midway leaves indexing off until a bulk load completes."""
+        self.qdrant_client.update_collection(
+            collection_name=self.qdrant_settings.collection_name,
+            optimizers_config=models.OptimizersConfigDiff(indexing_threshold=0),
+        )
+        self.bulk_loading = True
+        try:
+            yield
+        finally:
+            self.bulk_loading = False
+            self.qdrant_client.update_collection(
+                collection_name=self.qdrant_settings.collection_name,
+                optimizers_config=self.qdrant_settings.optimizers_config,
+            )
+        with metrics.span("index.build_index"):
+            await asyncio.to_thread(self.wait_until_indexed, timeout)
+
+    def wait_until_indexed(self, timeout: float = 3600.0) -> None:
+        deadline = time.monotonic() + timeout
+        while (
+            self.qdrant_client.get_collection(
+                self.qdrant_settings.collection_name
+            ).status
+            != models.CollectionStatus.GREEN
+        ):
+            if time.monotonic() > deadline:
+                raise TimeoutError(
+                    f"Collection {self.qdrant_settings.collection_name} was not"
+                    f" indexed in {timeout} s"
                 )
-                point_struct_models.extend(current_batch)
-                pbar.update(batch_size)
-                torch.cuda.empty_cache()
-        return point_struct_models
+            time.sleep(0.5)
+
+    @property
+    def model_name(self) -> str:
+        return self.db_settings.embedding_model_params.name
 
     async def read_from_pdfs(
-        self, extraction_metadata_file: pathlib.Path
+        self,
+        extraction_metadata_file: pathlib.Path,
+        incremental: bool = False,
+        added_since: float | None = None,
     ) -> list[datamodels.DocumentToVectorDB]:
         docs: list[datamodels.DocumentToVectorDB] = []
-        with open(extraction_metadata_file, "r") as f:
-            extraction_metadata = json.load(f)
-        extraction_metadata = [
-            extract_datamodels.ExtractData(**ed) for ed in extraction_metadata
+        async for pages in self.stream_from_pdfs(
+            extraction_metadata_file, incremental=incremental, added_since=added_since
+        ):
+            docs.extend(pages)
+        return docs
+
+    async def stream_from_pdfs(
+        self,
+        extraction_metadata_file: pathlib.Path,
+        max_pages_in_flight: int = 8,
+        num_workers: int | None = None,
+        incremental: bool = True,
+        added_since: float | None = None,
+    ) -> AsyncIterator[list[datamodels.DocumentToVectorDB]]:
+        """Yield rasterized pages in document order, at most
+        `max_pages_in_flight` per batch. In incremental mode, pages already in
+        the manifest are skipped; blank and duplicate pages are not encoded."""
+        documents, _ = await self.hash_documents(extraction_metadata_file, added_since)
+        async for docs in self.stream_documents(
+            documents, max_pages_in_flight, num_workers, incremental
+        ):
+            yield docs
+
+    async def stream_documents(
+        self,
+        documents: list[tuple[extract_datamodels.ExtractData, str]],
+        max_pages_in_flight: int = 8,
+        num_workers: int | None = None,
+        incremental: bool = True,
+    ) -> AsyncIterator[list[datamodels.DocumentToVectorDB]]:
+        """`stream_from_pdfs` for (metadata, content hash) of documents
+        already hashed by `hash_documents`."""
+        settings_hash = self.qdrant_settings.index_settings_hash()
+        skip_pages = [
+            (
+                self.manifest.indexed_pages(pdf_hash, self.model_name, settings_hash)
+                | self.manifest.blank_pages(pdf_hash)
+                if incremental
+                else set()
+            )
+            for _, pdf_hash in documents
         ]
-        for ed in extraction_metadata:
+        max_ink_coverage = self.db_settings.BLANK_PAGE_MAX_INK_COVERAGE
+        duplicates = None
+        if self.db_settings.DUPLICATE_PAGE_MAX_DISTANCE is not None:
+            duplicates = dedup.DuplicateIndex(
+                self.db_settings.DUPLICATE_PAGE_MAX_DISTANCE
+            )
+            if incremental:
+                for fingerprint, indexed_id in self.manifest.indexed_fingerprints(
+                    self.model_name, settings_hash
+                ):
+                    duplicates.add(fingerprint, indexed_id)
+        num_blank, num_duplicates = 0, 0
+        async for window, pages in rasterize.rasterize_pdfs(
+            [pathlib.Path(ed.pdf_path) for ed, _ in documents],
+            image_store_root=self.image_store.root,
+            max_pages_in_flight=max_pages_in_flight,
+            num_workers=num_workers or self.db_settings.RASTERIZE_WORKERS,
+            skip_pages=skip_pages,
+            options=self.render_options,
+        ):
+            ed, pdf_hash = documents[window.pdf_index]
+            docs: list[datamodels.DocumentToVectorDB] = []
+            fingerprints: list[tuple[str, int, dedup.PageFingerprint, bool]] = []
+            duplicate_pages: list[tuple[str, int, str, str]] = []
+            for page_number, page in enumerate(pages, start=window.first_page):
+                blank = max_ink_coverage is not None and dedup.is_blank(
+                    page.fingerprint, max_ink_coverage
+                )
+                fingerprints.append((pdf_hash, page_number, page.fingerprint, blank))
+                if blank:
+                    num_blank += 1
+                    metrics.inc("index.blank_pages")
+                    continue
+                point_id = datamodels.point_id(pdf_hash, page_number)
+                if duplicates is not None:
+                    shared_point_id = duplicates.find(page.fingerprint)
+                    if shared_point_id not in (None, str(point_id)):
+                        duplicate_pages.append(
+                            (pdf_hash, page_number, shared_point_id, ed.url)
+                        )
+                        num_duplicates += 1
+                        metrics.inc("index.duplicate_pages")
+                        continue
+                    duplicates.add(page.fingerprint, str(point_id))
+                docs.append(
+                    datamodels.DocumentToVectorDB(
+                        id=point_id,
+                        doc=page.image,
+                        metadata=datamodels.Metadata(
+                            **document_metadata(ed),
+                            image_key=page.image_key,
+                            thumbnail_base64=page.thumbnail_base64,
+                            pdf_hash=pdf_hash,
+                            page_number=page_number,
+                        ),
+                    )
+                )
+            self.record_pages(manifest.PageRecords(fingerprints, duplicate_pages))
+            if docs:
+                yield docs
+        if num_blank or num_duplicates:
+            logger.info(
+                f"Skipped {num_blank} blank and {num_duplicates} duplicate pages,"
+                f" saving {num_blank + num_duplicates} model calls"
+            )
+
+    def record_pages(self, records: manifest.PageRecords) -> None:
+        if self.deferred_page_records is not None:
+            self.deferred_page_records.append(records)
+            return
+        self.manifest.record_fingerprints(records.fingerprints)
+        self.manifest.record_duplicates(
+            records.duplicates,
+            self.model_name,
+            self.qdrant_settings.index_settings_hash(),
+        )
+
+    @property
+    def render_options(self) -> rasterize.RenderOptions:
+        return rasterize.RenderOptions(
+            dpi=self.db_settings.RENDER_DPI,
+            max_pixels=processor_max_pixels(self.processor),
+            oversampling=self.db_settings.RENDER_OVERSAMPLING,
+            max_dpi=self.db_settings.RENDER_MAX_DPI,
+            image_format=self.db_settings.PREVIEW_FORMAT,
+            quality=self.db_settings.PREVIEW_QUALITY,
+        )
+
+    async def hash_documents(
+        self,
+        extraction_metadata_file: pathlib.Path,
+        added_since: float | None = None,
+        updated_since: float | None = None,
+    ) -> tuple[list[tuple[extract_datamodels.ExtractData, str]], set[str]]:
+        """Return (metadata, content hash) of every PDF present on disk and the
+        URLs of metadata entries whose PDF is missing."""
+        documents: list[tuple[extract_datamodels.ExtractData, str]] = []
+        missing_urls: set[str] = set()
+        for ed in load_extraction_metadata(
+            extraction_metadata_file, added_since, updated_since
+        ):
             pdf_path = pathlib.Path(ed.pdf_path)
             if not pdf_path.exists():
                 logger.error(f"PDF file {pdf_path} does not exist")
+                missing_urls.add(ed.url)
                 continue
-            async with aiofiles.open(pdf_path, "rb") as f:
-                pdf_bytes = await f.read()
-                pdf_reader = pdf2image.convert_from_bytes(pdf_bytes)
-                for page in pdf_reader:
-                    docs.append(
-                        datamodels.DocumentToVectorDB(
-                            doc=page,
-                            metadata=datamodels.Metadata(
-                                title=ed.title,
-                                author=ed.author,
-                                date=ed.date,
-                                url=ed.url,
-                                base64_image=image_to_base64(page),
-                            ),
-                        )
+            documents.append(
+                (ed, await asyncio.to_thread(rasterize.hash_file, pdf_path))
+            )
+        return documents, missing_urls
+
+    async def prune_deleted_documents(
+        self, extraction_metadata_file: pathlib.Path
+    ) -> list[str]:
+        """Delete the points of PDFs that are no longer in the extraction
+        metadata or whose content changed since they were indexed."""
+        documents, missing_urls = await self.hash_documents(extraction_metadata_file)
+        settings_hash = self.qdrant_settings.index_settings_hash()
+        shared_pages = self.manifest.point_pages(
+            self.manifest.shared_points(self.model_name, settings_hash),
+            self.model_name,
+            settings_hash,
+        )
+        stale_point_ids = self.manifest.remove_stale(
+            {pdf_hash for _, pdf_hash in documents},
+            missing_urls,
+            self.model_name,
+            settings_hash,
+        )
+        if stale_point_ids:
+            self.qdrant_client.delete(
+                collection_name=self.qdrant_settings.collection_name,
+                points_selector=models.PointIdsList(points=list(stale_point_ids)),
+            )
+            self.embedding_store.remove_points(stale_point_ids)
+            self.query_result_cache.clear()
+            logger.info(f"Deleted {len(stale_point_ids)} stale points from Qdrant")
+        # Shared points that lost some of their pages but are still indexed.
+        remaining_pages = self.manifest.point_pages(
+            set(shared_pages), self.model_name, settings_hash
+        )
+        changed_pages = {
+            point_id: pages
+            for point_id, pages in remaining_pages.items()
+            if pages != shared_pages[point_id]
+        }
+        if changed_pages:
+            self.update_shared_sources(set(changed_pages))
+            self.move_shared_points(changed_pages, [ed for ed, _ in documents])
+        return stale_point_ids
+
+    def move_shared_points(
+        self,
+        point_pages: dict[str, list[tuple[str, int, str]]],
+        documents: list[extract_datamodels.ExtractData],
+    ) -> int:
+        """Give shared points whose page was pruned the page and document
+        fields of the first page they still stand for."""
+        documents_by_url = {ed.url: ed for ed in documents}
+        points = self.qdrant_client.retrieve(
+            collection_name=self.qdrant_settings.collection_name,
+            ids=list(point_pages),
+            with_payload=["pdf_hash", "page_number"],
+        )
+        operations = []
+        for point in points:
+            payload = point.payload or {}
+            pages = point_pages[str(point.id)]
+            if any(
+                (pdf_hash, page_number)
+                == (payload.get("pdf_hash"), payload.get("page_number"))
+                for pdf_hash, page_number, _ in pages
+            ):
+                continue
+            pdf_hash, page_number, url = pages[0]
+            new_payload = {"pdf_hash": pdf_hash, "page_number": page_number, "url": url}
+            if (ed := documents_by_url.get(url)) is not None:
+                new_payload.update(document_metadata(ed))
+            operations.append(
+                models.SetPayloadOperation(
+                    set_payload=models.SetPayload(
+                        payload=new_payload, points=[point.id]
                     )
-        return docs
+                )
+            )
+        if operations:
+            self.qdrant_client.batch_update_points(
+                collection_name=self.qdrant_settings.collection_name,
+                update_operations=operations,
+                wait=True,
+            )
+            self.query_result_cache.clear()
+            logger.info(f"Moved {len(operations)} shared points to a remaining page")
+        return len(operations)
+
+    def update_shared_sources(self, point_ids: set[str] | None = None) -> int:
+        """Set the `sources` payload of points to every page they stand for,
+        by default of all points that duplicate pages share. Run after
+        indexing, once the shared points are upserted."""
+        settings_hash = self.qdrant_settings.index_settings_hash()
+        if point_ids is None:
+            point_ids = self.manifest.shared_points(self.model_name, settings_hash)
+        point_pages = self.manifest.point_pages(
+            point_ids, self.model_name, settings_hash
+        )
+        operations = [
+            models.SetPayloadOperation(
+                set_payload=models.SetPayload(
+                    payload={
+                        "sources": [
+                            datamodels.PageSource(
+                                pdf_hash=pdf_hash, page_number=page_number, url=url
+                            ).model_dump()
+                            for pdf_hash, page_number, url in pages
+                        ]
+                    },
+                    points=[point_id],
+                )
+            )
+            for point_id, pages in point_pages.items()
+        ]
+        if operations:
+            self.qdrant_client.batch_update_points(
+                collection_name=self.qdrant_settings.collection_name,
+                update_operations=operations,
+                wait=True,
+            )
+            self.query_result_cache.clear()
+            logger.info(f"Updated the sources of {len(operations)} shared points")
+        return len(operations)
+
+    async def update_document_payloads(
+        self, extraction_metadata_file: pathlib.Path
+    ) -> int:
+        """Set the document fields of the indexed points, see
+        `document_metadata`, of documents whose extraction metadata changed
+        since the last run, or of every document on the first run. Points are
+        not encoded again when only their metadata changed."""
+        settings_hash = self.qdrant_settings.index_settings_hash()
+        synced_at = time.time()
+        documents, _ = await self.hash_documents(
+            extraction_metadata_file,
+            updated_since=self.manifest.payloads_synced_at(
+                self.model_name, settings_hash
+            ),
+        )
+        operations = [
+            models.SetPayloadOperation(
+                set_payload=models.SetPayload(
+                    payload=document_metadata(ed),
+                    filter=models.Filter(
+                        must=[
+                            models.FieldCondition(
+                                key="pdf_hash", match=models.MatchValue(value=pdf_hash)
+                            )
+                        ]
+                    ),
+                )
+            )
+            for ed, pdf_hash in documents
+        ]
+        if operations:
+            self.qdrant_client.batch_update_points(
+                collection_name=self.qdrant_settings.collection_name,
+                update_operations=operations,
+                wait=True,
+            )
+            self.query_result_cache.clear()
+        self.manifest.record_payload_sync(self.model_name, settings_hash, synced_at)
+        return len(operations)
+
+    @abc.abstractmethod
+    def _encode_queries(
+        self, queries: list[str], batch_size: int
+    ) -> list[torch.Tensor]:
+        """Query embeddings on the CPU in input order, without padding."""
+
+    @abc.abstractmethod
+    def search_batch(
+        self,
+        query_embs: list[torch.Tensor],
+        k: int = 5,
+        filters: datamodels.SearchFilters | None = None,
+    ) -> list[list[models.ScoredPoint]]: ...
+
+    @metrics.timed("query.encode")
+    def encode_query_batch(
+        self, queries: list[str], batch_size: int = 32
+    ) -> list[torch.Tensor]:
+        """Encode queries in batches of `batch_size`, skipping those in the
+        query embedding cache, and return them in input order."""
+        keys = [cache.normalize_query(query) for query in queries]
+        query_embs: dict[str, torch.Tensor] = {}
+        missing: list[str] = []
+        for key in dict.fromkeys(keys):
+            query_emb = self.query_embedding_cache.get(key)
+            if query_emb is None:
+                missing.append(key)
+            else:
+                query_embs[key] = query_emb
+        if missing:
+            encoded = self._encode_queries(missing, batch_size)
+            for key, query_emb in zip(missing, encoded, strict=True):
+                self.query_embedding_cache.put(key, query_emb)
+                query_embs[key] = query_emb
+        return [query_embs[key] for key in keys]
+
+    def encode_query(self, query: str) -> torch.Tensor:
+        return self.encode_query_batch([query])[0]
+
+    def query_db(
+        self,
+        query: str,
+        k: int = 5,
+        load_images: bool = False,
+        filters: datamodels.SearchFilters | None = None,
+        **search_options: Any,
+    ) -> list[datamodels.QueryResult]:
+        return self.query_db_batch(
+            [query],
+            k,
+            load_images=load_images,
+            filters=filters,
+            **search_options,
+        )[0]
+
+    @metrics.timed("query.query_db")
+    def query_db_batch(
+        self,
+        queries: list[str],
+        k: int = 5,
+        batch_size: int = 32,
+        load_images: bool = False,
+        filters: datamodels.SearchFilters | None = None,
+        **search_options: Any,
+    ) -> list[list[datamodels.QueryResult]]:
+        """Answer many queries with batched encoding and a single batched
+        Qdrant request, returning one result list per query in input order.
+        `filters` restrict every query to the matching documents and
+        `search_options` are passed on to `search_batch`."""
+        options = tuple(sorted(search_options.items()))
+        result_keys = [
+            (cache.normalize_query(query), k, filters, options) for query in queries
+        ]
+        cached: dict[tuple, list[datamodels.QueryResult]] = {}
+        missing: list[tuple] = []
+        for key in dict.fromkeys(result_keys):
+            results = self.query_result_cache.get(key)
+            if results is None:
+                missing.append(key)
+            else:
+                cached[key] = results
+        query_embs = self.encode_query_batch([key[0] for key in missing], batch_size)
+        for key, points in zip(
+            missing,
+            self.search_batch(query_embs, k, filters, **search_options),
+            strict=True,
+        ):
+            cached[key] = [
+                datamodels.QueryResult(
+                    query=key[0],
+                    metadata=datamodels.Metadata(**(point.payload or {})),
+                    score=point.score,
+                )
+                for point in points
+            ]
+            self.query_result_cache.put(key, cached[key])
+        batch_results: list[list[datamodels.QueryResult]] = []
+        for query, key in zip(queries, result_keys, strict=True):
+            results = [
+                result.model_copy(update={"query": query}, deep=True)
+                for result in cached[key]
+            ]
+            if load_images:
+                results = self.load_images(results)
+            batch_results.append(results)
+        return batch_results
+
+    def cache_stats(self) -> dict[str, cache.CacheStats]:
+        return {
+            "query_embedding": self.query_embedding_cache.stats(),
+            "query_result": self.query_result_cache.stats(),
+        }
+
+    def load_images(
+        self, results: list[datamodels.QueryResult]
+    ) -> list[datamodels.QueryResult]:
+        for result in results:
+            if result.metadata.base64_image is None and result.metadata.image_key:
+                result.metadata.base64_image = self.image_store.get_base64(
+                    result.metadata.image_key
+                )
+        return results
 
     @classmethod
     def from_pretrained(
@@ -154,8 +895,11 @@ class VectorStore(abc.ABC, Generic[T]):
         model_config: settings.VisionEmbeddingModel | settings.TextEmbeddingModel,
         config: settings.DBSettings,
         qdrant_settings: settings.QdrantSettings,
+        connect: bool = True,
     ) -> T:
         if isinstance(model_config, settings.VisionEmbeddingModel):
+            from colpali_engine import models as colpali_model
+
             model = (
                 colpali_model.ColQwen2.from_pretrained(
                     model_config.name,
@@ -173,9 +917,12 @@ class VectorStore(abc.ABC, Generic[T]):
                 processor=processor,
                 db_settings=config,
                 qdrant_settings=qdrant_settings,
+                connect=connect,
             )
 
         elif isinstance(model_config, settings.TextEmbeddingModel):
+            import sentence_transformers
+
             model = sentence_transformers.SentenceTransformer(
                 model_config.name, trust_remote_code=True
             ).to(config.RAG_MODEL_DEVICE)
@@ -185,17 +932,109 @@ class VectorStore(abc.ABC, Generic[T]):
                 processor=None,
                 db_settings=config,
                 qdrant_settings=qdrant_settings,
+                connect=connect,
             )
 
 
-def image_to_base64(image):
-    buffered = BytesIO()
-    image.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-    return img_str
+def document_metadata(ed: extract_datamodels.ExtractData) -> dict[str, Any]:
+    """Payload fields every point of a document shares."""
+    date_start, date_end = datamodels.parse_date_range(ed.date)
+    return {
+        "title": ed.title,
+        "author": ed.author,
+        "date": ed.date,
+        "url": ed.url,
+        "date_start": date_start,
+        "date_end": date_end,
+        "series": ed.series,
+    }
+
+
+def processor_max_pixels(processor: object) -> int | None:
+    """The most pixels a Qwen2-VL style processor passes to the model; larger
+    images are downscaled to fit. None if the processor does not say."""
+    image_processor = getattr(processor, "image_processor", None)
+    if image_processor is None:
+        return None
+    max_pixels = getattr(image_processor, "max_pixels", None)
+    if max_pixels is None and getattr(image_processor, "size", None):
+        max_pixels = image_processor.size.get("longest_edge")
+    return max_pixels
+
+
+def load_extraction_metadata(
+    extraction_metadata_file: pathlib.Path,
+    added_since: float | None = None,
+    updated_since: float | None = None,
+) -> Iterator[extract_datamodels.ExtractData]:
+    """Stream metadata records from the extraction metadata store. Legacy
+    `.json` files are still read whole, and `added_since` and
+    `updated_since` are ignored for them since they carry no timestamps."""
+    if extraction_metadata_file.suffix == ".json":
+        with open(extraction_metadata_file, "r") as f:
+            extraction_metadata = json.load(f)
+        yield from (extract_datamodels.ExtractData(**ed) for ed in extraction_metadata)
+        return
+    with metadata_store.MetadataStore(extraction_metadata_file) as store:
+        yield from store.iter_records(
+            added_since=added_since, updated_since=updated_since
+        )
+
+
+async def iter_batches(
+    docs: (
+        list[datamodels.DocumentToVectorDB]
+        | AsyncIterable[list[datamodels.DocumentToVectorDB]]
+    ),
+    batch_size: int | Callable[[], int],
+) -> AsyncIterator[list[datamodels.DocumentToVectorDB]]:
+    """Regroup documents into batches. A callable `batch_size` is read again
+    before every batch, so it can change while iterating."""
+
+    def next_size() -> int:
+        return batch_size() if callable(batch_size) else batch_size
+
+    if isinstance(docs, list):
+        i = 0
+        while i < len(docs):
+            size = next_size()
+            yield docs[i : i + size]
+            i += size
+        return
+    buffer: list[datamodels.DocumentToVectorDB] = []
+    async for pages in docs:
+        buffer.extend(pages)
+        while len(buffer) >= (size := next_size()):
+            yield buffer[:size]
+            buffer = buffer[size:]
+    if buffer:
+        yield buffer
+
+
+def to_stored_vectors(
+    vector: torch.Tensor | dict[str, torch.Tensor],
+) -> dict[str, np.ndarray]:
+    if not isinstance(vector, dict):
+        vector = {embedding_store.UNNAMED_VECTOR: vector}
+    return {name: v.detach().float().cpu().numpy() for name, v in vector.items()}
+
+
+def from_stored_vectors(
+    vectors: dict[str, np.ndarray],
+) -> torch.Tensor | dict[str, torch.Tensor]:
+    tensors = {
+        name: torch.from_numpy(v.astype(np.float32)) for name, v in vectors.items()
+    }
+    if embedding_store.UNNAMED_VECTOR in tensors:
+        return tensors[embedding_store.UNNAMED_VECTOR]
+    return tensors
+
+
+def to_vector_struct(vectors: dict[str, np.ndarray]) -> models.VectorStruct:
+    if embedding_store.UNNAMED_VECTOR in vectors:
+        return vectors[embedding_store.UNNAMED_VECTOR].astype(np.float32).tolist()
+    return {name: v.astype(np.float32).tolist() for name, v in vectors.items()}
 
 
-def base64_to_image(base64_string):
-    img_data = base64.b64decode(base64_string)
-    img = Image.open(BytesIO(img_data))
-    return img
+image_to_base64 = rasterize.image_to_base64
+base64_to_image = rasterize.base64_to_image
@@ -0,0 +1,116 @@
+import gc
+
+import loguru
+import psutil
+import torch
+
+logger = loguru.logger
+
+OOM_MESSAGES = ("out of memory", "can't allocate memory")
+
+
+def memory_usage(device: str | torch.device) -> float:
+    """Fraction of the device's memory in use: the peak allocator
+    reservation since the last call on CUDA, driver allocations against
+    system memory on MPS, and the process RSS against system memory on CPU."""
+    device = torch.device(device)
+    if device.type == "cuda":
+        free, total = torch.cuda.mem_get_info(device)
+        peak = torch.cuda.max_memory_reserved(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        return max(peak, total - free) / total
+    if device.type == "mps":
+        return torch.mps.driver_allocated_memory() / psutil.virtual_memory().total
+    return psutil.Process().memory_info().rss / psutil.virtual_memory().total
+
+
+def clear_cache(device: str | torch.device) -> None:
+    device = torch.device(device)
+    gc.collect()
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+    elif device.type == "mps":
+        torch.mps.empty_cache()
+
+
+def is_out_of_memory(error: BaseException) -> bool:
+    if isinstance(error, (torch.cuda.OutOfMemoryError, MemoryError)):
+        return True
+    return isinstance(error, RuntimeError) and any(
+        message in str(error).lower() for message in OOM_MESSAGES
+    )
+
+
+class BatchSizer:
+    """Encoding batch size for one indexing run. Out-of-memory errors halve
+    it; in `auto` mode it doubles while pages/second improves by more than
+    `tolerance`, then settles on the fastest size."""
+
+    def __init__(
+        self,
+        batch_size: int,
+        device: str | torch.device,
+        auto: bool = False,
+        max_batch_size: int = 64,
+        memory_limit: float = 0.8,
+        tolerance: float = 0.05,
+        batches_per_size: int = 3,
+    ) -> None:
+        self.batch_size = batch_size
+        self.device = device
+        self.auto = auto
+        self.max_batch_size = max(max_batch_size, batch_size)
+        self.memory_limit = memory_limit
+        self.tolerance = tolerance
+        self.batches_per_size = batches_per_size
+        self.measured: list[tuple[int, float]] = []
+        self.best_batch_size = batch_size
+        self.best_throughput = 0.0
+        self.settled = not auto
+
+    def __call__(self) -> int:
+        return self.batch_size
+
+    def record(self, num_docs: int, elapsed: float) -> None:
+        usage = memory_usage(self.device)
+        if usage > self.memory_limit:
+            clear_cache(self.device)
+        if self.settled or num_docs < self.batch_size:
+            return
+        self.measured.append((num_docs, elapsed))
+        if len(self.measured) < self.batches_per_size:
+            return
+        # The first batch also pays for warm-up, so it is left out when
+        # more than one batch was measured.
+        measured = self.measured[1:] or self.measured
+        self.measured = []
+        throughput = sum(n for n, _ in measured) / sum(t for _, t in measured)
+        logger.info(
+            f"Batch size {self.batch_size}: {throughput:.2f} pages/s, "
+            f"{usage:.0%} memory used"
+        )
+        if throughput > self.best_throughput * (1 + self.tolerance):
+            self.best_batch_size, self.best_throughput = self.batch_size, throughput
+            if usage < self.memory_limit and self.batch_size < self.max_batch_size:
+                self.batch_size = min(2 * self.batch_size, self.max_batch_size)
+                return
+        self.settle()
+
+    def settle(self) -> None:
+        self.batch_size = self.best_batch_size
+        self.settled = True
+        logger.info(
+            f"Chose batch size {self.batch_size} "
+            f"({self.best_throughput:.2f} pages/s)"
+        )
+
+    def on_out_of_memory(self, failed_batch_size: int) -> None:
+        clear_cache(self.device)
+        self.max_batch_size = max(1, failed_batch_size // 2)
+        self.batch_size = min(self.batch_size, self.max_batch_size)
+        self.measured = []
+        self.best_batch_size = min(self.best_batch_size, self.max_batch_size)
+        logger.warning(
+            f"Out of memory encoding {failed_batch_size} documents, "
+            f"retrying with batch size {self.batch_size}"
+        )
@@ -1,28 +1,178 @@
+import calendar
+import datetime
+import re
 import pydantic
 from PIL import Image
-from typing import Any
-import torch
+from typing import TYPE_CHECKING
 import uuid
 from qdrant_client.http import models
 
+if TYPE_CHECKING:
+    import torch
+
+POINT_ID_NAMESPACE = uuid.UUID("6f0c8f1e-5f3b-4d8e-9a51-3d2b7c9e4a10")
+
+
+def point_id(
+    pdf_hash: str, page_number: int, chunk_index: int | None = None
+) -> uuid.UUID:
+    name = f"{pdf_hash}:{page_number}"
+    if chunk_index is not None:
+        name = f"{name}:{chunk_index}"
+    return uuid.uuid5(POINT_ID_NAMESPACE, name)
+
+
+MONTHS = {
+    name.lower(): month
+    for names in (calendar.month_name, calendar.month_abbr)
+    for month, name in enumerate(names)
+    if name
+}
+DATE_PATTERN = re.compile(
+    r"(?:\b(?P<month>[a-z]+)\.?\s+(?:(?P<day>\d{1,2}),?\s+)?)?"
+    r"\b(?P<year>(?:19|20)\d{2})\b",
+    re.IGNORECASE,
+)
+ISO_DATE_PATTERN = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+
+
+def format_datetime(value: datetime.datetime) -> str:
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def parse_date_range(text: str | None) -> tuple[str | None, str | None]:
+    """First and last instant, as RFC 3339 UTC timestamps, of the dates in a
+    free-form date such as "JANUARY 12, 2024", "March 2019", "2024-01-12" or
+    a list or range of years such as "1986-2004". (None, None) if `text`
+    holds no date."""
+    if not text:
+        return None, None
+    days: list[tuple[datetime.date, datetime.date]] = []
+    for year, month, day in ISO_DATE_PATTERN.findall(text):
+        try:
+            date = datetime.date(int(year), int(month), int(day))
+        except ValueError:
+            continue
+        days.append((date, date))
+    for match in DATE_PATTERN.finditer(ISO_DATE_PATTERN.sub(" ", text)):
+        year = int(match["year"])
+        month = MONTHS.get((match["month"] or "").lower())
+        if month is None:
+            days.append((datetime.date(year, 1, 1), datetime.date(year, 12, 31)))
+            continue
+        last_day = calendar.monthrange(year, month)[1]
+        if match["day"] and 1 <= int(match["day"]) <= last_day:
+            date = datetime.date(year, month, int(match["day"]))
+            days.append((date, date))
+        else:
+            days.append(
+                (datetime.date(year, month, 1), datetime.date(year, month, last_day))
+            )
+    if not days:
+        return None, None
+    start = min(first for first, _ in days)
+    end = max(last for _, last in days)
+    return (
+        format_datetime(datetime.datetime.combine(start, datetime.time.min)),
+        format_datetime(datetime.datetime.combine(end, datetime.time(23, 59, 59))),
+    )
+
+
+class PageSource(pydantic.BaseModel):
+    pdf_hash: str
+    page_number: int
+    url: str
+
 
 class Metadata(pydantic.BaseModel):
     title: str
     author: list[str]
-    date: str
+    # As extracted, and normalized by `parse_date_range` for filtering.
+    date: str | None = None
     url: str
-    base64_image: str
+    date_start: str | None = None
+    date_end: str | None = None
+    series: str | None = None
+    image_key: str | None = None
+    thumbnail_base64: str | None = None
+    base64_image: str | None = None
+    pdf_hash: str | None = None
+    page_number: int | None = None
+    text: str | None = None
+    # Every page a point stands for when duplicate pages share it.
+    sources: list[PageSource] | None = None
+
+
+class SearchFilters(pydantic.BaseModel):
+    """Restrict a search to documents dated between `date_from` and
+    `date_to`, inclusive, by any of `authors`, in any of `series` and with
+    any of `titles`. Documents whose date covers a range of years match if
+    the range overlaps. Every field is optional."""
+
+    model_config = pydantic.ConfigDict(frozen=True)
+
+    date_from: datetime.date | None = None
+    date_to: datetime.date | None = None
+    authors: tuple[str, ...] | None = None
+    series: tuple[str, ...] | None = None
+    titles: tuple[str, ...] | None = None
+
+    def to_filter(self) -> models.Filter | None:
+        conditions: list[models.Condition] = []
+        if self.date_from is not None:
+            conditions.append(
+                models.FieldCondition(
+                    key="date_end",
+                    range=models.DatetimeRange(
+                        gte=datetime.datetime.combine(
+                            self.date_from, datetime.time.min, datetime.timezone.utc
+                        )
+                    ),
+                )
+            )
+        if self.date_to is not None:
+            conditions.append(
+                models.FieldCondition(
+                    key="date_start",
+                    range=models.DatetimeRange(
+                        lte=datetime.datetime.combine(
+                            self.date_to,
+                            datetime.time(23, 59, 59),
+                            datetime.timezone.utc,
+                        )
+                    ),
+                )
+            )
+        for key, values in (
+            ("author", self.authors),
+            ("series", self.series),
+            ("title", self.titles),
+        ):
+            if values:
+                conditions.append(
+                    models.FieldCondition(
+                        key=key, match=models.MatchAny(any=list(values))
+                    )
+                )
+        return models.Filter(must=conditions) if conditions else None
 
 
 class DocumentToVectorDB(pydantic.BaseModel):
-    id: pydantic.UUID4 = pydantic.Field(default_factory=uuid.uuid4)
+    id: uuid.UUID = pydantic.Field(default_factory=uuid.uuid4)
     doc: str | Image.Image
     metadata: Metadata
 
-    def to_point(self, vector: torch.Tensor) -> models.PointStruct:
+    def to_point(
+        self, vector: "torch.Tensor | dict[str, torch.Tensor]"
+    ) -> models.PointStruct:
+        vector_struct: models.VectorStruct
+        if isinstance(vector, dict):
+            vector_struct = {name: v.tolist() for name, v in vector.items()}
+        else:
+            vector_struct = vector.tolist()
         return models.PointStruct(
             id=str(self.id),
-            vector=vector.tolist(),
+            vector=vector_struct,
             payload=self.metadata.model_dump(),
         )
 
@@ -33,6 +183,18 @@ class DocumentToVectorDB(pydantic.BaseModel):
 class QueryResult(pydantic.BaseModel):
     query: str
     metadata: Metadata
+    score: float | None = None
 
     class Config:
         arbitrary_types_allowed = True
+
+
+class UpsertReport(pydantic.BaseModel):
+    upserted_ids: list[str] = pydantic.Field(default_factory=list)
+    failed_points: list[models.PointStruct] = pydantic.Field(
+        default_factory=list, exclude=True, repr=False
+    )
+
+    @property
+    def failed_ids(self) -> list[str]:
+        return [str(point.id) for point in self.failed_points]
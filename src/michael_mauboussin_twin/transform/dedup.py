@@ -0,0 +1,152 @@
+import collections
+from typing import Generic, Hashable, NamedTuple, TypeVar
+
+import numpy as np
+from PIL import Image
+
+V = TypeVar("V", bound=Hashable)
+
+HASH_BITS = 64
+HASH_SIZE = 8
+DCT_SIZE = 32
+DETAIL_SIZE = 32
+# Re-rendered or recompressed copies of a page differ in about 5% of their
+# detail hash bits, different pages of text in the same layout in about 30%.
+MAX_DETAIL_DISTANCE = DETAIL_SIZE * DETAIL_SIZE * 10 // 100
+INK_SAMPLE_WIDTH = 256
+INK_CONTRAST = 48
+
+
+class PageFingerprint(NamedTuple):
+    """Hashes of a page and the share of its pixels that stand out from the
+    background. `phash` is indexed; `detail_hash` confirms a match, since
+    text pages in one layout differ in few `phash` bits."""
+
+    phash: int
+    detail_hash: int
+    ink_coverage: float
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    k = np.arange(size)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * size))
+    matrix[0] /= np.sqrt(2)
+    return matrix * np.sqrt(2 / size)
+
+
+DCT_MATRIX = _dct_matrix(DCT_SIZE)
+
+
+def _to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def perceptual_hash(gray: Image.Image) -> int:
+    pixels = np.asarray(
+        gray.resize((DCT_SIZE, DCT_SIZE), Image.Resampling.BOX), dtype=np.float64
+    )
+    low_frequencies = (DCT_MATRIX @ pixels @ DCT_MATRIX.T)[:HASH_SIZE, :HASH_SIZE]
+    coefficients = low_frequencies.flatten()
+    # The DC term only carries the mean brightness.
+    return _to_int(coefficients > np.median(coefficients[1:]))
+
+
+def detail_hash(gray: Image.Image) -> int:
+    pixels = np.asarray(
+        gray.resize((DETAIL_SIZE + 1, DETAIL_SIZE), Image.Resampling.BOX),
+        dtype=np.float64,
+    )
+    return _to_int((pixels[:, 1:] > pixels[:, :-1]).flatten())
+
+
+def ink_coverage(gray: Image.Image) -> float:
+    """Share of pixels that differ from the page background, the median
+    brightness, by more than `INK_CONTRAST` levels. Sampled at a width of
+    `INK_SAMPLE_WIDTH` pixels, enough to keep a line of body text."""
+    height = max(1, round(gray.height * INK_SAMPLE_WIDTH / gray.width))
+    pixels = np.asarray(
+        gray.resize((INK_SAMPLE_WIDTH, height), Image.Resampling.BOX),
+        dtype=np.int16,
+    )
+    background = np.median(pixels)
+    return float(np.mean(np.abs(pixels - background) > INK_CONTRAST))
+
+
+def fingerprint(image: Image.Image) -> PageFingerprint:
+    gray = image.convert("L")
+    return PageFingerprint(perceptual_hash(gray), detail_hash(gray), ink_coverage(gray))
+
+
+def is_blank(page: PageFingerprint, max_ink_coverage: float) -> bool:
+    return page.ink_coverage <= max_ink_coverage
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class HammingIndex(Generic[V]):
+    """Finds the stored hashes within `max_distance` bits of a query hash by
+    multi-index hashing over `max_distance + 1` bands."""
+
+    def __init__(self, max_distance: int, bits: int = HASH_BITS) -> None:
+        if not 0 <= max_distance < bits:
+            raise ValueError(f"max_distance must be between 0 and {bits - 1}")
+        self.max_distance = max_distance
+        num_bands = max_distance + 1
+        edges = [round(i * bits / num_bands) for i in range(num_bands + 1)]
+        self.bands = [
+            (start, (1 << (end - start)) - 1)
+            for start, end in zip(edges[:-1], edges[1:])
+        ]
+        self.tables: list[dict[int, list[int]]] = [
+            collections.defaultdict(list) for _ in self.bands
+        ]
+        self.hashes: list[int] = []
+        self.values: list[V] = []
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def add(self, hash_: int, value: V) -> None:
+        position = len(self.hashes)
+        self.hashes.append(hash_)
+        self.values.append(value)
+        for table, (shift, mask) in zip(self.tables, self.bands):
+            table[(hash_ >> shift) & mask].append(position)
+
+    def search(self, hash_: int) -> list[tuple[V, int]]:
+        """Values and distances of the stored hashes within `max_distance`,
+        closest first."""
+        candidates = {
+            position
+            for table, (shift, mask) in zip(self.tables, self.bands)
+            for position in table.get((hash_ >> shift) & mask, ())
+        }
+        matches = [
+            (self.values[position], distance)
+            for position in candidates
+            if (distance := hamming_distance(hash_, self.hashes[position]))
+            <= self.max_distance
+        ]
+        return sorted(matches, key=lambda match: match[1])
+
+
+class DuplicateIndex:
+    """Point ids of the pages seen so far, looked up by fingerprint."""
+
+    def __init__(self, max_distance: int) -> None:
+        self.index: HammingIndex[tuple[str, int]] = HammingIndex(max_distance)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def add(self, page: PageFingerprint, point_id: str) -> None:
+        self.index.add(page.phash, (point_id, page.detail_hash))
+
+    def find(self, page: PageFingerprint) -> str | None:
+        """Point id of a page that `page` duplicates, if any."""
+        for (point_id, detail), _ in self.index.search(page.phash):
+            if hamming_distance(page.detail_hash, detail) <= MAX_DETAIL_DISTANCE:
+                return point_id
+        return None
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import pathlib
+import sqlite3
+import threading
+from typing import Iterable, Iterator
+
+import numpy as np
+
+UNNAMED_VECTOR = ""
+
+
+def content_key(image_key: str | None, text: str | None) -> str | None:
+    """Key of the content a point was encoded from: the page image key, or
+    the sha256 of the text chunk."""
+    if image_key is not None:
+        return image_key
+    if text is not None:
+        return hashlib.sha256(text.encode()).hexdigest()
+    return None
+
+
+class EmbeddingStore:
+    """Model outputs as float16 in memory-mapped shard files, indexed in
+    SQLite with the payloads of their points, so a collection can be rebuilt
+    without the model. Only one process may write to a store."""
+
+    def __init__(
+        self, root: str | pathlib.Path, max_shard_bytes: int = 1 << 30
+    ) -> None:
+        self.root = pathlib.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_shard_bytes = max_shard_bytes
+        self.connection = sqlite3.connect(
+            self.root / "index.sqlite", check_same_thread=False
+        )
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                content_key TEXT NOT NULL,
+                model_name TEXT NOT NULL,
+                config TEXT NOT NULL,
+                vector_name TEXT NOT NULL,
+                shard INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                rows INTEGER,
+                dim INTEGER NOT NULL,
+                PRIMARY KEY (content_key, model_name, config, vector_name)
+            );
+            CREATE TABLE IF NOT EXISTS points (
+                point_id TEXT NOT NULL,
+                model_name TEXT NOT NULL,
+                config TEXT NOT NULL,
+                content_key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                PRIMARY KEY (point_id, model_name, config)
+            );
+            """)
+        self.connection.commit()
+        (shard,) = self.connection.execute(
+            "SELECT COALESCE(MAX(shard), 0) FROM embeddings"
+        ).fetchone()
+        self.shard = shard
+        self._memmaps: dict[int, np.memmap] = {}
+        self._lock = threading.Lock()
+
+    def shard_path(self, shard: int) -> pathlib.Path:
+        return self.root / f"shard-{shard:05d}.f16"
+
+    def get_many(
+        self, content_keys: Iterable[str], model_name: str, config: str
+    ) -> dict[str, dict[str, np.ndarray]]:
+        """Vectors by name for every content key found in the store."""
+        content_keys = list(dict.fromkeys(content_keys))
+        vectors: dict[str, dict[str, np.ndarray]] = {}
+        with self._lock:
+            for i in range(0, len(content_keys), 500):
+                batch = content_keys[i : i + 500]
+                rows = self.connection.execute(
+                    "SELECT content_key, vector_name, shard, offset, rows, dim"
+                    " FROM embeddings WHERE model_name = ? AND config = ?"
+                    f" AND content_key IN ({', '.join('?' * len(batch))})",
+                    (model_name, config, *batch),
+                )
+                for key, vector_name, shard, offset, num_rows, dim in rows:
+                    end = offset + (num_rows or 1) * dim
+                    data = self._memmap(shard, end)[offset:end]
+                    shape = (num_rows, dim) if num_rows is not None else (dim,)
+                    vectors.setdefault(key, {})[vector_name] = data.reshape(shape)
+        return vectors
+
+    def put_many(
+        self,
+        items: Iterable[tuple[str, dict[str, np.ndarray]]],
+        model_name: str,
+        config: str,
+    ) -> None:
+        with self._lock:
+            path = self.shard_path(self.shard)
+            if path.exists() and path.stat().st_size >= self.max_shard_bytes:
+                self.shard += 1
+                path = self.shard_path(self.shard)
+            rows = []
+            with open(path, "ab") as f:
+                for key, vectors in items:
+                    for vector_name, vector in vectors.items():
+                        offset = f.tell() // 2
+                        f.write(np.ascontiguousarray(vector, np.float16).tobytes())
+                        rows.append(
+                            (
+                                key,
+                                model_name,
+                                config,
+                                vector_name,
+                                self.shard,
+                                offset,
+                                vector.shape[0] if vector.ndim == 2 else None,
+                                vector.shape[-1],
+                            )
+                        )
+            self._memmaps.pop(self.shard, None)
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.connection.commit()
+
+    def record_points(
+        self,
+        points: Iterable[tuple[str, str, dict]],
+        model_name: str,
+        config: str,
+    ) -> None:
+        """Remember the (point id, content key, payload) of upserted points."""
+        with self._lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO points VALUES (?, ?, ?, ?, ?)",
+                [
+                    (point_id, model_name, config, key, json.dumps(payload))
+                    for point_id, key, payload in points
+                ],
+            )
+            self.connection.commit()
+
+    def iter_points(
+        self, model_name: str, config: str, batch_size: int = 256
+    ) -> Iterator[list[tuple[str, dict, dict[str, np.ndarray]]]]:
+        """Stream batches of (point id, payload, vectors by name) of every
+        recorded point whose vectors are in the store."""
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT point_id, content_key, payload FROM points"
+                " WHERE model_name = ? AND config = ? ORDER BY rowid",
+                (model_name, config),
+            ).fetchall()
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i : i + batch_size]
+            vectors = self.get_many((key for _, key, _ in batch), model_name, config)
+            yield [
+                (point_id, json.loads(payload), vectors[key])
+                for point_id, key, payload in batch
+                if key in vectors
+            ]
+
+    def remove_points(self, point_ids: Iterable[str]) -> None:
+        with self._lock:
+            self.connection.executemany(
+                "DELETE FROM points WHERE point_id = ?",
+                [(point_id,) for point_id in point_ids],
+            )
+            self.connection.commit()
+
+    def counts(self, model_name: str, config: str) -> tuple[int, int]:
+        """Number of stored contents and recorded points."""
+        with self._lock:
+            (num_contents,) = self.connection.execute(
+                "SELECT COUNT(DISTINCT content_key) FROM embeddings"
+                " WHERE model_name = ? AND config = ?",
+                (model_name, config),
+            ).fetchone()
+            (num_points,) = self.connection.execute(
+                "SELECT COUNT(*) FROM points WHERE model_name = ? AND config = ?",
+                (model_name, config),
+            ).fetchone()
+        return num_contents, num_points
+
+    def _memmap(self, shard: int, min_size: int = 0) -> np.memmap:
+        # Another process may have appended to the shard since it was mapped.
+        if shard not in self._memmaps or len(self._memmaps[shard]) < min_size:
+            self._memmaps[shard] = np.memmap(
+                self.shard_path(shard), dtype=np.float16, mode="r"
+            )
+        return self._memmaps[shard]
+
+    def close(self) -> None:
+        self._memmaps.clear()
+        self.connection.close()
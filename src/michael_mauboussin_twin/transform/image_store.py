@@ -0,0 +1,68 @@
+import base64
+import hashlib
+import os
+import pathlib
+import tempfile
+from io import BytesIO
+
+from PIL import Image
+
+from michael_mauboussin_twin import metrics
+
+
+class ImageStore:
+    """Page images on local disk, stored once under the sha256 of their
+    encoded bytes."""
+
+    def __init__(
+        self,
+        root: str | pathlib.Path,
+        image_format: str = "PNG",
+        quality: int = 85,
+    ) -> None:
+        self.root = pathlib.Path(root)
+        self.image_format = image_format
+        self.quality = quality
+
+    @staticmethod
+    def key_for(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def path_for(self, key: str) -> pathlib.Path:
+        return self.root / key[:2] / key[2:]
+
+    def __contains__(self, key: str) -> bool:
+        return self.path_for(key).exists()
+
+    def put(self, data: bytes) -> str:
+        key = self.key_for(data)
+        path = self.path_for(key)
+        if path.exists():
+            return key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return key
+
+    @metrics.timed("rasterize.image_store_put")
+    def put_image(self, image: Image.Image) -> str:
+        buffered = BytesIO()
+        if self.image_format != "PNG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(buffered, format=self.image_format, quality=self.quality)
+        return self.put(buffered.getvalue())
+
+    def get_bytes(self, key: str) -> bytes:
+        return self.path_for(key).read_bytes()
+
+    def get_image(self, key: str) -> Image.Image:
+        return Image.open(self.path_for(key))
+
+    def get_base64(self, key: str) -> str:
+        return base64.b64encode(self.get_bytes(key)).decode("utf-8")
@@ -0,0 +1,256 @@
+import pathlib
+import sqlite3
+from typing import Iterable, Iterator, NamedTuple
+
+from qdrant_client.http import models
+
+from michael_mauboussin_twin.transform import dedup
+
+
+class PageRecords(NamedTuple):
+    """(pdf hash, page number, fingerprint, blank) of rendered pages and
+    (pdf hash, page number, shared point id, url) of pages that duplicate
+    an indexed page."""
+
+    fingerprints: list[tuple[str, int, dedup.PageFingerprint, bool]]
+    duplicates: list[tuple[str, int, str, str]]
+
+
+class IndexManifest:
+    """SQLite record of the points already written to a collection, keyed by
+    (pdf hash, page number, model name, index settings hash, point id).
+    Duplicate pages share the point id of the page they duplicate."""
+
+    def __init__(self, path: str | pathlib.Path) -> None:
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Shard workers read the manifest while the coordinator writes it.
+        self.connection = sqlite3.connect(self.path, timeout=30.0)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                pdf_hash TEXT NOT NULL,
+                page_number INTEGER NOT NULL,
+                model_name TEXT NOT NULL,
+                settings_hash TEXT NOT NULL,
+                point_id TEXT NOT NULL,
+                url TEXT NOT NULL,
+                PRIMARY KEY (pdf_hash, page_number, model_name, settings_hash, point_id)
+            )
+            """)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                pdf_hash TEXT NOT NULL,
+                page_number INTEGER NOT NULL,
+                phash TEXT NOT NULL,
+                detail_hash TEXT NOT NULL,
+                ink_coverage REAL NOT NULL,
+                blank INTEGER NOT NULL,
+                PRIMARY KEY (pdf_hash, page_number)
+            )
+            """)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS payload_syncs (
+                model_name TEXT NOT NULL,
+                settings_hash TEXT NOT NULL,
+                synced_at REAL NOT NULL,
+                PRIMARY KEY (model_name, settings_hash)
+            )
+            """)
+        self.connection.commit()
+
+    def indexed_pages(
+        self, pdf_hash: str, model_name: str, settings_hash: str
+    ) -> set[int]:
+        rows = self.connection.execute(
+            "SELECT page_number FROM pages"
+            " WHERE pdf_hash = ? AND model_name = ? AND settings_hash = ?",
+            (pdf_hash, model_name, settings_hash),
+        )
+        return {page_number for (page_number,) in rows}
+
+    def indexed_point_ids(
+        self, pdf_hash: str, model_name: str, settings_hash: str
+    ) -> set[str]:
+        rows = self.connection.execute(
+            "SELECT point_id FROM pages"
+            " WHERE pdf_hash = ? AND model_name = ? AND settings_hash = ?",
+            (pdf_hash, model_name, settings_hash),
+        )
+        return {point_id for (point_id,) in rows}
+
+    def blank_pages(self, pdf_hash: str) -> set[int]:
+        rows = self.connection.execute(
+            "SELECT page_number FROM fingerprints WHERE pdf_hash = ? AND blank",
+            (pdf_hash,),
+        )
+        return {page_number for (page_number,) in rows}
+
+    def record_fingerprints(
+        self, rows: Iterable[tuple[str, int, dedup.PageFingerprint, bool]]
+    ) -> None:
+        """Record (pdf hash, page number, fingerprint, blank) of pages."""
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    pdf_hash,
+                    page_number,
+                    f"{page.phash:x}",
+                    f"{page.detail_hash:x}",
+                    page.ink_coverage,
+                    blank,
+                )
+                for pdf_hash, page_number, page, blank in rows
+            ],
+        )
+        self.connection.commit()
+
+    def indexed_fingerprints(
+        self, model_name: str, settings_hash: str
+    ) -> Iterator[tuple[dedup.PageFingerprint, str]]:
+        """Fingerprints of the indexed pages with the id of the point that
+        indexes them."""
+        rows = self.connection.execute(
+            "SELECT f.phash, f.detail_hash, f.ink_coverage, p.point_id"
+            " FROM fingerprints f JOIN pages p"
+            " ON f.pdf_hash = p.pdf_hash AND f.page_number = p.page_number"
+            " WHERE p.model_name = ? AND p.settings_hash = ?"
+            " AND NOT f.blank",
+            (model_name, settings_hash),
+        )
+        for phash, detail_hash, ink_coverage, point_id in rows:
+            yield dedup.PageFingerprint(
+                int(phash, 16), int(detail_hash, 16), ink_coverage
+            ), point_id
+
+    def record_duplicates(
+        self,
+        rows: Iterable[tuple[str, int, str, str]],
+        model_name: str,
+        settings_hash: str,
+    ) -> None:
+        """Record (pdf hash, page number, point id, url) of pages that are
+        indexed by the point of the page they duplicate."""
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (pdf_hash, page_number, model_name, settings_hash, point_id, url)
+                for pdf_hash, page_number, point_id, url in rows
+            ],
+        )
+        self.connection.commit()
+
+    def shared_points(self, model_name: str, settings_hash: str) -> set[str]:
+        """Point ids that several pages share."""
+        rows = self.connection.execute(
+            "SELECT point_id FROM pages WHERE model_name = ? AND settings_hash = ?"
+            " GROUP BY point_id HAVING COUNT(*) > 1",
+            (model_name, settings_hash),
+        )
+        return {point_id for (point_id,) in rows}
+
+    def point_pages(
+        self, point_ids: set[str], model_name: str, settings_hash: str
+    ) -> dict[str, list[tuple[str, int, str]]]:
+        """(pdf hash, page number, url) of the pages each point stands for,
+        in the order they were recorded."""
+        rows = self.connection.execute(
+            "SELECT point_id, pdf_hash, page_number, url FROM pages"
+            " WHERE model_name = ? AND settings_hash = ? ORDER BY rowid",
+            (model_name, settings_hash),
+        )
+        pages: dict[str, list[tuple[str, int, str]]] = {}
+        for point_id, pdf_hash, page_number, url in rows:
+            if point_id in point_ids:
+                pages.setdefault(point_id, []).append((pdf_hash, page_number, url))
+        return pages
+
+    def record(
+        self,
+        points: Iterable[models.PointStruct],
+        model_name: str,
+        settings_hash: str,
+    ) -> None:
+        rows = [
+            (
+                payload["pdf_hash"],
+                payload["page_number"],
+                model_name,
+                settings_hash,
+                str(point.id),
+                payload["url"],
+            )
+            for point in points
+            if (payload := point.payload or {}).get("pdf_hash") is not None
+        ]
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+        self.connection.commit()
+
+    def remove_stale(
+        self,
+        current_hashes: set[str],
+        kept_urls: set[str],
+        model_name: str,
+        settings_hash: str,
+    ) -> list[str]:
+        """Forget pages of PDFs whose hash is no longer current, unless their
+        URL is in `kept_urls`, and return the point ids no longer referenced
+        by any remaining page."""
+        rows = self.connection.execute(
+            "SELECT pdf_hash, url, point_id FROM pages"
+            " WHERE model_name = ? AND settings_hash = ?",
+            (model_name, settings_hash),
+        ).fetchall()
+        stale = [
+            (pdf_hash, point_id)
+            for pdf_hash, url, point_id in rows
+            if pdf_hash not in current_hashes and url not in kept_urls
+        ]
+        stale_hashes = {pdf_hash for pdf_hash, _ in stale}
+        live_point_ids = {
+            point_id for pdf_hash, _, point_id in rows if pdf_hash not in stale_hashes
+        }
+        self.connection.executemany(
+            "DELETE FROM pages"
+            " WHERE pdf_hash = ? AND model_name = ? AND settings_hash = ?",
+            [(pdf_hash, model_name, settings_hash) for pdf_hash in stale_hashes],
+        )
+        self.connection.commit()
+        return sorted(
+            {point_id for _, point_id in stale if point_id not in live_point_ids}
+        )
+
+    def payloads_synced_at(self, model_name: str, settings_hash: str) -> float | None:
+        """When the document payloads of the points were last brought up to
+        date with the extraction metadata, None if never."""
+        row = self.connection.execute(
+            "SELECT synced_at FROM payload_syncs"
+            " WHERE model_name = ? AND settings_hash = ?",
+            (model_name, settings_hash),
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def record_payload_sync(
+        self, model_name: str, settings_hash: str, synced_at: float
+    ) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO payload_syncs VALUES (?, ?, ?)",
+            (model_name, settings_hash, synced_at),
+        )
+        self.connection.commit()
+
+    def counts(self, model_name: str, settings_hash: str) -> tuple[int, int, int]:
+        """Number of indexed PDFs, pages and points."""
+        return self.connection.execute(
+            "SELECT COUNT(DISTINCT pdf_hash),"
+            " COUNT(DISTINCT pdf_hash || ':' || page_number),"
+            " COUNT(DISTINCT point_id)"
+            " FROM pages WHERE model_name = ? AND settings_hash = ?",
+            (model_name, settings_hash),
+        ).fetchone()
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,59 @@
+from typing import Literal
+
+import numpy as np
+import torch
+from scipy.cluster import hierarchy
+
+PoolingMethod = Literal["hierarchical", "sequential"]
+
+
+def strip_padding(embedding: torch.Tensor) -> torch.Tensor:
+    # ColQwen2 zeroes the embeddings of padding tokens in a batch.
+    return embedding[embedding.norm(dim=-1) > 0]
+
+
+def mean_pool(embedding: torch.Tensor) -> torch.Tensor:
+    return torch.nn.functional.normalize(
+        strip_padding(embedding).float().mean(dim=0), dim=-1
+    )
+
+
+def pool_embedding(
+    embedding: torch.Tensor,
+    pool_factor: int,
+    method: PoolingMethod = "hierarchical",
+) -> torch.Tensor:
+    """Reduce a (num_tokens, dim) multivector to about num_tokens / pool_factor
+    vectors, either by clustering similar patch embeddings (hierarchical) or by
+    averaging runs of consecutive tokens (sequential)."""
+    embedding = strip_padding(embedding)
+    num_tokens = embedding.shape[0]
+    num_clusters = max(1, num_tokens // pool_factor)
+    if pool_factor <= 1 or num_tokens <= num_clusters:
+        return embedding
+    if method == "sequential":
+        groups = torch.arange(num_tokens, device=embedding.device) // pool_factor
+    elif method == "hierarchical":
+        vectors = embedding.float().cpu().numpy()
+        distances = np.clip(1 - vectors @ vectors.T, 0, None)
+        condensed = distances[np.triu_indices(num_tokens, k=1)]
+        linkage = hierarchy.linkage(condensed, method="ward")
+        clusters = hierarchy.fcluster(linkage, t=num_clusters, criterion="maxclust")
+        groups = torch.from_numpy(clusters - 1).to(embedding.device)
+    else:
+        raise ValueError(f"Unknown pooling method {method}")
+    num_groups = int(groups.max()) + 1
+    pooled = torch.zeros(
+        num_groups, embedding.shape[1], dtype=embedding.dtype, device=embedding.device
+    )
+    pooled.index_add_(0, groups, embedding)
+    counts = torch.bincount(groups, minlength=num_groups).unsqueeze(1)
+    return pooled / counts.to(embedding.dtype)
+
+
+def pool_embeddings(
+    embeddings: torch.Tensor | list[torch.Tensor],
+    pool_factor: int,
+    method: PoolingMethod = "hierarchical",
+) -> list[torch.Tensor]:
+    return [pool_embedding(embedding, pool_factor, method) for embedding in embeddings]
@@ -0,0 +1,234 @@
+import asyncio
+import base64
+import collections
+import concurrent.futures
+import hashlib
+import math
+import pathlib
+import re
+from io import BytesIO
+from typing import Any, AsyncIterator, NamedTuple
+
+import pdf2image
+from PIL import Image
+
+from michael_mauboussin_twin import metrics
+from michael_mauboussin_twin.transform import dedup, image_store
+
+THUMBNAIL_SIZE = (256, 256)
+# pdf2image's default.
+DEFAULT_DPI = 200
+PAGE_SIZE_PATTERN = re.compile(r"([\d.]+) x ([\d.]+) pts")
+
+
+class RenderOptions(NamedTuple):
+    """How pages are rendered and stored. Without `dpi`, pages are rendered
+    at `oversampling` times the processor's `max_pixels` resolution, capped
+    at `max_dpi`."""
+
+    dpi: int | None = None
+    max_pixels: int | None = None
+    oversampling: float = 2.0
+    max_dpi: int = DEFAULT_DPI
+    image_format: str = "PNG"
+    quality: int = 85
+
+
+class RenderedPage(NamedTuple):
+    image: Image.Image
+    image_key: str
+    thumbnail_base64: str
+    fingerprint: dedup.PageFingerprint
+
+
+class PageWindow(NamedTuple):
+    pdf_index: int
+    pdf_path: pathlib.Path
+    first_page: int
+    last_page: int
+    dpi: int
+
+
+@metrics.timed("rasterize.image_to_base64")
+def image_to_base64(image: Image.Image) -> str:
+    buffered = BytesIO()
+    image.save(buffered, format="PNG")
+    img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
+    return img_str
+
+
+def base64_to_image(base64_string: str) -> Image.Image:
+    img_data = base64.b64decode(base64_string)
+    img = Image.open(BytesIO(img_data))
+    return img
+
+
+@metrics.timed("rasterize.thumbnail")
+def image_to_thumbnail_base64(
+    image: Image.Image, size: tuple[int, int] = THUMBNAIL_SIZE
+) -> str:
+    thumbnail = image.convert("RGB")
+    thumbnail.thumbnail(size)
+    buffered = BytesIO()
+    thumbnail.save(buffered, format="JPEG", quality=70)
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+
+@metrics.timed("rasterize.fingerprint")
+def fingerprint(image: Image.Image) -> dedup.PageFingerprint:
+    return dedup.fingerprint(image)
+
+
+def hash_file(path: pathlib.Path, chunk_size: int = 1 << 20) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def page_windows(page_numbers: list[int], window_size: int) -> list[tuple[int, int]]:
+    """Split sorted page numbers into (first_page, last_page) runs of
+    consecutive pages no longer than `window_size`."""
+    windows: list[tuple[int, int]] = []
+    for page_number in page_numbers:
+        if windows:
+            first_page, last_page = windows[-1]
+            if (
+                page_number == last_page + 1
+                and last_page - first_page + 1 < window_size
+            ):
+                windows[-1] = (first_page, page_number)
+                continue
+        windows.append((page_number, page_number))
+    return windows
+
+
+def pdf_info(pdf_path: pathlib.Path) -> tuple[int, tuple[float, float] | None]:
+    """Number of pages and the size in points of the first page."""
+    info = pdf2image.pdfinfo_from_path(str(pdf_path))
+    match = PAGE_SIZE_PATTERN.match(info.get("Page size", ""))
+    page_size = (float(match[1]), float(match[2])) if match else None
+    return info["Pages"], page_size
+
+
+def target_dpi(page_size: tuple[float, float] | None, options: RenderOptions) -> int:
+    """DPI at which a page of `page_size` points is rendered."""
+    if options.dpi is not None:
+        return options.dpi
+    if options.max_pixels is None or page_size is None:
+        return options.max_dpi
+    width, height = page_size
+    dpi = math.ceil(
+        options.oversampling * 72 * math.sqrt(options.max_pixels / (width * height))
+    )
+    return max(1, min(dpi, options.max_dpi))
+
+
+def render_pages(
+    pdf_path: pathlib.Path,
+    first_page: int,
+    last_page: int,
+    image_store_root: pathlib.Path,
+    dpi: int = DEFAULT_DPI,
+    image_format: str = "PNG",
+    quality: int = 85,
+) -> list[RenderedPage]:
+    store = image_store.ImageStore(image_store_root, image_format, quality)
+    with metrics.span("rasterize.pdf2image"):
+        pages = pdf2image.convert_from_path(
+            pdf_path, dpi=dpi, first_page=first_page, last_page=last_page
+        )
+    metrics.inc("rasterize.pages", len(pages))
+    return [
+        RenderedPage(
+            page,
+            store.put_image(page),
+            image_to_thumbnail_base64(page),
+            fingerprint(page),
+        )
+        for page in pages
+    ]
+
+
+def _render_pages_with_metrics(*args: Any) -> tuple[list[RenderedPage], dict]:
+    """`render_pages` in a pool worker, returning the worker's metrics so
+    the parent can merge them."""
+    metrics.enable()
+    metrics.reset()
+    pages = render_pages(*args)
+    return pages, metrics.snapshot()
+
+
+def _merge_metrics(result: Any, collect_metrics: bool) -> list[RenderedPage]:
+    if not collect_metrics:
+        return result
+    pages, worker_metrics = result
+    metrics.merge(worker_metrics)
+    return pages
+
+
+async def rasterize_pdfs(
+    pdf_paths: list[pathlib.Path],
+    image_store_root: pathlib.Path,
+    max_pages_in_flight: int = 8,
+    num_workers: int = 1,
+    skip_pages: list[set[int]] | None = None,
+    options: RenderOptions = RenderOptions(),
+) -> AsyncIterator[tuple[PageWindow, list[RenderedPage]]]:
+    """Render page windows of several PDFs in a process pool, at most
+    `max_pages_in_flight` pages ahead of the consumer, and yield them in
+    document and page order. Pages in `skip_pages[i]` of `pdf_paths[i]` are
+    not rendered."""
+    if max_pages_in_flight < 1 or num_workers < 1:
+        raise ValueError("max_pages_in_flight and num_workers must be at least 1")
+    window_size = max(1, max_pages_in_flight // num_workers)
+    max_pending = max(1, max_pages_in_flight // window_size)
+    loop = asyncio.get_running_loop()
+    executor = (
+        concurrent.futures.ProcessPoolExecutor(max_workers=num_workers)
+        if num_workers > 1
+        else concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    )
+    collect_metrics = num_workers > 1 and metrics.enabled()
+
+    async def windows() -> AsyncIterator[PageWindow]:
+        for pdf_index, pdf_path in enumerate(pdf_paths):
+            num_pages, page_size = await loop.run_in_executor(
+                executor, pdf_info, pdf_path
+            )
+            dpi = target_dpi(page_size, options)
+            skip = skip_pages[pdf_index] if skip_pages else set()
+            page_numbers = [p for p in range(1, num_pages + 1) if p not in skip]
+            for first_page, last_page in page_windows(page_numbers, window_size):
+                yield PageWindow(pdf_index, pdf_path, first_page, last_page, dpi)
+
+    pending: collections.deque[tuple[PageWindow, asyncio.Future]] = collections.deque()
+    try:
+        async for window in windows():
+            pending.append(
+                (
+                    window,
+                    loop.run_in_executor(
+                        executor,
+                        _render_pages_with_metrics if collect_metrics else render_pages,
+                        window.pdf_path,
+                        window.first_page,
+                        window.last_page,
+                        image_store_root,
+                        window.dpi,
+                        options.image_format,
+                        options.quality,
+                    ),
+                )
+            )
+            if len(pending) >= max_pending:
+                done_window, future = pending.popleft()
+                yield done_window, _merge_metrics(await future, collect_metrics)
+        while pending:
+            done_window, future = pending.popleft()
+            yield done_window, _merge_metrics(await future, collect_metrics)
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
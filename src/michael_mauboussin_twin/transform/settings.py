@@ -1,9 +1,26 @@
 import pydantic_settings
 import pydantic
-from typing import NamedTuple
+from typing import Literal, NamedTuple
+import qdrant_client
 from qdrant_client.http import models
+import hashlib
+import httpx
 import os
 
+MULTI_VECTOR_NAME = "multivector"
+PREFETCH_VECTOR_NAME = "mean_pooled"
+QUERY_SETTINGS = {"prefetch_limit", "hnsw_ef", "exact", "rescore", "oversampling"}
+# Payload fields search filters use, indexed so filtered searches stay on
+# the HNSW index instead of scanning payloads.
+PAYLOAD_INDEXES = {
+    "title": models.PayloadSchemaType.KEYWORD,
+    "author": models.PayloadSchemaType.KEYWORD,
+    "series": models.PayloadSchemaType.KEYWORD,
+    "pdf_hash": models.PayloadSchemaType.KEYWORD,
+    "date_start": models.PayloadSchemaType.DATETIME,
+    "date_end": models.PayloadSchemaType.DATETIME,
+}
+
 
 class VisionEmbeddingModel(NamedTuple):
     name: str = "vidore/colqwen2-v1.0"
@@ -14,10 +31,59 @@ class TextEmbeddingModel(NamedTuple):
     query_prompt_name: str | None = "s2p_query"
 
 
+class QuantizationProfile(NamedTuple):
+    """How vectors are quantized, and whether the originals (`on_disk`) and
+    quantized vectors (`always_ram`) live on disk or in RAM."""
+
+    name: Literal["int8", "binary", "product", "none"] = "int8"
+    on_disk: bool = False
+    always_ram: bool = True
+    compression: models.CompressionRatio = models.CompressionRatio.X16
+
+
+QUANTIZATION_PROFILES = {
+    "int8": QuantizationProfile("int8"),
+    "int8-disk": QuantizationProfile("int8", on_disk=True),
+    "binary": QuantizationProfile("binary"),
+    "binary-disk": QuantizationProfile("binary", on_disk=True),
+    "product": QuantizationProfile("product"),
+    "product-disk": QuantizationProfile("product", on_disk=True),
+    "none": QuantizationProfile("none"),
+    "none-disk": QuantizationProfile("none", on_disk=True),
+}
+
+
+def get_quantization_config(
+    profile: QuantizationProfile,
+) -> models.QuantizationConfig | None:
+    if profile.name == "int8":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8,
+                quantile=0.99,
+                always_ram=profile.always_ram,
+            ),
+        )
+    if profile.name == "binary":
+        return models.BinaryQuantization(
+            binary=models.BinaryQuantizationConfig(always_ram=profile.always_ram)
+        )
+    if profile.name == "product":
+        return models.ProductQuantization(
+            product=models.ProductQuantizationConfig(
+                compression=profile.compression, always_ram=profile.always_ram
+            )
+        )
+    return None
+
+
 def get_default_multi_vector_config(
     vector_size: int,
     indexing_threshold: int = 100,
-) -> tuple[models.VectorParams, models.ScalarQuantization, models.OptimizersConfigDiff]:
+    quantization: QuantizationProfile = QuantizationProfile(),
+) -> tuple[
+    models.VectorParams, models.QuantizationConfig | None, models.OptimizersConfigDiff
+]:
 
     optimizers_config = models.OptimizersConfigDiff(
         indexing_threshold=indexing_threshold
@@ -29,21 +95,21 @@ def get_default_multi_vector_config(
         multivector_config=models.MultiVectorConfig(
             comparator=models.MultiVectorComparator.MAX_SIM
         ),
+        # None rather than False keeps the settings hash of existing
+        # in-RAM collections unchanged.
+        on_disk=quantization.on_disk or None,
     )
-    quantization_config = models.ScalarQuantization(
-        scalar=models.ScalarQuantizationConfig(
-            type=models.ScalarType.INT8,
-            quantile=0.99,
-            always_ram=True,
-        ),
-    )
+    quantization_config = get_quantization_config(quantization)
     return vectors_config, quantization_config, optimizers_config
 
 
 def get_default_single_vector_config(
     vector_size: int,
     indexing_threshold: int = 100,
-) -> tuple[models.VectorParams, models.ScalarQuantization, models.OptimizersConfigDiff]:
+    quantization: QuantizationProfile = QuantizationProfile(),
+) -> tuple[
+    models.VectorParams, models.QuantizationConfig | None, models.OptimizersConfigDiff
+]:
 
     optimizers_config = models.OptimizersConfigDiff(
         indexing_threshold=indexing_threshold
@@ -52,23 +118,72 @@ def get_default_single_vector_config(
     vectors_config = models.VectorParams(
         size=vector_size,
         distance=models.Distance.COSINE,
+        on_disk=quantization.on_disk or None,
     )
-    quantization_config = models.ScalarQuantization(
-        scalar=models.ScalarQuantizationConfig(
-            type=models.ScalarType.INT8,
-            quantile=0.99,
-            always_ram=True,
-        ),
-    )
+    quantization_config = get_quantization_config(quantization)
     return vectors_config, quantization_config, optimizers_config
 
 
+def get_default_prefetch_vector_params(vector_size: int) -> models.VectorParams:
+    vectors_config, _, _ = get_default_single_vector_config(vector_size)
+    return vectors_config
+
+
 class QdrantSettings(pydantic.BaseModel):
     collection_name: str = "mauboussinTwin"
     on_disk_payload: bool = True
     optimizers_config: models.OptimizersConfigDiff
     vector_params: models.VectorParams
-    scalar_params: models.ScalarQuantization
+    quantization_config: models.QuantizationConfig | None = None
+    pool_factor: int = 1
+    pooling_method: Literal["hierarchical", "sequential"] = "hierarchical"
+    prefetch_vector_params: models.VectorParams | None = None
+    prefetch_limit: int = 100
+    # Query time only: HNSW beam width, exact (full scan) search, and whether
+    # candidates found with quantized vectors are rescored with the original
+    # vectors, fetching `oversampling` times as many candidates first.
+    hnsw_ef: int | None = None
+    exact: bool = False
+    rescore: bool = True
+    oversampling: float | None = None
+
+    @property
+    def vectors_config(self) -> models.VectorParams | dict[str, models.VectorParams]:
+        if self.prefetch_vector_params is None:
+            return self.vector_params
+        return {
+            MULTI_VECTOR_NAME: self.vector_params,
+            PREFETCH_VECTOR_NAME: self.prefetch_vector_params,
+        }
+
+    def embedding_settings_hash(self) -> str:
+        # Only settings that change the vectors computed for a document.
+        embedding_settings = self.model_dump_json(
+            include={"pool_factor", "pooling_method"}
+        ) + str(self.prefetch_vector_params is not None)
+        return hashlib.sha256(embedding_settings.encode()).hexdigest()[:16]
+
+    def index_settings_hash(self) -> str:
+        # Only settings that change what is written to the collection.
+        index_settings = self.model_dump_json(exclude=QUERY_SETTINGS)
+        return hashlib.sha256(index_settings.encode()).hexdigest()[:16]
+
+    @property
+    def search_params(self) -> models.SearchParams | None:
+        quantization = None
+        if self.quantization_config is not None:
+            quantization = models.QuantizationSearchParams(
+                rescore=self.rescore, oversampling=self.oversampling
+            )
+        if self.hnsw_ef is None and not self.exact and quantization is None:
+            return None
+        return models.SearchParams(
+            hnsw_ef=self.hnsw_ef, exact=self.exact, quantization=quantization
+        )
+
+    @property
+    def multi_vector_name(self) -> str | None:
+        return None if self.prefetch_vector_params is None else MULTI_VECTOR_NAME
 
 
 class DBSettings(pydantic_settings.BaseSettings):
@@ -80,13 +195,45 @@ class DBSettings(pydantic_settings.BaseSettings):
     TEXT_EMBEDDING_MODEL_PARAMS: TextEmbeddingModel | None = None
 
     RAG_MODEL_DEVICE: str = f"cuda:{os.environ.get('CUDA_VISIBLE_DEVICES', '0')}"
+    RASTERIZE_WORKERS: int = int(
+        os.environ.get("RASTERIZE_WORKERS", str(os.cpu_count() or 1))
+    )
+    MAX_ENCODE_BATCH_SIZE: int = 64
+    ENCODE_MEMORY_LIMIT: float = 0.8
+    # Pages are rendered at RENDER_DPI, or by default at RENDER_OVERSAMPLING
+    # times the DPI that fills the model processor's input resolution, at
+    # most RENDER_MAX_DPI. Full page images are stored as PREVIEW_FORMAT.
+    RENDER_DPI: int | None = None
+    RENDER_OVERSAMPLING: float = 2.0
+    RENDER_MAX_DPI: int = 200
+    PREVIEW_FORMAT: Literal["PNG", "JPEG", "WEBP"] = "PNG"
+    PREVIEW_QUALITY: int = 85
+    # Pages with less ink than this are not indexed, and pages within this
+    # many perceptual hash bits of an indexed page, confirmed by the detail
+    # hash, share its point. None turns either check off.
+    BLANK_PAGE_MAX_INK_COVERAGE: float | None = 0.001
+    DUPLICATE_PAGE_MAX_DISTANCE: int | None = 6
 
     USE_QDRANT_CLOUD: bool = False
     QDRANT_DATABASE_PATH: str = os.getcwd() + "/mj-db"
+    IMAGE_STORE_PATH: str = os.getcwd() + "/mj-images"
+    INDEX_MANIFEST_PATH: str = os.getcwd() + "/mj-index-manifest.sqlite"
+    EMBEDDING_STORE_PATH: str = os.getcwd() + "/mj-embeddings"
+    INDEX_CHECKPOINT_PATH: str = os.getcwd() + "/mj-index-checkpoint.json"
+    SNAPSHOT_PATH: str = os.getcwd() + "/mj-snapshots"
+
+    QUERY_CACHE_SIZE: int = 1024
+    QUERY_CACHE_TTL: float | None = None
+    RESULT_CACHE_SIZE: int = 1024
+    RESULT_CACHE_TTL: float | None = 300.0
     QDRANT_DATABASE_HOST: str = os.environ.get("QDRANT_DATABASE_HOST", "localhost")
     QDRANT_DATABASE_PORT: int = int(os.environ.get("QDRANT_DATABASE_PORT", "6333"))
     QDRANT_CLOUD_URL: str = os.environ.get("QDRANT_CLOUD_URL", "http://localhost:6333")
     QDRANT_APIKEY: str | None = os.environ.get("QDRANT_APIKEY")
+    QDRANT_CONNECTION_POOL_SIZE: int = 16
+    # Upserts in flight during a bulk load, which does not wait for them to
+    # be applied.
+    BULK_UPLOAD_PARALLEL: int = 4
 
     @pydantic.model_validator(mode="after")
     def validate_embedding_models(cls, values):
@@ -102,3 +249,32 @@ class DBSettings(pydantic_settings.BaseSettings):
             )
 
         return values
+
+    @property
+    def is_local_qdrant(self) -> bool:
+        return "localhost" in self.QDRANT_CLOUD_URL
+
+    @property
+    def embedding_model_params(self) -> VisionEmbeddingModel | TextEmbeddingModel:
+        model_params = (
+            self.VISION_EMBEDDING_MODEL_PARAMS or self.TEXT_EMBEDDING_MODEL_PARAMS
+        )
+        if model_params is None:
+            raise ValueError("Either vision or text embedding model must be specified")
+        return model_params
+
+
+def get_qdrant_client(db_settings: DBSettings) -> qdrant_client.QdrantClient:
+    if db_settings.is_local_qdrant:
+        return qdrant_client.QdrantClient(path=db_settings.QDRANT_DATABASE_PATH)
+    # Keep connections alive between requests; qdrant_client disables
+    # keep-alive for localhost by default.
+    return qdrant_client.QdrantClient(
+        url=db_settings.QDRANT_CLOUD_URL,
+        port=db_settings.QDRANT_DATABASE_PORT,
+        api_key=db_settings.QDRANT_APIKEY,
+        limits=httpx.Limits(
+            max_connections=db_settings.QDRANT_CONNECTION_POOL_SIZE,
+            max_keepalive_connections=db_settings.QDRANT_CONNECTION_POOL_SIZE,
+        ),
+    )
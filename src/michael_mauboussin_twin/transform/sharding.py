@@ -0,0 +1,406 @@
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import pathlib
+import queue
+import tempfile
+import time
+from typing import Any, Callable, NamedTuple, Sequence
+
+import loguru
+import numpy as np
+import torch
+import tqdm
+
+from michael_mauboussin_twin.feature.extract import datamodels as extract_datamodels
+from michael_mauboussin_twin.transform import (
+    base,
+    batching,
+    datamodels,
+    embedding_store,
+    manifest,
+    settings,
+)
+
+logger = loguru.logger
+
+# Loads a model replica for the settings a worker process is given. Must be
+# picklable, such as a module level function or a partial of one.
+StoreFactory = Callable[[settings.DBSettings], base.VectorStore]
+
+
+class ShardsFailed(Exception):
+    pass
+
+
+class Shard(NamedTuple):
+    number: int
+    key: str
+    documents: list[tuple[extract_datamodels.ExtractData, str]]
+
+
+class EncodedBatch(NamedTuple):
+    """(point id, payload, vectors by name) of a batch of a shard, the
+    content keys of the vectors that are not in the embedding store yet and
+    the manifest records of the pages rendered since the last message."""
+
+    shard: int
+    batch: int
+    points: list[tuple[str, dict, dict[str, np.ndarray]]]
+    new_keys: list[str]
+    page_records: list[manifest.PageRecords]
+
+
+class ShardDone(NamedTuple):
+    shard: int
+    worker: int
+    page_records: list[manifest.PageRecords]
+    error: str | None = None
+
+
+def make_shards(
+    documents: list[tuple[extract_datamodels.ExtractData, str]], shard_size: int
+) -> list[Shard]:
+    """Split documents into shards of `shard_size` consecutive documents,
+    keyed by the content hashes of their PDFs."""
+    return [
+        Shard(
+            number,
+            hashlib.sha256(
+                ",".join(pdf_hash for _, pdf_hash in chunk).encode()
+            ).hexdigest()[:16],
+            chunk,
+        )
+        for number, chunk in enumerate(
+            documents[i : i + shard_size] for i in range(0, len(documents), shard_size)
+        )
+    ]
+
+
+class ShardCheckpoint:
+    """JSON record of the upserted batches and complete shards of a run,
+    rewritten atomically after every batch. A checkpoint of another model,
+    collection, index settings or shard size is discarded."""
+
+    def __init__(self, path: str | pathlib.Path, run_key: str) -> None:
+        self.path = pathlib.Path(path)
+        self.run_key = run_key
+        self.shards: dict[str, dict[str, Any]] = {}
+        if self.path.exists():
+            state = json.loads(self.path.read_text())
+            if state.get("run") == run_key:
+                self.shards = state["shards"]
+            else:
+                logger.info(f"Checkpoint {self.path} is of another run, starting over")
+
+    def is_complete(self, shard_key: str) -> bool:
+        return self.shards.get(shard_key, {}).get("complete", False)
+
+    def record_batch(self, shard_key: str, num_points: int) -> None:
+        shard = self._shard(shard_key)
+        shard["batches"] += 1
+        shard["points"] += num_points
+        self.save()
+
+    def complete(self, shard_key: str) -> None:
+        self._shard(shard_key)["complete"] = True
+        self.save()
+
+    def _shard(self, shard_key: str) -> dict[str, Any]:
+        return self.shards.setdefault(
+            shard_key, {"batches": 0, "points": 0, "complete": False}
+        )
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"run": self.run_key, "shards": self.shards}, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def worker_settings(
+    db_settings: settings.DBSettings, device: str, num_workers: int
+) -> settings.DBSettings:
+    """Settings of a worker process: its model on `device`, and its share of
+    the rasterizer processes."""
+    return db_settings.model_copy(
+        update={
+            "RAG_MODEL_DEVICE": device,
+            "RASTERIZE_WORKERS": max(1, db_settings.RASTERIZE_WORKERS // num_workers),
+        }
+    )
+
+
+def run_worker(
+    worker: int,
+    make_store: StoreFactory,
+    db_settings: settings.DBSettings,
+    num_threads: int | None,
+    tasks: multiprocessing.Queue,
+    results: multiprocessing.Queue,
+    batch_size: int,
+    auto_batch_size: bool,
+    stream_kwargs: dict[str, Any],
+) -> None:
+    """Entry point of a worker process: load a model replica and encode the
+    shards taken from `tasks` until it takes None."""
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    store = make_store(db_settings)
+    store.deferred_page_records = []
+    logger.info(f"Worker {worker} loaded the model on {db_settings.RAG_MODEL_DEVICE}")
+    asyncio.run(
+        encode_shards(
+            worker,
+            store,
+            tasks,
+            results,
+            batch_size,
+            auto_batch_size,
+            stream_kwargs,
+        )
+    )
+
+
+async def encode_shards(
+    worker: int,
+    store: base.VectorStore,
+    tasks: multiprocessing.Queue,
+    results: multiprocessing.Queue,
+    batch_size: int,
+    auto_batch_size: bool,
+    stream_kwargs: dict[str, Any],
+) -> None:
+    sizer = batching.BatchSizer(
+        batch_size,
+        store.model.device,
+        auto=auto_batch_size,
+        max_batch_size=store.db_settings.MAX_ENCODE_BATCH_SIZE,
+        memory_limit=store.db_settings.ENCODE_MEMORY_LIMIT,
+    )
+    while (shard := await asyncio.to_thread(tasks.get)) is not None:
+        logger.info(
+            f"Worker {worker} encoding shard {shard.number}"
+            f" of {len(shard.documents)} documents"
+        )
+        batch_index = 0
+        try:
+            async for batch in base.iter_batches(
+                store.stream_documents(shard.documents, **stream_kwargs), sizer
+            ):
+                batch_start = time.perf_counter()
+                vectors, new_vectors = await asyncio.to_thread(
+                    store.load_or_encode_vectors, batch, sizer
+                )
+                sizer.record(len(batch), time.perf_counter() - batch_start)
+                await asyncio.to_thread(
+                    results.put,
+                    EncodedBatch(
+                        shard.number,
+                        batch_index,
+                        [
+                            (
+                                str(doc.id),
+                                doc.metadata.model_dump(),
+                                base.to_stored_vectors(vector),
+                            )
+                            for doc, vector in zip(batch, vectors, strict=True)
+                        ],
+                        [key for key, _ in new_vectors],
+                        take_page_records(store),
+                    ),
+                )
+                batch_index += 1
+        except Exception as e:
+            logger.exception(f"Worker {worker} failed on shard {shard.number}")
+            await asyncio.to_thread(
+                results.put,
+                ShardDone(shard.number, worker, take_page_records(store), repr(e)),
+            )
+        else:
+            await asyncio.to_thread(
+                results.put, ShardDone(shard.number, worker, take_page_records(store))
+            )
+
+
+def take_page_records(store: base.VectorStore) -> list[manifest.PageRecords]:
+    records, store.deferred_page_records = store.deferred_page_records or [], []
+    return records
+
+
+def record_pages(
+    store: base.VectorStore, page_records: list[manifest.PageRecords]
+) -> None:
+    for records in page_records:
+        store.record_pages(records)
+
+
+def next_message(
+    results: multiprocessing.Queue,
+    processes: Sequence[multiprocessing.process.BaseProcess],
+) -> EncodedBatch | ShardDone | None:
+    """The next message of the workers, or None once they all exited."""
+    while True:
+        try:
+            return results.get(timeout=1.0)
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes):
+                try:
+                    return results.get_nowait()
+                except queue.Empty:
+                    return None
+
+
+async def index_sharded(
+    store: base.VectorStore,
+    extraction_metadata_file: pathlib.Path,
+    make_store: StoreFactory,
+    num_workers: int,
+    devices: list[str] | None = None,
+    num_threads: int | None = None,
+    shard_size: int = 16,
+    batch_size: int = 10,
+    auto_batch_size: bool = False,
+    checkpoint_path: str | pathlib.Path | None = None,
+    stream_kwargs: dict[str, Any] | None = None,
+) -> datamodels.UpsertReport:
+    """Encode shards of `shard_size` PDFs in `num_workers` processes, worker
+    `i` on `devices[i % len(devices)]`, and write the results through
+    `store`, the coordinator. Raises `ShardsFailed` once the other shards are
+    upserted if any shard failed."""
+    db_settings = store.db_settings
+    devices = devices or [db_settings.RAG_MODEL_DEVICE]
+    if num_threads is None and all(device == "cpu" for device in devices):
+        num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+    documents, _ = await store.hash_documents(extraction_metadata_file)
+    shards = make_shards(documents, shard_size)
+    checkpoint = ShardCheckpoint(
+        checkpoint_path or db_settings.INDEX_CHECKPOINT_PATH,
+        ":".join(
+            [
+                store.model_name,
+                store.qdrant_settings.collection_name,
+                store.qdrant_settings.index_settings_hash(),
+                str(shard_size),
+            ]
+        ),
+    )
+    pending = {
+        shard.number: shard for shard in shards if not checkpoint.is_complete(shard.key)
+    }
+    logger.info(
+        f"Indexing {len(pending)} of {len(shards)} shards"
+        f" with {num_workers} workers on {', '.join(devices)}"
+    )
+    report = datamodels.UpsertReport()
+    if not pending:
+        return report
+
+    # CUDA cannot be used in forked processes.
+    context = multiprocessing.get_context("spawn")
+    tasks = context.Queue()
+    results = context.Queue(maxsize=2 * num_workers)
+    for shard in pending.values():
+        tasks.put(shard)
+    for _ in range(num_workers):
+        tasks.put(None)
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(
+                worker,
+                make_store,
+                worker_settings(
+                    db_settings, devices[worker % len(devices)], num_workers
+                ),
+                num_threads,
+                tasks,
+                results,
+                batch_size,
+                auto_batch_size,
+                stream_kwargs or {},
+            ),
+        )
+        for worker in range(min(num_workers, len(pending)))
+    ]
+    # Workers are not daemonic so that they can start rasterizer processes,
+    # which leaves stopping them to the finally block.
+    for process in processes:
+        process.start()
+
+    config = store.qdrant_settings.embedding_settings_hash()
+    failed_shards: set[int] = set()
+    error_shards: list[int] = []
+    start = 0
+    run_start = time.perf_counter()
+    try:
+        with tqdm.tqdm(desc="Indexing Progress", unit="page") as pbar:
+            while pending:
+                message = await asyncio.to_thread(next_message, results, processes)
+                if message is None:
+                    logger.error(f"Workers exited with {len(pending)} shards left")
+                    error_shards.extend(pending)
+                    break
+                if isinstance(message, ShardDone):
+                    record_pages(store, message.page_records)
+                    shard = pending.pop(message.shard)
+                    if message.error is not None:
+                        logger.error(
+                            f"Shard {shard.number} failed in worker {message.worker}:"
+                            f" {message.error}"
+                        )
+                        error_shards.append(shard.number)
+                    elif message.shard not in failed_shards:
+                        checkpoint.complete(shard.key)
+                    continue
+                new_keys = set(message.new_keys)
+                store.embedding_store.put_many(
+                    [
+                        (key, vectors)
+                        for _, payload, vectors in message.points
+                        if (
+                            key := embedding_store.content_key(
+                                payload.get("image_key"), payload.get("text")
+                            )
+                        )
+                        in new_keys
+                    ],
+                    store.model_name,
+                    config,
+                )
+                num_failed = len(report.failed_points)
+                await store.upsert_stored_points(message.points, start, report)
+                record_pages(store, message.page_records)
+                if len(report.failed_points) > num_failed:
+                    failed_shards.add(message.shard)
+                else:
+                    checkpoint.record_batch(
+                        pending[message.shard].key, len(message.points)
+                    )
+                start += len(message.points)
+                pbar.update(len(message.points))
+    finally:
+        for process in processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+    logger.info(
+        f"Indexed {start} pages at {start / (time.perf_counter() - run_start):.2f}"
+        f" pages/s with {len(processes)} workers"
+    )
+    if report.failed_ids:
+        logger.error(f"{len(report.failed_ids)} of {start} points failed to upsert")
+    if error_shards:
+        raise ShardsFailed(
+            f"{len(error_shards)} of {len(shards)} shards failed:"
+            f" {sorted(error_shards)}; run again to resume from the checkpoint"
+        )
+    return report
@@ -0,0 +1,193 @@
+import json
+import os
+import pathlib
+import sqlite3
+import tarfile
+import tempfile
+import time
+from typing import Iterable
+
+import httpx
+import loguru
+
+from michael_mauboussin_twin.transform import settings
+
+logger = loguru.logger
+
+# Local mode snapshots copy the storage layout of qdrant-client 1.12, which
+# pyproject.toml pins: a meta.json of collection configs and a SQLite file
+# per collection.
+LOCAL_META_FILE = "meta.json"
+LOCAL_STORAGE_FILE = "storage.sqlite"
+LOCAL_SNAPSHOT_SUFFIX = ".tar.gz"
+
+
+def create_snapshot(
+    db_settings: settings.DBSettings,
+    collection_name: str,
+    output_dir: str | pathlib.Path | None = None,
+) -> pathlib.Path:
+    """Snapshot a collection into `output_dir` (defaults to `SNAPSHOT_PATH`)
+    and return the snapshot file. Local mode collections are archived as
+    stored."""
+    output_dir = pathlib.Path(output_dir or db_settings.SNAPSHOT_PATH)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if db_settings.is_local_qdrant:
+        path = _create_local_snapshot(db_settings, collection_name, output_dir)
+    else:
+        path = _create_server_snapshot(db_settings, collection_name, output_dir)
+    logger.info(
+        f"Snapshot of {collection_name} written to {path}"
+        f" ({path.stat().st_size / 2**20:.1f} MiB)"
+    )
+    return path
+
+
+def restore_snapshot(
+    db_settings: settings.DBSettings,
+    collection_name: str,
+    snapshot_path: str | pathlib.Path,
+) -> None:
+    """Replace `collection_name` with the collection in a snapshot made by
+    `create_snapshot`. Nothing else may have a local mode path open."""
+    snapshot_path = pathlib.Path(snapshot_path)
+    if db_settings.is_local_qdrant:
+        _restore_local_snapshot(db_settings, collection_name, snapshot_path)
+    else:
+        _restore_server_snapshot(db_settings, collection_name, snapshot_path)
+    logger.info(f"Restored {collection_name} from {snapshot_path}")
+
+
+def server_url(db_settings: settings.DBSettings) -> httpx.URL:
+    url = httpx.URL(db_settings.QDRANT_CLOUD_URL)
+    if url.port is None:
+        url = url.copy_with(port=db_settings.QDRANT_DATABASE_PORT)
+    return url
+
+
+def _server_client(db_settings: settings.DBSettings) -> httpx.Client:
+    return httpx.Client(
+        base_url=server_url(db_settings),
+        headers=(
+            {"api-key": db_settings.QDRANT_APIKEY} if db_settings.QDRANT_APIKEY else {}
+        ),
+        timeout=httpx.Timeout(60.0, read=None),
+    )
+
+
+def _create_server_snapshot(
+    db_settings: settings.DBSettings, collection_name: str, output_dir: pathlib.Path
+) -> pathlib.Path:
+    client = settings.get_qdrant_client(db_settings)
+    try:
+        snapshot = client.create_snapshot(collection_name, wait=True)
+    finally:
+        client.close()
+    if snapshot is None:
+        raise RuntimeError(f"Qdrant did not create a snapshot of {collection_name}")
+    path = output_dir / snapshot.name
+    with _server_client(db_settings) as http:
+        with http.stream(
+            "GET", f"/collections/{collection_name}/snapshots/{snapshot.name}"
+        ) as response:
+            response.raise_for_status()
+            _write_atomic(path, response.iter_bytes())
+    return path
+
+
+def _restore_server_snapshot(
+    db_settings: settings.DBSettings,
+    collection_name: str,
+    snapshot_path: pathlib.Path,
+) -> None:
+    with _server_client(db_settings) as http, open(snapshot_path, "rb") as f:
+        response = http.post(
+            f"/collections/{collection_name}/snapshots/upload",
+            params={"priority": "snapshot", "wait": "true"},
+            files={"snapshot": (snapshot_path.name, f)},
+        )
+        response.raise_for_status()
+
+
+def _create_local_snapshot(
+    db_settings: settings.DBSettings, collection_name: str, output_dir: pathlib.Path
+) -> pathlib.Path:
+    root = pathlib.Path(db_settings.QDRANT_DATABASE_PATH)
+    meta = json.loads((root / LOCAL_META_FILE).read_text())
+    if collection_name not in meta["collections"]:
+        raise ValueError(f"Collection {collection_name} does not exist in {root}")
+    path = output_dir / (
+        f"{collection_name}-{time.strftime('%Y-%m-%d-%H-%M-%S')}"
+        + LOCAL_SNAPSHOT_SUFFIX
+    )
+    with tempfile.TemporaryDirectory(dir=output_dir) as tmp_dir:
+        storage = pathlib.Path(tmp_dir) / LOCAL_STORAGE_FILE
+        # The backup API copies a consistent state even while the collection
+        # is open in another process.
+        source = sqlite3.connect(root / "collection" / collection_name / storage.name)
+        target = sqlite3.connect(storage)
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
+        config = pathlib.Path(tmp_dir) / LOCAL_META_FILE
+        config.write_text(json.dumps(meta["collections"][collection_name]))
+        archive = pathlib.Path(tmp_dir) / path.name
+        # Vectors compress poorly: the fastest level is about 30x faster than
+        # the default for archives a quarter larger.
+        with tarfile.open(archive, "w:gz", compresslevel=1) as tar:
+            tar.add(config, LOCAL_META_FILE)
+            tar.add(storage, LOCAL_STORAGE_FILE)
+        os.replace(archive, path)
+    return path
+
+
+def _restore_local_snapshot(
+    db_settings: settings.DBSettings,
+    collection_name: str,
+    snapshot_path: pathlib.Path,
+) -> None:
+    with tarfile.open(snapshot_path, "r:gz") as tar:
+        names = set(tar.getnames())
+        if names != {LOCAL_META_FILE, LOCAL_STORAGE_FILE}:
+            raise ValueError(
+                f"{snapshot_path} is not a local mode snapshot; server snapshots"
+                " can only be restored to a Qdrant server"
+            )
+        meta_file = tar.extractfile(LOCAL_META_FILE)
+        assert meta_file is not None
+        config = json.load(meta_file)
+        root = pathlib.Path(db_settings.QDRANT_DATABASE_PATH)
+        # Holding a client locks the path against other local mode clients.
+        client = settings.get_qdrant_client(db_settings)
+        try:
+            collection_dir = root / "collection" / collection_name
+            collection_dir.mkdir(parents=True, exist_ok=True)
+            with tempfile.TemporaryDirectory(dir=collection_dir) as tmp_dir:
+                # The extraction filter is new in Python 3.11.4.
+                if hasattr(tarfile, "data_filter"):
+                    tar.extract(LOCAL_STORAGE_FILE, tmp_dir, filter="data")
+                else:
+                    tar.extract(LOCAL_STORAGE_FILE, tmp_dir)
+                os.replace(
+                    pathlib.Path(tmp_dir) / LOCAL_STORAGE_FILE,
+                    collection_dir / LOCAL_STORAGE_FILE,
+                )
+            meta = json.loads((root / LOCAL_META_FILE).read_text())
+            meta["collections"][collection_name] = config
+            _write_atomic(root / LOCAL_META_FILE, [json.dumps(meta).encode()])
+        finally:
+            client.close()
+
+
+def _write_atomic(path: pathlib.Path, chunks: Iterable[bytes]) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -1,23 +1,176 @@
+import asyncio
+import pathlib
+from typing import TYPE_CHECKING, AsyncIterator
+
+import pypdfium2
 import torch
-import sentence_transformers
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from qdrant_client.http import models
 
+from michael_mauboussin_twin import metrics
 from michael_mauboussin_twin.transform import base, settings, datamodels
+from michael_mauboussin_twin.feature.extract import datamodels as extract_datamodels
+
+if TYPE_CHECKING:
+    import sentence_transformers
 
 CHUNK_SIZE = 100
 CHUNK_OVERLAP = 25
 
 
-class TextVectorDB(base.VectorDB):
+def extract_text(pdf_path: pathlib.Path) -> list[str]:
+    pdf = pypdfium2.PdfDocument(pdf_path)
+    try:
+        return [page.get_textpage().get_text_range() for page in pdf]
+    finally:
+        pdf.close()
+
+
+class TextVectorDB(base.VectorStore):
     def __init__(
         self,
-        model: sentence_transformers.SentenceTransformer,
+        model: "sentence_transformers.SentenceTransformer | None",
         db_settings: settings.DBSettings,
         qdrant_settings: settings.QdrantSettings,
+        processor: None = None,
+        connect: bool = True,
     ) -> None:
-        super().__init__(db_settings, qdrant_settings)
-        self.model = model
+        super().__init__(model, db_settings, qdrant_settings, connect=connect)
+        self.text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+        )
 
-    def encode_docs(
+    @property
+    def query_prompt_name(self) -> str | None:
+        model_params = self.db_settings.TEXT_EMBEDDING_MODEL_PARAMS
+        if model_params is None:
+            raise ValueError("TextVectorDB needs TEXT_EMBEDDING_MODEL_PARAMS")
+        prompt_name = model_params.query_prompt_name
+        return prompt_name if prompt_name in self.model.prompts else None
+
+    def encode_docs(self, docs: list[datamodels.DocumentToVectorDB]) -> torch.Tensor:
+        return self.model.encode(
+            [doc.doc for doc in docs],
+            batch_size=len(docs),
+            convert_to_tensor=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+
+    async def stream_from_pdfs(
+        self,
+        extraction_metadata_file: pathlib.Path,
+        max_pages_in_flight: int = 8,
+        num_workers: int | None = None,
+        incremental: bool = True,
+        added_since: float | None = None,
+        *,
+        sort_window: int = 512,
+    ) -> AsyncIterator[list[datamodels.DocumentToVectorDB]]:
+        """Yield text chunks in windows of about `sort_window` chunks sorted
+        by token count, to cut padding. `max_pages_in_flight` and
+        `num_workers` are ignored since nothing is rendered."""
+        documents, _ = await self.hash_documents(extraction_metadata_file, added_since)
+        async for docs in self.stream_documents(
+            documents, incremental=incremental, sort_window=sort_window
+        ):
+            yield docs
+
+    async def stream_documents(
+        self,
+        documents: list[tuple[extract_datamodels.ExtractData, str]],
+        max_pages_in_flight: int = 8,
+        num_workers: int | None = None,
+        incremental: bool = True,
+        *,
+        sort_window: int = 512,
+    ) -> AsyncIterator[list[datamodels.DocumentToVectorDB]]:
+        """`stream_from_pdfs` for (metadata, content hash) of documents
+        already hashed by `hash_documents`."""
+        settings_hash = self.qdrant_settings.index_settings_hash()
+        window: list[datamodels.DocumentToVectorDB] = []
+        for ed, pdf_hash in documents:
+            # A page's chunks can land in different batches, so chunks are
+            # skipped one by one rather than by page.
+            indexed_ids = (
+                self.manifest.indexed_point_ids(
+                    pdf_hash, self.model_name, settings_hash
+                )
+                if incremental
+                else set()
+            )
+            pages = await asyncio.to_thread(extract_text, pathlib.Path(ed.pdf_path))
+            for page_number, text in enumerate(pages, start=1):
+                for chunk_index, chunk in enumerate(
+                    self.text_splitter.split_text(text)
+                ):
+                    point_id = datamodels.point_id(pdf_hash, page_number, chunk_index)
+                    if str(point_id) in indexed_ids:
+                        continue
+                    window.append(
+                        datamodels.DocumentToVectorDB(
+                            id=point_id,
+                            doc=chunk,
+                            metadata=datamodels.Metadata(
+                                **base.document_metadata(ed),
+                                pdf_hash=pdf_hash,
+                                page_number=page_number,
+                                text=chunk,
+                            ),
+                        )
+                    )
+            if len(window) >= sort_window:
+                yield self.sort_by_length(window)
+                window = []
+        if window:
+            yield self.sort_by_length(window)
+
+    def sort_by_length(
         self, docs: list[datamodels.DocumentToVectorDB]
+    ) -> list[datamodels.DocumentToVectorDB]:
+        token_ids = self.model.tokenizer([doc.doc for doc in docs])["input_ids"]
+        return [
+            doc
+            for _, doc in sorted(
+                zip(map(len, token_ids), docs, strict=True), key=lambda item: item[0]
+            )
+        ]
+
+    def _encode_queries(
+        self, queries: list[str], batch_size: int
     ) -> list[torch.Tensor]:
-        raise NotImplementedError
+        return list(
+            self.model.encode(
+                queries,
+                batch_size=batch_size,
+                prompt_name=self.query_prompt_name,
+                convert_to_tensor=True,
+                normalize_embeddings=True,
+                show_progress_bar=False,
+            ).cpu()
+        )
+
+    @metrics.timed("query.search")
+    def search_batch(
+        self,
+        query_embs: list[torch.Tensor],
+        k: int = 5,
+        filters: datamodels.SearchFilters | None = None,
+    ) -> list[list[models.ScoredPoint]]:
+        if not query_embs:
+            return []
+        query_filter = filters.to_filter() if filters is not None else None
+        responses = self.qdrant_client.query_batch_points(
+            collection_name=self.qdrant_settings.collection_name,
+            requests=[
+                models.QueryRequest(
+                    query=query_emb.float().numpy().tolist(),
+                    filter=query_filter,
+                    limit=k,
+                    params=self.qdrant_settings.search_params,
+                    with_payload=True,
+                )
+                for query_emb in query_embs
+            ],
+        )
+        return [response.points for response in responses]
@@ -1,45 +1,138 @@
-from michael_mauboussin_twin.transform import base, settings, datamodels
+from michael_mauboussin_twin import metrics
+from michael_mauboussin_twin.transform import (
+    base,
+    settings,
+    datamodels,
+    pooling,
+)
+from typing import TYPE_CHECKING
 import torch
-from colpali_engine import models as colpali_model
+from qdrant_client.http import models
+
+if TYPE_CHECKING:
+    from colpali_engine import models as colpali_model
 
 
 class VisionVectorStore(base.VectorStore):
     def __init__(
         self,
-        model: colpali_model.ColQwen2,
-        processor: colpali_model.ColQwen2Processor,
+        model: "colpali_model.ColQwen2 | None",
+        processor: "colpali_model.ColQwen2Processor | None",
         db_settings: settings.DBSettings,
         qdrant_settings: settings.QdrantSettings,
+        connect: bool = True,
     ) -> None:
-        super().__init__(model, db_settings, qdrant_settings, processor)
+        super().__init__(
+            model, db_settings, qdrant_settings, processor, connect=connect
+        )
 
-    def encode_docs(
-        self, docs: list[datamodels.DocumentToVectorDB]
-    ) -> list[torch.Tensor]:
+    def encode_docs(self, docs: list[datamodels.DocumentToVectorDB]) -> torch.Tensor:
         images = [doc.doc for doc in docs]
         batch_images = self.processor.process_images(images).to(self.model.device)
         with torch.no_grad():
             image_embeddings = self.model(**batch_images)
         return image_embeddings
 
-    def query_db(self, query: str, k: int = 5) -> list[datamodels.QueryResult]:
+    def postprocess_embeddings(
+        self, vector_emb: torch.Tensor
+    ) -> torch.Tensor | list[torch.Tensor] | list[dict[str, torch.Tensor]]:
+        multivectors = vector_emb
+        if self.qdrant_settings.pool_factor > 1:
+            multivectors = pooling.pool_embeddings(
+                vector_emb,
+                self.qdrant_settings.pool_factor,
+                self.qdrant_settings.pooling_method,
+            )
+        if self.qdrant_settings.prefetch_vector_params is None:
+            return multivectors
+        return [
+            {
+                settings.MULTI_VECTOR_NAME: multivector,
+                settings.PREFETCH_VECTOR_NAME: pooling.mean_pool(embedding),
+            }
+            for multivector, embedding in zip(multivectors, vector_emb, strict=True)
+        ]
+
+    def encode_queries(self, queries: list[str]) -> torch.Tensor:
         with torch.no_grad():
-            processed_query = self.processor.process_queries([query]).to(
+            processed_queries = self.processor.process_queries(queries).to(
                 self.model.device
             )
-            query_emb = self.model(**processed_query)
-        multivector_query = query_emb[0].cpu().float().numpy().tolist()
+            return self.model(**processed_queries)
 
-        results = self.qdrant_client.search(
-            collection_name=self.qdrant_settings.collection_name,
-            query_vector=multivector_query,
+    def _encode_queries(
+        self, queries: list[str], batch_size: int
+    ) -> list[torch.Tensor]:
+        query_embs: list[torch.Tensor] = []
+        for i in range(0, len(queries), batch_size):
+            query_embs.extend(
+                pooling.strip_padding(query_emb).cpu()
+                for query_emb in self.encode_queries(queries[i : i + batch_size])
+            )
+        return query_embs
+
+    def query_request(
+        self,
+        query_emb: torch.Tensor,
+        k: int = 5,
+        two_stage: bool | None = None,
+        prefetch_limit: int | None = None,
+        filters: datamodels.SearchFilters | None = None,
+    ) -> models.QueryRequest:
+        """MaxSim query for one query multivector, reranking the top
+        `prefetch_limit` mean-pooled candidates if a prefetch vector is
+        configured. `filters` apply to both stages."""
+        if two_stage is None:
+            two_stage = self.qdrant_settings.prefetch_vector_params is not None
+        elif two_stage and self.qdrant_settings.prefetch_vector_params is None:
+            raise ValueError("Two-stage search needs prefetch_vector_params")
+        query_emb = pooling.strip_padding(query_emb)
+        query_filter = filters.to_filter() if filters is not None else None
+        prefetch = None
+        if two_stage:
+            prefetch = models.Prefetch(
+                query=pooling.mean_pool(query_emb).cpu().numpy().tolist(),
+                using=settings.PREFETCH_VECTOR_NAME,
+                filter=query_filter,
+                limit=prefetch_limit or self.qdrant_settings.prefetch_limit,
+                params=self.qdrant_settings.search_params,
+            )
+        return models.QueryRequest(
+            query=query_emb.cpu().float().numpy().tolist(),
+            using=self.qdrant_settings.multi_vector_name,
+            prefetch=prefetch,
+            filter=query_filter,
             limit=k,
+            params=self.qdrant_settings.search_params,
+            with_payload=True,
         )
-        results = [
-            datamodels.QueryResult(
-                query=query,
-                metadata=datamodels.Metadata(**result.payload),
-            )
-            for result in results
-        ]
-        return results
+
+    @metrics.timed("query.search")
+    def search_batch(
+        self,
+        query_embs: list[torch.Tensor],
+        k: int = 5,
+        filters: datamodels.SearchFilters | None = None,
+        two_stage: bool | None = None,
+        prefetch_limit: int | None = None,
+    ) -> list[list[models.ScoredPoint]]:
+        if not query_embs:
+            return []
+        responses = self.qdrant_client.query_batch_points(
+            collection_name=self.qdrant_settings.collection_name,
+            requests=[
+                self.query_request(query_emb, k, two_stage, prefetch_limit, filters)
+                for query_emb in query_embs
+            ],
+        )
+        return [response.points for response in responses]
+
+    def search(
+        self,
+        query_emb: torch.Tensor,
+        k: int = 5,
+        two_stage: bool | None = None,
+        prefetch_limit: int | None = None,
+        filters: datamodels.SearchFilters | None = None,
+    ) -> list[models.ScoredPoint]:
+        return self.search_batch([query_emb], k, filters, two_stage, prefetch_limit)[0]